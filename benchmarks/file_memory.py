@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""Measures the memory per file and the ingest rate of the Filesystem for large listings.
+
+The old File representation (the whole response dict, an instance __dict__ and an eagerly
+parsed modifiedTime) is reproduced below as the baseline."""
+
+import sys
+import time
+import datetime
+import tracemalloc
+from os.path import join
+sys.path.insert(0, join(sys.path[0], ".."))
+
+# pylint: disable=C0413
+from gdrive_lib.drive.file import File
+from gdrive_lib.drive.filesystem import Filesystem
+
+class LegacyFile():
+    """The File before it was slotted, as the baseline."""
+    # pylint: disable=R0902,R0903
+
+    def __init__(self, base_path, data):
+        self.data = data
+        self.id = data['id']
+        self.name = data['name']
+        self.parents = data['parents']
+        self.mime_type = data['mimeType']
+        self.is_dir = self.mime_type == File.FOLDER_MIME_TYPE
+        self.is_downloadable = not self.mime_type.startswith(File.GOOGLE_APPS_MIME_PREFIX)
+        self.trashed = data.get("trashed", False)
+        self.size = int(data["size"]) if "size" in data else None
+        self.md5 = data.get("md5Checksum")
+        if "modifiedTime" in data:
+            self.modified_time = datetime.datetime.strptime(data["modifiedTime"], "%Y-%m-%dT%H:%M:%S.%fZ")
+        self.path = join(base_path, self.name)
+
+def listing(count : int, per_folder : int = 1000):
+    """Yields the raw entries of [count] files, spread over folders of [per_folder] files each (like ls_all would)."""
+
+    for i in range(count):
+        # Every entry comes from a freshly decoded response, so nothing is shared between them
+        yield "/folder%d" % (i // per_folder), {
+            "id": "1%032d" % (i),
+            "name": "file-%d.txt" % (i),
+            "parents": ["0%032d" % (i // per_folder)],
+            "mimeType": "text/plain",
+            "trashed": False,
+            "modifiedTime": "2020-01-%02dT12:00:00.000Z" % (1 + i % 28),
+            "size": str(i),
+            "md5Checksum": "%032x" % (i)
+        }
+
+def ingest(cls, count : int) -> Filesystem:
+    fs = Filesystem()
+    fs.add_files(cls(path, data) for path, data in listing(count))
+    return fs
+
+def measure(cls, count : int):
+    """Returns the bytes that stay allocated per file and the files ingested per second."""
+
+    started = time.perf_counter()
+    ingest(cls, count)
+    seconds = time.perf_counter() - started
+
+    # Tracing slows everything down, so the memory is measured in a separate run
+    tracemalloc.start()
+    fs = ingest(cls, count)
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del fs
+    return size / count, count / seconds
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for name, cls in [("before (dict + eager timestamps)", LegacyFile), ("after (slots + lazy timestamps)", File)]:
+        per_file, rate = measure(cls, count)
+        print("%-34s %7.0f bytes/file %10.0f files/s" % (name, per_file, rate))
+
+if __name__ == '__main__':
+    main()
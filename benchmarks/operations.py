@@ -0,0 +1,209 @@
+#!/usr/bin/python
+"""Measures the main Drive and Sheets operations against the in-process emulator, so that performance
+changes can be measured offline.
+
+Results can be saved with --save and compared to a saved run with --baseline, which fails if any
+benchmark got slower than the --tolerance allows."""
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+import statistics
+from os.path import join, abspath, dirname
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = abspath(join(dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+# pylint: disable=C0413
+from gdrive_lib import scheduler
+from gdrive_lib.api_utils import use_backend
+from gdrive_lib.emulator.transport import Emulator
+from gdrive_lib.emulator import trees
+from gdrive_lib.drive.drive import Drive
+from gdrive_lib.drive.drive_api import DRIVE_FULL
+from gdrive_lib.drive.transfer import format_size
+from gdrive_lib.sheets.sheets import Sheets
+from gdrive_lib.sheets.sheets_api import SHEET_FULL
+
+# Returns the seconds it took and what was processed (a count or bytes) for the rate
+Benchmark = Callable[[argparse.Namespace], Tuple[float, int]]
+
+def new_emulator(args) -> Emulator:
+    emulator = Emulator(latency=args.latency / 1000, max_page_size=args.page_size, throttle_rate=args.throttle)
+    # Every benchmark starts with a full quota
+    use_backend(emulator)
+    return emulator
+
+def timed(run : Callable[[], Any]) -> float:
+    """Returns the seconds [run] takes. Anything it prints (e.g. transfer summaries) is dropped."""
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    return time.perf_counter() - started
+
+def tree_emulator(args) -> Tuple[Emulator, int]:
+    emulator = new_emulator(args)
+    if args.shape == "deep":
+        count = trees.deep(emulator.drive, args.files // 10, 10)
+    elif args.shape == "wide":
+        count = trees.wide(emulator.drive, args.files // 100, 100)
+    else:
+        count = trees.sized(emulator.drive, args.files, args.fanout, args.fanout * 10)
+    return emulator, count
+
+def ls_all(workers : int = 1, flat : bool = False) -> Benchmark:
+    def run(args) -> Tuple[float, int]:
+        _emulator, count = tree_emulator(args)
+        drive = Drive(DRIVE_FULL)
+        return timed(lambda: drive.ls_all("/", flat=flat, max_workers=workers)), count
+    return run
+
+def resolve(args) -> Tuple[float, int]:
+    """Resolves random file paths in a cold Drive, i.e. every component needs to be looked up once."""
+
+    _emulator, _count = tree_emulator(args)
+    crawled = Drive(DRIVE_FULL)
+    crawled.ls_all("/", flat=True)
+    paths = [f.path for f in crawled.fs.files_below("/") if not f.is_dir]
+    paths = random.Random(0).sample(paths, min(len(paths), args.resolves))
+
+    drive = Drive(DRIVE_FULL)
+    return timed(lambda: [drive.resolve(path) for path in paths]), len(paths)
+
+def download(workers : int) -> Benchmark:
+    def run(args) -> Tuple[float, int]:
+        emulator = new_emulator(args)
+        size = args.size * 1024 * 1024
+        emulator.drive.add("big.bin", "root", content=os.urandom(size))
+        drive = Drive(DRIVE_FULL)
+        drive.resolve("/big.bin")
+        with tempfile.TemporaryDirectory() as local:
+            return timed(lambda: drive.download("/big.bin", join(local, "big.bin"), workers,
+                                                part_size=size // max(1, workers))), size
+    return run
+
+def upload(args) -> Tuple[float, int]:
+    new_emulator(args)
+    size = args.size * 1024 * 1024
+    with tempfile.TemporaryDirectory() as local:
+        with open(join(local, "big.bin"), "wb") as fh:
+            fh.write(os.urandom(size))
+        drive = Drive(DRIVE_FULL)
+        drive.resolve("/")
+        return timed(lambda: drive.upload(join(local, "big.bin"), "/big.bin")), size
+
+def tree_transfer(direction : str) -> Benchmark:
+    def run(args) -> Tuple[float, int]:
+        emulator = new_emulator(args)
+        folder = emulator.drive.mkdir("tree")["id"]
+        count = trees.balanced(emulator.drive, 2, 5, 10, folder, size=1024)
+        drive = Drive(DRIVE_FULL)
+        with tempfile.TemporaryDirectory() as local:
+            seconds = timed(lambda: drive.download_tree("/tree", local, workers=8))
+            if direction == "up":
+                seconds = timed(lambda: drive.upload_tree(local, "/copy", workers=8))
+        return seconds, count
+    return run
+
+def csv_round_trip(args) -> Tuple[float, int]:
+    """Uploads a CSV into a new sheet and reads it back."""
+
+    emulator = new_emulator(args)
+    file_id = emulator.sheets.create("Sheet")
+    spreadsheet = Sheets(SHEET_FULL, "credentials.json", "token.json").get_spreadsheet(file_id)
+    rows = [[str(r * 26 + c) for c in range(26)] for r in range(args.rows)]
+    with tempfile.TemporaryDirectory() as local:
+        path = join(local, "upload.csv")
+        with open(path, "w", newline="") as fh:
+            csv.writer(fh).writerows(rows)
+
+        def run():
+            spreadsheet.upload_csv(path, "Upload")
+            assert spreadsheet.get_data("Upload") == rows
+        return timed(run), len(rows) * 26
+
+BENCHMARKS : List[Tuple[str, Benchmark, str]] = [
+    ("ls_all", ls_all(), "files"),
+    ("ls_all (8 workers)", ls_all(workers=8), "files"),
+    ("ls_all (flat)", ls_all(flat=True), "files"),
+    ("resolve (cold)", resolve, "paths"),
+    ("download", download(1), "bytes"),
+    ("download (4 workers)", download(4), "bytes"),
+    ("upload (resumable)", upload, "bytes"),
+    ("download_tree (8 workers)", tree_transfer("down"), "files"),
+    ("upload_tree (8 workers)", tree_transfer("up"), "files"),
+    ("csv round trip", csv_round_trip, "cells"),
+]
+
+def rate(amount : int, unit : str, seconds : float) -> str:
+    if unit == "bytes":
+        return "%s/s" % (format_size(amount / seconds))
+    return "%.0f %s/s" % (amount / seconds, unit)
+
+def compare(results : Dict[str, float], baseline_path : str, tolerance : float) -> List[str]:
+    """Returns a line for each benchmark that got slower than the baseline allows."""
+
+    with open(baseline_path, "r", encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    regressions = []
+    for name, seconds in results.items():
+        if name in baseline and seconds > baseline[name] * (1 + tolerance):
+            regressions.append("%s: %.3fs -> %.3fs (%+.0f%%)" % (
+                name, baseline[name], seconds, 100 * (seconds / baseline[name] - 1)))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10000, help="Size of the synthetic tree (e.g. 1000000)")
+    parser.add_argument("--shape", choices=["balanced", "deep", "wide"], default="balanced")
+    parser.add_argument("--fanout", type=int, default=10, help="Folders per folder of balanced trees")
+    parser.add_argument("--resolves", type=int, default=200, help="Paths to resolve")
+    parser.add_argument("--size", type=int, default=32, help="MB per transferred file")
+    parser.add_argument("--rows", type=int, default=5000, help="Rows of the CSV round trip")
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds per request")
+    parser.add_argument("--page-size", type=int, default=1000, help="Most files per list page")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Share of requests that are throttled")
+    parser.add_argument("--unpaced", action="store_true", help="Lift the quotas of the request scheduler")
+    parser.add_argument("--runs", type=int, default=1, help="Runs per benchmark (the median is reported)")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    if args.unpaced:
+        for api in scheduler.RATE_LIMITS:
+            scheduler.RATE_LIMITS[api] = (1e9, 1000000000)
+
+    results : Dict[str, float] = {}
+    for name, benchmark, unit in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        runs = [benchmark(args) for _ in range(args.runs)]
+        seconds = statistics.median(s for s, _amount in runs)
+        results[name] = seconds
+        print("%-30s %8.3f s %20s" % (name, seconds, rate(runs[0][1], unit, seconds)))
+        sys.stdout.flush()
+    use_backend(None)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print("Regression: %s" % (line))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
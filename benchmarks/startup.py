@@ -0,0 +1,51 @@
+#!/usr/bin/python
+"""Measures the fixed startup cost of the commander, which dominates small commands run from scripts."""
+
+import sys
+import time
+import subprocess
+import statistics
+from os.path import join, abspath, dirname
+
+ROOT = abspath(join(dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+# pylint: disable=C0413
+from httplib2 import Http # type: ignore
+from googleapiclient.discovery import build, build_from_document # type: ignore
+from gdrive_lib.api_utils import discovery_document
+
+def run(args, runs : int) -> float:
+    """Returns the median wall time of running python with the given [args] in a fresh interpreter."""
+
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+def build_services(runs : int, cached : bool) -> float:
+    """Returns the median time to create a Drive and a Sheets service, like csv-download does."""
+
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        for api, version in [("drive", "v3"), ("sheets", "v4")]:
+            if cached:
+                build_from_document(discovery_document(api, version, Http()), http=Http())
+            else:
+                build(api, version, http=Http())
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print("%-40s %7.1f ms" % ("python (empty)", 1000 * run(["-c", "pass"], runs)))
+    print("%-40s %7.1f ms" % ("gdrive --help", 1000 * run(["-m", "gdrive_lib.commander", "--help"], runs)))
+    print("%-40s %7.1f ms" % ("import of the Drive client", 1000 * run(["-c", "import gdrive_lib.drive.drive"], runs)))
+    print("%-40s %7.1f ms" % ("Drive + Sheets services (build)", 1000 * build_services(runs, False)))
+    print("%-40s %7.1f ms" % ("Drive + Sheets services (cached docs)", 1000 * build_services(runs, True)))
+
+if __name__ == '__main__':
+    main()
@@ -4,19 +4,11 @@ import os
 
 from gdrive_lib.drive.drive import Drive
 
-def download_all_files_from_directory_rec(source_dir, target_dir):
+def download_all_files_from_directory_rec(source_dir, target_dir, workers=4):
     """Downloads all files in the Google Drive directory at [source_dir] (recursively)
-         into the [target_dir] on the local machine."""
+         into the [target_dir] on the local machine, mirroring the folder hierarchy."""
     drive = Drive("https://www.googleapis.com/auth/drive.readonly")
-    files = drive.ls(source_dir)
-    for file in files:
-        if not file.is_dir:
-            print("Downloading %s" % (file.name))
-            output_file = os.path.join(target_dir, file.name)
-            drive.download(file.path, output_file)
-        else:
-            new_source_dir = os.path.join(source_dir, file.name)
-            download_all_files_from_directory_rec(new_source_dir, target_dir)
+    drive.download_tree(source_dir, target_dir, workers=workers)
 
 
 def main(remote, local):
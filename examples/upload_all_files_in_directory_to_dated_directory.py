@@ -15,12 +15,7 @@ def upload_all_files_to_a_dated_directory(source_dir):
     date = datetime.datetime.today().strftime('%Y-%m-%d')
     dated_dir = os.path.join(remote_dir, date)
 
-    drive.ls(remote_dir)
-    if not drive.fs.file_exists_at_path(remote_dir):
-        drive.mkdir(remote_dir)
-
-    if not drive.fs.file_exists_at_path(dated_dir):
-        drive.mkdir(dated_dir)
+    drive.makedirs(dated_dir)
 
     # Upload the files
     for file in to_upload:
@@ -0,0 +1,125 @@
+"""Sends API requests from asyncio code, so that many concurrent requests don't need a thread each.
+
+Requests are still built with googleapiclient, only sending them is asynchronous. With aiohttp installed
+(pip install gdrive_lib[async]) they go through a pooled aiohttp session on the event loop. Otherwise they
+are sent from a small pool of threads, which is slower but behaves the same."""
+
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, Tuple
+from googleapiclient.errors import HttpError # type: ignore
+from httplib2 import Http, Response # type: ignore
+from .api_utils import authorized_http, get_backend, get_credentials
+from .scheduler import CONNECTION_ERRORS, backoff_delay, get_scheduler, is_idempotent, is_retryable, is_throttled
+from .stats import AuthTimingHttp, record_request
+
+try:
+    import aiohttp # type: ignore
+except ImportError:
+    # Optional, see the module docs
+    aiohttp = None
+
+# How many requests are in flight at most, i.e. the connections of the aiohttp pool or the threads otherwise
+DEFAULT_POOL_SIZE = 16
+
+_CONNECTION_ERRORS : Tuple = CONNECTION_ERRORS + (asyncio.TimeoutError,)
+if aiohttp is not None:
+    _CONNECTION_ERRORS += (aiohttp.ClientConnectionError,)
+
+class AsyncTransport:
+    """Sends the requests of one API and user, paced by the same scheduler as the synchronous clients,
+    so that sync and async code in one process share the quota and the concurrency limit."""
+
+    def __init__(self, api : str, scope, credentials, token, pool_size : int = DEFAULT_POOL_SIZE) -> None:
+        # pylint: disable=R0913
+        self.__scope = scope
+        self.__credentials = credentials
+        self.__token = token
+        self.__scheduler = get_scheduler(api, token)
+        self.__pool_size = pool_size
+        # Backends like the emulator are only reachable through their transports
+        self.__use_aiohttp = aiohttp is not None and get_backend() is None
+        # Also refreshes the access token for aiohttp, since oauth2client can only do that blocking
+        self.__pool = ThreadPoolExecutor(max_workers=1 if self.__use_aiohttp else pool_size)
+        self.__session : Optional[Any] = None
+        get_credentials(credentials, token, scope)
+
+    async def execute(self, request) -> Any:
+        """Sends a googleapiclient request and returns its result like request.execute() would."""
+
+        resp, content = await self.request(request.uri, request.method, request.body, request.headers)
+        if resp.status >= 300:
+            raise HttpError(resp, content, uri=request.uri)
+        return request.postproc(resp, content)
+
+    async def request(self, uri, method="GET", body=None, headers=None) -> Tuple[Any, bytes]:
+        """Like httplib2.Http.request, but retries throttled and failed requests with backoff."""
+
+        scheduler = self.__scheduler
+        idempotent = is_idempotent(uri, method, body, headers)
+        attempt = 0
+        while True:
+            await asyncio.sleep(scheduler.bucket.reserve())
+            await scheduler.concurrency.acquire_async()
+            resp, content, throttled = None, b"", False
+            started = time.perf_counter()
+            try:
+                resp, content = await self.__send(uri, method, body, dict(headers or {}))
+                throttled = is_throttled(resp, content)
+            except _CONNECTION_ERRORS:
+                if not idempotent or attempt >= scheduler.max_retries:
+                    raise
+            finally:
+                scheduler.concurrency.release(throttled)
+                record_request(uri, method, body, resp, content, started, attempt > 0)
+
+            if (resp is not None and not is_retryable(resp, content, idempotent)) or attempt >= scheduler.max_retries:
+                return resp, content
+
+            scheduler.count_retry()
+            await asyncio.sleep(backoff_delay(attempt, resp))
+            attempt += 1
+
+    async def __send(self, uri, method, body, headers) -> Tuple[Any, bytes]:
+        if not self.__use_aiohttp:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__pool, self.__send_blocking, uri, method, body, headers)
+
+        resp, content = await self.__send_aiohttp(uri, method, body, headers, False)
+        if resp.status == 401:
+            # The access token expired while the request was on its way
+            resp, content = await self.__send_aiohttp(uri, method, body, headers, True)
+        return resp, content
+
+    def __send_blocking(self, uri, method, body, headers) -> Tuple[Any, bytes]:
+        """Runs on the pool, where every thread has its own authorized transport."""
+        return authorized_http(self.__credentials, self.__token, self.__scope).request(uri, method, body, headers)
+
+    async def __send_aiohttp(self, uri, method, body, headers, refresh : bool) -> Tuple[Any, bytes]:
+        # pylint: disable=R0913
+        if self.__session is None:
+            connector = aiohttp.TCPConnector(limit=self.__pool_size)
+            self.__session = aiohttp.ClientSession(connector=connector)
+
+        headers["authorization"] = "Bearer %s" % (await self.__access_token(refresh))
+        # aiohttp sets the length of the body itself
+        headers.pop("content-length", None)
+        async with self.__session.request(method, uri, data=body, headers=headers, allow_redirects=False) as r:
+            content = await r.read()
+            info = {key.lower(): value for key, value in r.headers.items()}
+            info["status"] = str(r.status)
+            return Response(info), content
+
+    async def __access_token(self, refresh : bool) -> str:
+        creds = get_credentials(self.__credentials, self.__token, self.__scope)
+        if refresh or creds.access_token is None or creds.access_token_expired:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.__pool, creds.refresh, AuthTimingHttp(Http()))
+        return creds.access_token
+
+    async def close(self) -> None:
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+        self.__pool.shutdown(wait=False)
@@ -1,4 +1,26 @@
+import os
+import time
+import threading
+from typing import Any, Dict, Tuple
 from oauth2client import file, client, tools # type: ignore
+from googleapiclient.discovery import build_from_document, DISCOVERY_URI # type: ignore
+from googleapiclient.errors import HttpError # type: ignore
+from httplib2 import Http # type: ignore
+from .scheduler import ScheduledHttp, get_scheduler, reset_schedulers
+from .stats import AuthTimingHttp, record_auth
+
+# Discovery documents we had to fetch are kept in the user's cache directory and refreshed once a day
+DISCOVERY_MAX_AGE = 24 * 60 * 60
+
+def user_cache_dir() -> str:
+    """Returns the directory for state that has to outlive the process, like the session URIs of resumable
+    uploads (which let anyone upload to them). It's per user, and only the user may access it."""
+
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "gdrive-lib")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700)
+    return path
 
 def init_credentials(credentials, token, scope):
     store = file.Storage(token)
@@ -7,3 +29,119 @@ def init_credentials(credentials, token, scope):
         flow = client.flow_from_clientsecrets(credentials, scope)
         creds = tools.run_flow(flow, store)
     return creds
+
+_credentials : Dict[str, Any] = {}
+_documents : Dict[Tuple[str, str], str] = {}
+_lock = threading.Lock()
+_local = threading.local()
+# Serves the requests instead of Google if set, see use_backend
+_backend : Any = None
+# Changes with the backend, so that no thread keeps using transports and services of the previous one
+_generation = 0
+
+def use_backend(backend) -> None:
+    """Sends the requests of all clients that are created from now on to the [backend] instead of Google
+    (or to Google again if it's None). The backend provides credentials(), whose authorize(http) returns
+    its stand-in for httplib2.Http, e.g. gdrive_lib.emulator.transport.Emulator."""
+    # pylint: disable=W0603
+
+    global _backend, _generation
+    with _lock:
+        _backend = backend
+        _generation += 1
+        _credentials.clear()
+    # The backend has quotas of its own
+    reset_schedulers()
+
+def get_backend() -> Any:
+    return _backend
+
+def get_credentials(credentials, token, scope):
+    """Like init_credentials, but all clients that use the same [token] share one credentials object."""
+
+    key = os.path.abspath(token)
+    with _lock:
+        if key not in _credentials:
+            if _backend is not None:
+                _credentials[key] = _backend.credentials()
+            else:
+                started = time.perf_counter()
+                _credentials[key] = init_credentials(credentials, token, scope)
+                record_auth(started)
+        return _credentials[key]
+
+def authorized_http(credentials, token, scope):
+    """Returns the authorized transport of the current thread for the [token].
+
+    httplib2 is not thread-safe, so every thread gets its own, which all APIs on that thread share."""
+
+    transports = getattr(_local, "transports", None)
+    if transports is None:
+        transports = _local.transports = {}
+    key = (os.path.abspath(token), _generation)
+    if key not in transports:
+        # Token refreshes are sent through the transport that is authorized, so that's where we time them
+        transports[key] = get_credentials(credentials, token, scope).authorize(AuthTimingHttp(Http()))
+    return transports[key]
+
+def discovery_document(api : str, version : str, http) -> str:
+    """Returns the discovery document of the API, from memory, the bundled documents or the local cache
+    if possible, and only fetches it (with [http]) otherwise."""
+
+    key = (api, version)
+    with _lock:
+        if key in _documents:
+            return _documents[key]
+
+    document = _load_discovery_document(api, version, http)
+    with _lock:
+        _documents[key] = document
+    return document
+
+def _load_discovery_document(api : str, version : str, http) -> str:
+    try:
+        # pylint: disable=C0415
+        from googleapiclient.discovery_cache import get_static_doc # type: ignore
+        document = get_static_doc(api, version)
+        if document is not None:
+            return document
+    except ImportError:
+        # Older versions of the client don't bundle the documents
+        pass
+
+    # Nobody else may be able to plant the document that tells us where to send our requests
+    discovery_dir = os.path.join(user_cache_dir(), "discovery")
+    path = os.path.join(discovery_dir, "%s.%s.json" % (api, version))
+    try:
+        if time.time() - os.path.getmtime(path) < DISCOVERY_MAX_AGE:
+            with open(path, "r", encoding="utf-8") as fh:
+                return fh.read()
+    except OSError:
+        pass
+
+    uri = DISCOVERY_URI.format(api=api, apiVersion=version)
+    resp, content = http.request(uri)
+    if resp.status >= 400:
+        raise HttpError(resp, content, uri=uri)
+    document = content.decode("utf-8")
+
+    os.makedirs(discovery_dir, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        fh.write(document)
+    os.replace(path + ".tmp", path)
+    return document
+
+def build_service(api : str, version : str, credentials, token, scope):
+    """Returns the service of the API for the current thread.
+
+    Services share the credentials and the authorized transport of their token, and all their requests go
+    through the scheduler of the API and token. Discovery documents are only parsed once per thread."""
+
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = _local.services = {}
+    key = (api, version, os.path.abspath(token), _generation)
+    if key not in services:
+        http = ScheduledHttp(authorized_http(credentials, token, scope), get_scheduler(api, token))
+        services[key] = build_from_document(discovery_document(api, version, http), http=http)
+    return services[key]
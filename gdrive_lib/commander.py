@@ -5,22 +5,47 @@ import os
 import csv
 import argparse
 import re
-from .drive.drive import Drive
-from .drive.drive_api import DRIVE_READONLY, DRIVE_PER_FILE
-from .sheets.sheets import Sheets
-from .sheets.sheets_api import SHEET_FULL, SHEET_READONLY
+from typing import Iterable, List, TYPE_CHECKING
+
+# The API clients take most of the startup time, so each command only imports what it needs.
+# pylint: disable=C0415
+if TYPE_CHECKING:
+    from .drive.drive import Drive
+    from .drive.file import File
+    from .sheets.sheets import Sheets
 
 BLUE = "\033[94m"
 NOCOLOR = "\033[0m"
 
+def open_drive(args, scope) -> "Drive":
+    """Returns the Drive for a command. Commands in a shell or daemon session all share one."""
+
+    if args.session is not None:
+        return args.session.drive(scope, args.creds, args.drive_token, args.cache_dir)
+    from .drive.drive import Drive
+    return Drive(scope, credentials=args.creds, token=args.drive_token, cache_dir=args.cache_dir)
+
+def open_sheets(args, scope) -> "Sheets":
+    if args.session is not None:
+        return args.session.sheets(scope, args.creds, args.sheets_token)
+    from .sheets.sheets import Sheets
+    return Sheets(scope, credentials=args.creds, token=args.sheets_token)
+
 def ls(args) -> None:
-    drive = Drive(DRIVE_READONLY, credentials=args.creds, token=args.drive_token)
-    files = drive.ls(args.path)
+    from .drive.drive_api import DRIVE_READONLY
+
+    drive = open_drive(args, DRIVE_READONLY)
+
+    if args.R:
+        drive.ls_all(args.path, max_workers=args.j)
+        files : Iterable["File"] = sorted(drive.fs.files_below(args.path), key=lambda x: x.path)
+    else:
+        # Let the API sort, so that we can print the first entries while the rest is still listed
+        files = drive.iter_ls(args.path, order_by="name")
 
     print(args.path)
-    files = sorted(files, key=lambda x: x.name)
     for file in files:
-        full_path = os.path.join(args.path, file.name)
+        full_path = file.path if args.R else os.path.join(args.path, file.name)
 
         color = NOCOLOR
         if file.is_dir:
@@ -33,37 +58,61 @@ def ls(args) -> None:
             print("%s%s%s" % (color, full_path, NOCOLOR))
 
 def csv_download(args):
-    drive = Drive(DRIVE_READONLY, credentials=args.creds, token=args.drive_token)
-    sheets = Sheets(SHEET_READONLY, credentials=args.creds, token=args.sheets_token)
+    from .drive.drive_api import DRIVE_READONLY
+    from .sheets.sheets_api import SHEET_READONLY
 
-    drive.ls(args.SPREADSHEET)
-    if drive.fs.file_exists_at_path(args.SPREADSHEET):
+    drive = open_drive(args, DRIVE_READONLY)
+    sheets = open_sheets(args, SHEET_READONLY)
+
+    f = drive.resolve(args.SPREADSHEET)
+    if f is None:
         print("File not found")
         sys.exit(-1)
 
-    f = drive.fs.by_path(args.SPREADSHEET)
     sheet = sheets.get_spreadsheet(f.id)
-    data  = sheet.get_data(sheet_name=args.SHEET)
+    # Rows are written as they arrive, so the whole sheet never has to fit in memory
+    data  = sheet.iter_rows(args.SHEET, chunk_rows=args.chunk_rows, windows=args.windows)
 
     if args.CSV is None:
         writer = csv.writer(sys.stdout, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
         writer.writerows(data)
     else:
-        with open(args.CSV, mode='w') as fh:
+        with open(args.CSV, mode='w', encoding='utf-8', newline='') as fh:
             writer = csv.writer(fh, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
             writer.writerows(data)
 
+def sheets_export(args):
+    from .drive.drive_api import DRIVE_READONLY
+    from .sheets.sheets_api import SHEET_READONLY
+    from .sheets.export import export_spreadsheets
+
+    drive = open_drive(args, DRIVE_READONLY)
+    sheets = open_sheets(args, SHEET_READONLY)
+    stats = export_spreadsheets(drive, sheets, args.DIR, args.OUTDIR, workers=args.j)
+    if stats is None or stats.failed > 0:
+        sys.exit(-1)
+
 def csv_upload(args):
-    drive  = Drive(DRIVE_READONLY, credentials=args.creds, token=args.drive_token)
-    sheets = Sheets(SHEET_FULL, credentials=args.creds, token=args.sheets_token)
+    from .drive.drive_api import DRIVE_READONLY
+    from .sheets.sheets_api import SHEET_FULL
+
+    drive  = open_drive(args, DRIVE_READONLY)
+    sheets = open_sheets(args, SHEET_FULL)
 
-    drive.ls(args.SPREADSHEET)
-    if drive.fs.file_exists_at_path(args.SPREADSHEET):
+    f = drive.resolve(args.SPREADSHEET)
+    if f is None:
         print("File not found")
         sys.exit(-1)
-    f = drive.fs.by_path(args.SPREADSHEET)
     sheet = sheets.get_spreadsheet(f.id)
-    sheet.upload_csv(args.CSV, args.SHEET)
+
+    def print_rows(written : int, total : int) -> None:
+        end = "\n" if written >= total else ""
+        print("\r%d of %d rows" % (written, total), end=end, flush=True)
+    if args.delta:
+        cells = sheet.upload_csv_delta(args.CSV, args.SHEET, cache_dir=args.cache_dir)
+        print("Updated %d cells" % (cells))
+        return
+    sheet.upload_csv(args.CSV, args.SHEET, block_rows=args.block_rows, workers=args.j, progress=print_rows)
 
 class ScpArgs:
     is_remote : bool
@@ -79,35 +128,124 @@ class ScpArgs:
             self.path = path
 
 
+def print_progress(sent : int, total : int) -> None:
+    from .drive.transfer import format_size
+
+    percent = 100 * sent // total if total > 0 else 100
+    end = "\n" if sent >= total else ""
+    print("\r%s of %s (%d%%)" % (format_size(sent), format_size(total), percent), end=end, flush=True)
+
 def scp(args):
+    from .drive.drive_api import DRIVE_READONLY, DRIVE_PER_FILE
+
     src : ScpArgs = args.src
     dst : ScpArgs = args.dst
 
     if src.is_remote and (not dst.is_remote):
         print("Downloading %s to %s" % (src.path, dst.path))
-        drive = Drive(DRIVE_READONLY, credentials=args.creds, token=args.drive_token)
-        drive.ls(src.path)
-        drive.download(src.path, dst.path)
+        drive = open_drive(args, DRIVE_READONLY)
+        if args.r:
+            drive.download_tree(src.path, dst.path, workers=args.j)
+        else:
+            drive.download(src.path, dst.path, workers=args.j, part_size=args.part_size * 1024 * 1024)
     elif (not src.is_remote) and dst.is_remote:
         print("Uploading %s to %s" % (src.path, dst.path))
-        drive = Drive(DRIVE_PER_FILE, credentials=args.creds, token=args.drive_token)
-        drive.ls(dst.path)
-        drive.upload(src.path, dst.path)
+        drive = open_drive(args, DRIVE_PER_FILE)
+        if args.r:
+            drive.upload_tree(src.path, dst.path, workers=args.j, chunk_size=args.chunk_size * 1024 * 1024)
+        else:
+            drive.upload(src.path, dst.path, chunk_size=args.chunk_size * 1024 * 1024, progress=print_progress)
     else:
         print("One of the two given paths must be local while the other is remote!")
         sys.exit(-1)
 
-def main():
-    parser = argparse.ArgumentParser()
+def sync(args):
+    from .drive.drive_api import DRIVE_READONLY, DRIVE_FULL
+    from .drive.sync import Sync
+
+    src : ScpArgs = args.src
+    dst : ScpArgs = args.dst
+
+    if src.is_remote == dst.is_remote:
+        print("One of the two given paths must be local while the other is remote!")
+        sys.exit(-1)
+
+    upload = dst.is_remote
+    scope = DRIVE_FULL if upload else DRIVE_READONLY
+    drive = open_drive(args, scope)
+    remote, local = (dst.path, src.path) if upload else (src.path, dst.path)
+
+    syncer = Sync(drive, remote, local, upload=upload, delete=args.delete, workers=args.j)
+    plan = syncer.plan()
+    if plan is None:
+        sys.exit(-1)
+    plan.print()
+    if args.dry_run or len(plan.actions) == 0:
+        return
+
+    stats = syncer.run(plan)
+    print(stats.summary("Uploaded" if upload else "Downloaded"))
+
+def expand_globs(drive : "Drive", patterns : List[str]) -> List["File"]:
+    files = []
+    for pattern in patterns:
+        matches = drive.glob(pattern)
+        if len(matches) == 0:
+            print("Nothing matches %s" % (pattern))
+        files.extend(matches)
+    return files
+
+def rm(args):
+    from .drive.drive_api import DRIVE_FULL
+
+    drive = open_drive(args, DRIVE_FULL)
+
+    files = expand_globs(drive, args.paths)
+    if not args.r:
+        for f in files:
+            if f.is_dir:
+                print("Skipping %s, because it is a folder (use -r to remove folders)." % (f.path))
+        files = [f for f in files if not f.is_dir]
+
+    trashed = drive.rm_files(files)
+    print("Moved %d files to the trash" % (len(trashed)))
+
+def mv(args):
+    from .drive.drive_api import DRIVE_FULL
+
+    drive = open_drive(args, DRIVE_FULL)
+
+    files = expand_globs(drive, args.paths)
+    moved = drive.mv_files(files, args.folder)
+    print("Moved %d files to %s" % (len(moved), args.folder))
+
+def shell(_args):
+    from .daemon import Session, run_shell
+    run_shell(Session(run))
+
+def daemon(args):
+    from .daemon import Session, serve
+    serve(Session(run), args.socket)
+
+def build_parser() -> argparse.ArgumentParser:
+    # pylint: disable=R0915
+    parser = argparse.ArgumentParser(prog="gdrive")
     def print_help(_arg):
         parser.print_help()
     parser.set_defaults(func=print_help)
+    parser.add_argument("--stats", action="store_true",
+        help="Print the calls, latencies and bytes of each API operation when the command is done")
+    parser.add_argument("--stats-json", metavar="PATH", help="Write these statistics to a JSON file")
+    parser.add_argument("--stats-prometheus", metavar="PATH",
+        help="Write these statistics to a file in the Prometheus text format")
     subparsers = parser.add_subparsers()
 
     def new_drive_subparser(cmd, func, **kwargs):
         sub = subparsers.add_parser(cmd, **kwargs)
         sub.add_argument("--creds", default="credentials.json", metavar="CREDENTIALS.JSON")
         sub.add_argument("--token", default="token.json", metavar="TOKEN.JSON", dest="drive_token")
+        sub.add_argument("--cache-dir", default=None, metavar="DIR",
+            help="Keep the Drive metadata in this directory and catch up via the changes feed")
         sub.set_defaults(func=func)
         return sub
 
@@ -116,32 +254,113 @@ def main():
         sub.add_argument("--creds", default="credentials.json", metavar="CREDENTIALS.JSON")
         sub.add_argument("--drive-token", default="token.json", metavar="TOKEN.JSON")
         sub.add_argument("--sheets-token", default="token.json", metavar="TOKEN.JSON")
+        sub.add_argument("--cache-dir", default=None, metavar="DIR",
+            help="Keep the Drive metadata (and snapshots of sheets uploaded with --delta) in this directory")
         sub.set_defaults(func=func)
         return sub
 
     p_ls = new_drive_subparser("ls", ls, help="List all files at the given path")
     p_ls.add_argument("path", type=str, metavar="PATH")
     p_ls.add_argument("-l", action='store_true')
+    p_ls.add_argument("-R", action='store_true', help="List all files below the path recursively")
+    p_ls.add_argument("-j", type=int, default=1, metavar="N", help="List up to N folders concurrently (with -R)")
 
     p_scp = new_drive_subparser("scp", scp, help="Transfer files between the local host and the drive")
     p_scp.add_argument("src", type=ScpArgs, metavar="SOURCE", help="Local path (e.g. ~/test.pdf) or remote path (e.g. drive:/test.pdf)")
     p_scp.add_argument("dst", type=ScpArgs, metavar="TARGET")
+    p_scp.add_argument("-r", action='store_true', help="Transfer the whole directory tree")
+    p_scp.add_argument("-j", type=int, default=4, metavar="N",
+        help="Transfer up to N files concurrently (with -r), or N parts of a single large file")
+    p_scp.add_argument("--part-size", type=int, default=64, metavar="MB",
+        help="Download files larger than this in parallel parts of this size")
+    p_scp.add_argument("--chunk-size", type=int, default=8, metavar="MB",
+        help="Upload large files resumably in chunks of this size")
+
+    p_sync = new_drive_subparser("sync", sync, help="Transfer only new or changed files between a local and a remote folder")
+    p_sync.add_argument("src", type=ScpArgs, metavar="SOURCE", help="Local folder (e.g. ~/backup) or remote folder (e.g. drive:/backup)")
+    p_sync.add_argument("dst", type=ScpArgs, metavar="TARGET")
+    p_sync.add_argument("--delete", action='store_true', help="Move files that were deleted from the source to the trash")
+    p_sync.add_argument("--dry-run", action='store_true', help="Only print what would be transferred")
+    p_sync.add_argument("-j", type=int, default=4, metavar="N", help="Transfer up to N files concurrently")
+
+    p_rm = new_drive_subparser("rm", rm, help="Move the files at the given paths to the trash")
+    p_rm.add_argument("paths", type=str, nargs="+", metavar="PATH", help="Remote path, may contain wildcards (e.g. '/logs/*.txt')")
+    p_rm.add_argument("-r", action='store_true', help="Also remove folders (including everything in them)")
+
+    p_mv = new_drive_subparser("mv", mv, help="Move the files at the given paths into a folder")
+    p_mv.add_argument("paths", type=str, nargs="+", metavar="PATH", help="Remote path, may contain wildcards (e.g. '/logs/*.txt')")
+    p_mv.add_argument("folder", type=str, metavar="FOLDER")
 
     p_csv_download = new_sheets_subparser("csv-download", csv_download, help="Downloads the given sheet in a CSV format")
     p_csv_download.add_argument("SPREADSHEET", type=str, help="Path to the SPREADSHEET")
     p_csv_download.add_argument("SHEET", type=str, help="Name of the SHEET within the spreadsheet")
     p_csv_download.add_argument("CSV", type=str, default=None, nargs="?",
         help="Write output to this CSV file. Printing to stdout if not specified")
+    p_csv_download.add_argument("--chunk-rows", type=int, default=None, metavar="N",
+        help="Fetch N rows per range (by default as many as fit into about 200,000 cells)")
+    p_csv_download.add_argument("--windows", type=int, default=2, metavar="N", help="Fetch N ranges per request")
 
     p_csv_upload = new_sheets_subparser("csv-upload", csv_upload, help="Upload a CSV into the given sheet")
     p_csv_upload.add_argument("SPREADSHEET", type=str, help="Path to the SPREADSHEET")
     p_csv_upload.add_argument("SHEET", type=str, help="Name of the SHEET within the spreadsheet")
     p_csv_upload.add_argument("CSV", type=str)
+    p_csv_upload.add_argument("-j", type=int, default=4, metavar="N", help="Send up to N blocks of rows at once")
+    p_csv_upload.add_argument("--block-rows", type=int, default=None, metavar="N",
+        help="Send N rows per request (by default as many as fit into about 200,000 cells)")
+    p_csv_upload.add_argument("--delta", action="store_true",
+        help="Only write the cells that changed (compared to the last upload if there is a --cache-dir)")
+
+    p_sheets_export = new_sheets_subparser("sheets-export", sheets_export,
+        help="Downloads every sheet of all spreadsheets below the folder as CSV files")
+    p_sheets_export.add_argument("DIR", type=str, help="Path to the folder on the drive")
+    p_sheets_export.add_argument("OUTDIR", type=str, help="Write the CSV files below this directory")
+    p_sheets_export.add_argument("-j", type=int, default=8, metavar="N", help="Export up to N spreadsheets concurrently")
+
+    p_shell = subparsers.add_parser("shell", help="Run commands interactively, sharing one warm session")
+    p_shell.set_defaults(func=shell)
+
+    p_daemon = subparsers.add_parser("daemon", help="Serve commands from other gdrive invocations on a Unix socket, sharing one warm session")
+    p_daemon.add_argument("--socket", default=None, metavar="PATH", help="Listen on this socket instead of $GDRIVE_SOCKET or the default")
+    p_daemon.set_defaults(func=daemon)
 
-    args, unknown_args = parser.parse_known_args()
+    return parser
+
+def run(argv : List[str], session=None) -> None:
+    """Runs a single command line, with the clients of the [session] if there is one."""
+
+    parser = build_parser()
+    args, unknown_args = parser.parse_known_args(argv)
     sys.argv = [sys.argv[0]] + unknown_args
+    args.session = session
+
+    from .stats import get_recorder, Sink, TextSink, JsonSink, PrometheusSink
+    recorder = get_recorder()
+    sinks : List[Sink] = [TextSink()] if args.stats else []
+    sinks += [JsonSink(args.stats_json)] if args.stats_json else []
+    sinks += [PrometheusSink(args.stats_prometheus)] if args.stats_prometheus else []
+    if len(sinks) == 0:
+        args.func(args)
+        return
+
+    # A session runs many commands, only this one's requests count
+    recorder.reset()
+    for sink in sinks:
+        recorder.add_sink(sink)
+    try:
+        args.func(args)
+    finally:
+        recorder.flush()
+        for sink in sinks:
+            recorder.remove_sink(sink)
+
+def main():
+    from .daemon import forward
 
-    args.func(args)
+    # Let the daemon run the command if there is one, so that it can use its warm session
+    code = forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    run(sys.argv[1:])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+"""Runs commands against one long-lived session, interactively or for clients on a Unix socket.
+
+A session keeps its Drive and Sheets clients (with their credentials, connections and filesystem cache)
+between commands, so that only the first command pays for authorization and path resolution."""
+
+import io
+import os
+import sys
+import json
+import shlex
+import socket
+import tempfile
+import threading
+import traceback
+import contextlib
+import socketserver
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Commands that need to run in the process they were started in
+LOCAL_COMMANDS = ("shell", "daemon")
+# Global options of the commander that take a value, which comes before the command
+VALUE_OPTIONS = ("--stats-json", "--stats-prometheus")
+
+def socket_path() -> str:
+    """Returns where the daemon listens, which can be changed with the GDRIVE_SOCKET environment variable."""
+
+    default = os.path.join(tempfile.gettempdir(), "gdrive-%d.sock" % (os.getuid()))
+    return os.environ.get("GDRIVE_SOCKET", default)
+
+def command_name(argv : List[str]) -> Optional[str]:
+    """Returns the command of a command line, i.e. its first argument that isn't a global option."""
+
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith("-"):
+            return arg
+    return None
+
+class Session:
+    """Hands out the same Drive and Sheets clients to all commands that use the same settings.
+
+    Commands are run with [run_command](argv, session), i.e. the commander's run."""
+
+    __drives : Dict[Tuple, Any]
+    __sheets : Dict[Tuple, Any]
+
+    def __init__(self, run_command : Callable[[List[str], "Session"], None]) -> None:
+        self.__run_command = run_command
+        self.__drives = {}
+        self.__sheets = {}
+
+    def drive(self, scope, credentials, token, cache_dir):
+        # pylint: disable=C0415
+        from .drive.drive import Drive
+        from .api_utils import user_cache_dir
+
+        # Sessions keep a persistent cache, so that they can catch up with changes between commands
+        cache_dir = cache_dir if cache_dir is not None else user_cache_dir()
+        key = (scope, os.path.abspath(credentials), os.path.abspath(token), os.path.abspath(cache_dir))
+        drive = self.__drives.get(key)
+        if drive is None:
+            drive = Drive(scope, credentials=credentials, token=token, cache_dir=cache_dir)
+            self.__drives[key] = drive
+        else:
+            # Catch up with whatever changed on the Drive since the last command
+            drive.sync()
+        return drive
+
+    def sheets(self, scope, credentials, token):
+        # pylint: disable=C0415
+        from .sheets.sheets import Sheets
+
+        key = (scope, os.path.abspath(credentials), os.path.abspath(token))
+        if key not in self.__sheets:
+            self.__sheets[key] = Sheets(scope, credentials=credentials, token=token)
+        return self.__sheets[key]
+
+    def run(self, argv : List[str], cwd : str) -> int:
+        """Runs a single command line in the given working directory and returns its exit code."""
+
+        try:
+            os.chdir(cwd)
+            self.__run_command(argv, self)
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception: # pylint: disable=W0703
+            # A failing command must not take the whole session down
+            traceback.print_exc()
+            return 1
+
+def run_shell(session : Session) -> None:
+    """Reads commands from stdin until EOF or 'exit' and runs them in the session."""
+
+    while True:
+        try:
+            line = input("gdrive> ")
+        except EOFError:
+            print()
+            return
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            print(e)
+            continue
+        if len(argv) == 0:
+            continue
+        if argv[0] in ("exit", "quit"):
+            return
+        if command_name(argv) in LOCAL_COMMANDS:
+            print("Can not run %s within the shell." % (command_name(argv)))
+            continue
+        session.run(argv, os.getcwd())
+
+class _Stream(io.TextIOBase):
+    """Sends everything that is written to it to the client, as one JSON message per write."""
+
+    def __init__(self, wfile, kind : str, lock : threading.Lock) -> None:
+        super().__init__()
+        self.__wfile = wfile
+        self.__kind = kind
+        # Commands print from worker threads as well
+        self.__lock = lock
+
+    def write(self, text) -> int:
+        with self.__lock:
+            self.__wfile.write((json.dumps({self.__kind: text}) + "\n").encode("utf-8"))
+            self.__wfile.flush()
+        return len(text)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+        lock = threading.Lock()
+        out, err = _Stream(self.wfile, "out", lock), _Stream(self.wfile, "err", lock)
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            code = self.server.session.run(request["argv"], request["cwd"]) # type: ignore
+        self.wfile.write((json.dumps({"exit": code}) + "\n").encode("utf-8"))
+
+class _Server(socketserver.UnixStreamServer):
+    # Commands share the session, so they are handled one after another
+    session : Session
+
+def serve(session : Session, path : Optional[str] = None) -> None:
+    """Serves commands from clients on the Unix socket at [path] in the session until interrupted."""
+
+    path = path if path is not None else socket_path()
+    if os.path.exists(path):
+        sock = connect(path)
+        if sock is not None:
+            sock.close()
+            print("A daemon is already listening on %s" % (path))
+            return
+        # Left behind by a daemon that didn't shut down cleanly
+        os.remove(path)
+
+    server = _Server(path, _Handler)
+    server.session = session
+    # Commands run with our credentials, so only we may connect
+    os.chmod(path, 0o600)
+    print("Listening on %s" % (path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def connect(path : str) -> Optional[socket.socket]:
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) # pylint: disable=E1101
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def forward(argv : List[str]) -> Optional[int]:
+    """Runs the command in the daemon if one is running and returns its exit code, or None if there is none.
+
+    Set GDRIVE_NO_DAEMON to always run commands in this process."""
+
+    if command_name(argv) in LOCAL_COMMANDS or "GDRIVE_NO_DAEMON" in os.environ:
+        return None
+    sock = connect(socket_path())
+    if sock is None:
+        return None
+
+    with sock, sock.makefile("rwb") as fh:
+        fh.write((json.dumps({"argv": argv, "cwd": os.getcwd()}) + "\n").encode("utf-8"))
+        fh.flush()
+        for line in fh:
+            message = json.loads(line.decode("utf-8"))
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stdout if "out" in message else sys.stderr
+            stream.write(message.get("out", message.get("err")))
+            stream.flush()
+    # The daemon went away in the middle of the command
+    return 1
@@ -0,0 +1,357 @@
+"""Asyncio counterpart of Drive, for embedding the library in services that run an event loop."""
+
+import os
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from os.path import join, basename, dirname
+from googleapiclient.errors import HttpError, ResumableUploadError # type: ignore
+from googleapiclient.http import MediaFileUpload # type: ignore
+from .drive_api import DriveApi, DRIVE_READONLY
+from ..api_utils import user_cache_dir
+from .file import File
+from .filesystem import DEFAULT_LISTING_TTL
+from .drive import FILE_FIELDS, MAX_PAGE_SIZE, RESOLVE_FIELDS, CHANGE_FIELDS
+from .drive import sort_files, name_query, best_match, open_filesystem, absolute_path
+from .transfer import DEFAULT_PART_SIZE, RANGE_CHUNK_SIZE, DEFAULT_UPLOAD_CHUNK_SIZE, RESUMABLE_THRESHOLD
+from .transfer import DownloadCheckpoint, RangeDownload, UploadSession
+from ..aio import AsyncTransport, DEFAULT_POOL_SIZE
+
+class AsyncDrive():
+    """Like Drive, but all operations are coroutines that send their requests through a pooled async transport.
+
+    The fs is only touched from the event loop, so any number of operations can run concurrently, e.g. with
+    asyncio.gather. With a [cache_dir], use the drive with 'async with' (or await sync()) to catch up with
+    the changes since the last run."""
+
+    def __init__(self,
+            scope=DRIVE_READONLY,
+            credentials="credentials.json",
+            token="token.json",
+            cache_dir=None,
+            listing_ttl=DEFAULT_LISTING_TTL,
+            pool_size=DEFAULT_POOL_SIZE):
+        # pylint: disable=R0913
+        self.__api = DriveApi(scope, credentials, token)
+        self.__transport = AsyncTransport("drive", scope, credentials, token, pool_size)
+        self.__state_dir = cache_dir if cache_dir is not None else user_cache_dir()
+        self.fs = open_filesystem(token, cache_dir, listing_ttl)
+
+    async def __aenter__(self) -> "AsyncDrive":
+        await self.sync()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.__transport.close()
+
+    def __files(self):
+        # Requests are only built here, and sent with our transport
+        return self.__api.files()
+
+    async def __execute(self, request):
+        return await self.__transport.execute(request)
+
+    def __add_file(self, base_path : str, data) -> Optional[File]:
+        return self.fs.add_file(File(base_path, data))
+
+    async def __root_id(self) -> str:
+        if self.fs.root_id is None:
+            root = await self.__execute(self.__files().get(fileId="root", fields="id"))
+            self.fs.set_root_id(root["id"])
+        assert self.fs.root_id is not None
+        return self.fs.root_id
+
+    async def __list_pages(self, query : str, page_size : int = MAX_PAGE_SIZE,
+                           fields : str = FILE_FIELDS, order_by : Optional[str] = None) -> AsyncIterator[List[Dict]]:
+        page_token = None
+        while True:
+            results = await self.__execute(self.__files().list(
+                pageSize=page_size,
+                pageToken=page_token,
+                q=query,
+                orderBy=order_by,
+                fields="nextPageToken, files(%s)" % (fields)))
+            yield results.get('files', [])
+
+            page_token = results.get('nextPageToken')
+            if page_token is None:
+                return
+
+    async def sync(self) -> None:
+        """Catches up the persistent cache with the changes that happened since the last run."""
+
+        cache = self.fs.cache
+        if cache is None:
+            return
+        await self.__root_id()
+
+        changes = self.__api.changes()
+        page_token = cache.get_meta("changes_page_token")
+        if page_token is None:
+            start = await self.__execute(changes.getStartPageToken())
+            cache.set_meta("changes_page_token", start["startPageToken"])
+            return
+
+        while page_token is not None:
+            results = await self.__execute(changes.list(
+                pageToken=page_token,
+                pageSize=1000,
+                includeRemoved=True,
+                spaces="drive",
+                fields=CHANGE_FIELDS))
+            for change in results.get("changes", []):
+                self.fs.apply_change(change)
+
+            if "newStartPageToken" in results:
+                cache.set_meta("changes_page_token", results["newStartPageToken"])
+            page_token = results.get("nextPageToken")
+
+    async def resolve(self, path : str) -> Optional[File]:
+        """Finds the file at the path, see Drive.resolve."""
+        return await self.__resolve(absolute_path(path), False)
+
+    async def __resolve(self, path : str, want_dir : bool) -> Optional[File]:
+        if self.fs.file_exists_at_path(path):
+            return self.fs.by_path(path)
+
+        parent_path = dirname(path)
+        if parent_path == path:
+            return None
+        parent = await self.__resolve(parent_path, True)
+        if parent is None or not parent.is_dir or self.fs.is_fresh(parent):
+            # A folder that was just listed completely has no children we don't know about
+            return None
+
+        matches : List[Dict] = []
+        async for page in self.__list_pages(name_query(basename(path), parent.id), fields=RESOLVE_FIELDS):
+            matches.extend(page)
+        if len(matches) == 0:
+            return None
+        return self.__add_file(parent_path, best_match(matches, want_dir))
+
+    async def ls(self, path : str) -> List[File]:
+        """Tries to find the file at the path and all its children if it's a folder."""
+        return [f async for f in self.iter_ls(path)]
+
+    async def iter_ls(self, path : str, page_size : int = MAX_PAGE_SIZE, fields : str = FILE_FIELDS,
+                      order_by : Optional[str] = None) -> AsyncIterator[File]:
+        """Like ls, but yields the children page by page as they arrive, see Drive.iter_ls."""
+
+        folder = await self.resolve(path)
+        if folder is None:
+            return
+
+        if folder.is_dir and fields == FILE_FIELDS and self.fs.is_fresh(folder):
+            for f in sort_files(self.fs.children(folder), order_by):
+                yield f
+            return
+
+        listed : List[str] = []
+        async for page in self.__list_pages("'%s' in parents" % (folder.id), page_size, fields, order_by):
+            files = self.fs.add_files([File(folder.path, data) for data in page])
+            listed.extend(f.id for f in files)
+            for f in files:
+                yield f
+        if folder.is_dir:
+            self.fs.mark_listed(folder, listed)
+
+    async def download(self, remote : str, local : str, workers : int = 1,
+                       part_size : int = DEFAULT_PART_SIZE) -> Optional[int]:
+        """Downloads the [remote] file to the [local] target and returns the bytes transferred, see Drive.download."""
+        # pylint: disable=R0914
+
+        f = await self.resolve(remote)
+        if f is None:
+            print("Can not download the file because we can't find anything at that path.", remote)
+            return None
+        if f.is_dir:
+            print("Can not download a directory.", remote)
+            return None
+
+        size, md5, modified_time = f.size, f.md5, f.modified
+        if size is None:
+            # Files loaded from the cache don't know their size and checksum
+            data = await self.__execute(self.__files().get(fileId=f.id, fields="size, md5Checksum, modifiedTime"))
+            size, md5, modified_time = int(data.get("size", 0)), data.get("md5Checksum"), data.get("modifiedTime")
+
+        request = self.__files().get_media(fileId=f.id)
+        if size <= RANGE_CHUNK_SIZE:
+            content = await self.__execute(request)
+            with open(local, "wb") as fh:
+                fh.write(content)
+            return len(content)
+
+        checkpoint = DownloadCheckpoint.start(local, f.id, md5 or modified_time, size, part_size if workers > 1 else size)
+        remaining = checkpoint.remaining()
+        semaphore = asyncio.Semaphore(max(1, workers))
+        fd = os.open(checkpoint.partial, os.O_WRONLY)
+        try:
+            await asyncio.gather(*[self.__download_range(request, fd, checkpoint, start, end, semaphore)
+                                   for start, end in remaining])
+        finally:
+            os.close(fd)
+
+        os.replace(checkpoint.partial, checkpoint.local)
+        checkpoint.remove()
+        return sum(end - start for start, end in remaining)
+
+    async def __download_range(self, request, fd : int, checkpoint : DownloadCheckpoint, start : int, end : int,
+                               semaphore : asyncio.Semaphore) -> None:
+        # pylint: disable=R0913
+        async with semaphore:
+            # All writes happen on the loop thread, so the lock is never contended
+            chunks = RangeDownload(request, fd, threading.Lock(), checkpoint, start, end)
+            while not chunks.done:
+                chunks.received(*await self.__transport.request(request.uri, "GET", None, chunks.headers()))
+
+    async def upload(self, local : str, remote : str, chunk_size : int = DEFAULT_UPLOAD_CHUNK_SIZE,
+                     progress : Optional[Callable[[int, int], None]] = None) -> Optional[File]:
+        """Upload the given [local] file to the [remote] location, see Drive.upload."""
+
+        remote = absolute_path(remote)
+        file_name = basename(remote)
+        parent_path = dirname(remote)
+
+        if await self.resolve(remote) is not None:
+            print("Can not upload file because the remote file exists already.", remote)
+            return None
+        parent = await self.resolve(parent_path)
+        if parent is None:
+            print("Can not upload file because folder does not exist.", parent_path)
+            return None
+
+        file_metadata = {'name': file_name, 'parents': [ parent.id ]}
+        if os.path.getsize(local) <= RESUMABLE_THRESHOLD:
+            request = self.__files().create(body=file_metadata, media_body=MediaFileUpload(local), fields=FILE_FIELDS)
+            data = await self.__execute(request)
+        else:
+            media = MediaFileUpload(local, chunksize=chunk_size, resumable=True)
+            request = self.__files().create(body=file_metadata, media_body=media, fields=FILE_FIELDS)
+            session = UploadSession(join(self.__state_dir, "uploads"), local, parent.id, file_name)
+            data = await self.__upload_resumable(request, session, chunk_size, progress)
+        return self.__add_file(parent.path, data)
+
+    async def __upload_resumable(self, request, session : UploadSession, chunk_size : int,
+                                 progress : Optional[Callable[[int, int], None]]):
+        """Like transfer.upload_resumable, but speaks the resumable protocol itself, since the
+        request can only send its chunks synchronously."""
+
+        size = session.size
+        offset = 0
+        uri = session.load()
+        if uri is not None:
+            resp, content = await self.__transport.request(uri, "PUT", None, {
+                "Content-Range": "bytes */%d" % (size),
+                "content-length": "0"
+            })
+            if resp.status in (200, 201):
+                # Everything was uploaded before we got to hear about it
+                session.remove()
+                return request.postproc(resp, content)
+            if resp.status == 308:
+                offset = int(resp["range"].rsplit("-", 1)[1]) + 1 if "range" in resp else 0
+            else:
+                # The session expired, so we start a new one
+                uri = None
+
+        if uri is None:
+            headers = dict(request.headers)
+            headers["X-Upload-Content-Type"] = request.resumable.mimetype()
+            headers["X-Upload-Content-Length"] = str(size)
+            resp, content = await self.__transport.request(request.uri, request.method, request.body, headers)
+            if resp.status != 200 or "location" not in resp:
+                raise ResumableUploadError(resp, content)
+            uri = resp["location"]
+            session.save(uri)
+
+        while True:
+            chunk = request.resumable.getbytes(offset, chunk_size)
+            resp, content = await self.__transport.request(uri, "PUT", chunk, {
+                "Content-Range": "bytes %d-%d/%d" % (offset, offset + len(chunk) - 1, size)
+            })
+            if resp.status in (200, 201):
+                session.remove()
+                if progress is not None:
+                    progress(size, size)
+                return request.postproc(resp, content)
+            if resp.status != 308:
+                raise HttpError(resp, content, uri=uri)
+
+            offset = int(resp["range"].rsplit("-", 1)[1]) + 1 if "range" in resp else 0
+            if progress is not None:
+                progress(offset, size)
+
+    async def mkdir(self, remote : str) -> Optional[File]:
+        """Creates a new folder if nothing exists at that path yet."""
+
+        remote = absolute_path(remote)
+        if await self.resolve(remote) is not None:
+            print("Can not create directory because something already exists at the path.", remote)
+            return None
+
+        parent_path = dirname(remote)
+        parent = await self.resolve(parent_path)
+        if parent is None:
+            print("Can not create directory because the parent folder does not exist.", parent_path)
+            return None
+
+        file_metadata = {
+            "name": basename(remote),
+            "mimeType": File.FOLDER_MIME_TYPE,
+            "parents": [parent.id]
+        }
+        data = await self.__execute(self.__files().create(body=file_metadata, fields=FILE_FIELDS))
+        folder = self.__add_file(parent.path, data)
+        if folder is not None:
+            # It's empty, so its children don't need to be looked up
+            self.fs.mark_listed(folder)
+        return folder
+
+    async def mv(self, path : str, to_folder : str) -> Optional[File]:
+        """Move the file at [path] to the given folder"""
+
+        f, folder = await asyncio.gather(self.resolve(path), self.resolve(to_folder))
+        if folder is None or not folder.is_dir:
+            print("Can not move the file because there is no folder at the path.", to_folder)
+            return None
+        if f is None:
+            print("Can not find anything at the path.", path)
+            return None
+
+        request = self.__files().update(
+            fileId=f.id,
+            addParents=folder.id,
+            removeParents=",".join(f.parents),
+            fields=FILE_FIELDS)
+        try:
+            data = await self.__execute(request)
+        except HttpError as e:
+            self.__forget_if_gone(f, e)
+            raise
+        # Adding it at the new path re-paths everything below it
+        return self.__add_file(folder.path, data)
+
+    async def rm(self, remote : str) -> Optional[File]:
+        """Moves the given file to the trash and returns it."""
+
+        f = await self.resolve(remote)
+        if f is None:
+            print("Can not find anything at the path.", remote)
+            return None
+
+        request = self.__files().update(fileId=f.id, body={"trashed": True}, fields=FILE_FIELDS)
+        try:
+            await self.__execute(request)
+        except HttpError as e:
+            self.__forget_if_gone(f, e)
+            raise
+        self.fs.remove_file(f)
+        return f
+
+    def __forget_if_gone(self, f : File, error : HttpError) -> None:
+        if error.resp.status == 404:
+            # Somebody else deleted it already, so our fs is stale
+            self.fs.remove_file(f)
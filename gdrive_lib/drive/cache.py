@@ -0,0 +1,77 @@
+"""Persists what we know about the Drive filesystem between runs."""
+
+import os
+import sqlite3
+from typing import List, Optional
+from .file import File
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    parents TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    modified_time TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class FilesystemCache:
+    """Stores the cached files and the changes page token in a SQLite database."""
+
+    def __init__(self, path : str) -> None:
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self.__conn = sqlite3.connect(path)
+        with self.__conn:
+            self.__conn.executescript(SCHEMA)
+
+    def load(self) -> List[File]:
+        """Returns all files that are stored in the cache."""
+
+        files : List[File] = []
+        rows = self.__conn.execute("SELECT id, path, name, parents, mime_type, modified_time FROM files")
+        for file_id, path, name, parents, mime_type, modified_time in rows:
+            data = {
+                "id": file_id,
+                "name": name,
+                "parents": parents.split(",") if parents != "" else [],
+                "mimeType": mime_type
+            }
+            if modified_time is not None:
+                data["modifiedTime"] = modified_time
+            # File joins the base path and the name, so strip the name back off the path.
+            files.append(File(path[:len(path) - len(name)], data))
+        return files
+
+    def put(self, files : List[File]) -> None:
+        """Inserts or replaces the given files in a single transaction."""
+
+        rows = [(f.id, f.path, f.name, ",".join(f.parents), f.mime_type, f.modified)
+                for f in files]
+        with self.__conn:
+            self.__conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def delete(self, file_ids : List[str]) -> None:
+        """Removes the files with the given ids in a single transaction."""
+
+        with self.__conn:
+            self.__conn.executemany("DELETE FROM files WHERE id = ?", [(file_id,) for file_id in file_ids])
+
+    def get_meta(self, key : str) -> Optional[str]:
+        row = self.__conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_meta(self, key : str, value : str) -> None:
+        with self.__conn:
+            self.__conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def close(self) -> None:
+        self.__conn.close()
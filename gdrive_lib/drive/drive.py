@@ -1,25 +1,138 @@
 """Handles operations on the files within the Drive."""
 
-import io
-import datetime
-from typing import List, Optional, Dict
-from os.path import join, basename, dirname
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload # type: ignore
+import os
+import math
+import time
+import fnmatch
+import hashlib
+import posixpath
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from os.path import join, basename, dirname, relpath
+from googleapiclient.errors import HttpError # type: ignore
+from googleapiclient.http import MediaFileUpload # type: ignore
 from .drive_api import DriveApi, DRIVE_READONLY
+from ..api_utils import user_cache_dir
 from .file import File
-from .filesystem import Filesystem
-
-FILE_FIELDS = 'id, name, parents, mimeType, trashed, modifiedTime'
+from .filesystem import Filesystem, DEFAULT_LISTING_TTL
+from .cache import FilesystemCache
+from ..scheduler import MAX_RETRIES, backoff_delay, is_retryable
+from .transfer import TransferStats, DownloadCheckpoint, DEFAULT_PART_SIZE, RANGE_CHUNK_SIZE
+from .transfer import DEFAULT_UPLOAD_CHUNK_SIZE, RESUMABLE_THRESHOLD, UploadSession
+from .transfer import download_media, download_resumable, upload_resumable
+
+FILE_FIELDS = 'id, name, parents, mimeType, trashed, modifiedTime, size, md5Checksum'
+MAX_PAGE_SIZE = 1000
+# How many sibling folders are merged into a single "'a' in parents or 'b' in parents" query
+PARENTS_PER_QUERY = 20
+# The most calls the Drive accepts in a single batch request
+MAX_BATCH_SIZE = 100
+# Same-named files are told apart by their age
+RESOLVE_FIELDS = FILE_FIELDS + ', createdTime'
+CHANGE_FIELDS = 'nextPageToken, newStartPageToken, changes(fileId, removed, file(%s))' % (FILE_FIELDS)
+
+def sort_files(files : List[File], order_by : Optional[str]) -> List[File]:
+    """Sorts files from memory like the API would for the 'folder' and 'name' keys of [order_by]."""
+
+    if order_by is None:
+        return files
+    keys = [key.strip() for key in order_by.split(",")]
+    def sort_key(f : File):
+        return [(not f.is_dir) if key == "folder" else f.name for key in keys if key in ("folder", "name")]
+    return sorted(files, key=sort_key)
+
+def name_query(name : str, parent_id : str) -> str:
+    """Returns the query for the files with the [name] in the folder with the [parent_id]."""
+
+    name = name.replace("\\", "\\\\").replace("'", "\\'")
+    return "name = '%s' and '%s' in parents and trashed = false" % (name, parent_id)
+
+def best_match(matches : List[Dict], want_dir : bool) -> Dict:
+    """Picks the file a path refers to among files with the same name, see Drive.resolve."""
+
+    def rank(data):
+        not_dir = data['mimeType'] != File.FOLDER_MIME_TYPE
+        return (want_dir and not_dir, data.get('createdTime', ''), data['id'])
+    return min(matches, key=rank)
+
+def absolute_path(path : str) -> str:
+    """Normalises a remote path, which is always relative to the root of the drive (e.g. "a/b" is "/a/b")."""
+    return posixpath.normpath("/" + path.lstrip("/"))
+
+def unique_files(files : List[File]) -> List[File]:
+    """Drops repeated files (e.g. matched by several patterns), keeping the order."""
+
+    seen = set()
+    unique = []
+    for f in files:
+        if f.id not in seen:
+            seen.add(f.id)
+            unique.append(f)
+    return unique
+
+def local_targets(files : List[File], remote_dir : str, local_dir : str) -> List[Tuple[File, str]]:
+    """Returns the local path of each file below [remote_dir]. Drive allows several files with the same
+    path, of which the least recently modified one keeps its name and the others get a number appended,
+    e.g. "notes (1).txt", so that they don't overwrite each other."""
+
+    by_target : Dict[str, List[File]] = {}
+    for f in files:
+        by_target.setdefault(join(local_dir, relpath(f.path, remote_dir)), []).append(f)
+
+    targets = []
+    for target, same in by_target.items():
+        same.sort(key=lambda f: (f.modified or "", f.id))
+        targets.append((same[0], target))
+        root, ext = os.path.splitext(target)
+        number = 0
+        for f in same[1:]:
+            renamed = target
+            while renamed in by_target:
+                number += 1
+                renamed = "%s (%d)%s" % (root, number, ext)
+            print("There are several files at %s, downloading %s to %s." % (f.path, f.id, renamed))
+            targets.append((f, renamed))
+    return targets
+
+def open_filesystem(token : str, cache_dir : Optional[str], listing_ttl : float) -> Filesystem:
+    """Returns an empty filesystem, or the one cached in [cache_dir] for the [token]."""
+
+    if cache_dir is None:
+        return Filesystem(listing_ttl=listing_ttl)
+    # Keep one cache per token, so that different accounts don't share their metadata.
+    key = hashlib.sha1(os.path.abspath(token).encode("utf-8")).hexdigest()[:16]
+    cache = FilesystemCache(join(cache_dir, "filesystem-%s.sqlite3" % (key)))
+    return Filesystem(cache, listing_ttl)
+
+def walk_by_depth(local_dir : str) -> Tuple[Dict[int, List[str]], Dict[int, List[str]]]:
+    """Returns the relative paths of the folders and the files below [local_dir], grouped by their depth."""
+
+    folders : Dict[int, List[str]] = {}
+    files : Dict[int, List[str]] = {}
+    for path, dirs, names in os.walk(local_dir):
+        rel = relpath(path, local_dir)
+        depth = 0 if rel == "." else rel.count(os.sep) + 1
+        folders.setdefault(depth + 1, []).extend(os.path.normpath(join(rel, d)) for d in dirs)
+        files.setdefault(depth, []).extend(os.path.normpath(join(rel, n)) for n in names)
+    return folders, files
 
 class Drive():
     """Handles interactions with the Google Drive filesystem."""
+    # pylint: disable=R0904
 
     def __init__(self,
             scope=DRIVE_READONLY,
             credentials="credentials.json",
-            token="token.json"):
+            token="token.json",
+            cache_dir=None,
+            listing_ttl=DEFAULT_LISTING_TTL):
         self.__api = DriveApi(scope, credentials, token)
-        self.fs = Filesystem()
+        # Where we keep state that needs to survive a restart, like resumable upload sessions
+        self.__state_dir = cache_dir if cache_dir is not None else user_cache_dir()
+
+        self.fs = open_filesystem(token, cache_dir, listing_ttl)
+        if cache_dir is not None:
+            self.sync()
 
     def __files(self):
         return self.__api.files()
@@ -33,87 +146,322 @@ class Drive():
         """Removes a file from our internal cache of the Drive fs."""
         self.fs.remove_file(f)
 
+    def __root_id(self) -> str:
+        """Returns the real id of the root folder, which children reference in their parents."""
+
+        if self.fs.root_id is None:
+            root = self.__files().get(fileId="root", fields="id").execute()
+            self.fs.set_root_id(root["id"])
+        assert self.fs.root_id is not None
+        return self.fs.root_id
+
+    def __list_pages(self, query : str, page_size : int = MAX_PAGE_SIZE,
+                     fields : str = FILE_FIELDS, order_by : Optional[str] = None) -> Iterator[List[Dict]]:
+        """Runs the query and yields the raw file entries of each result page."""
+
+        page_token = None
+        while True:
+            results = self.__files().list(
+                pageSize=page_size,
+                pageToken=page_token,
+                q=query,
+                orderBy=order_by,
+                fields="nextPageToken, files(%s)" % (fields)).execute()
+            yield results.get('files', [])
+
+            page_token = results.get('nextPageToken')
+            if page_token is None:
+                return
+
+    def sync(self) -> None:
+        """Catches up the persistent cache with the changes that happened since the last run."""
+
+        cache = self.fs.cache
+        if cache is None:
+            return
+
+        self.__root_id()
+
+        page_token = cache.get_meta("changes_page_token")
+        if page_token is None:
+            # Nothing is cached yet, so we only need to remember where to start next time.
+            start = self.__api.changes().getStartPageToken().execute()
+            cache.set_meta("changes_page_token", start["startPageToken"])
+            return
+
+        while page_token is not None:
+            results = self.__api.changes().list(
+                pageToken=page_token,
+                pageSize=1000,
+                includeRemoved=True,
+                spaces="drive",
+                fields=CHANGE_FIELDS).execute()
+            for change in results.get("changes", []):
+                self.fs.apply_change(change)
+
+            if "newStartPageToken" in results:
+                cache.set_meta("changes_page_token", results["newStartPageToken"])
+            page_token = results.get("nextPageToken")
+
     def __locate_file(self, remote : str) -> bool:
         """Returns true if the file exists on the remote Drive fs."""
+        return self.resolve(remote) is not None
+
+    def resolve(self, path : str) -> Optional[File]:
+        """Finds the file at the path, looking up only the unknown path components by name.
 
-        if self.fs.file_exists_at_path(remote):
-            return True
+        Drive allows several files with the same name in a folder. In that case folders are preferred
+        for the components leading up to the file, then the oldest file wins."""
+        return self.__resolve(absolute_path(path), False)
 
-        self.ls(dirname(remote))
-        return self.fs.file_exists_at_path(remote)
+    def __resolve(self, path : str, want_dir : bool) -> Optional[File]:
+        if self.fs.file_exists_at_path(path):
+            return self.fs.by_path(path)
+
+        parent_path = dirname(path)
+        if parent_path == path:
+            return None
+        parent = self.__resolve(parent_path, True)
+        if parent is None or not parent.is_dir or self.fs.is_fresh(parent):
+            # A folder that was just listed completely has no children we don't know about
+            return None
+
+        matches : List[Dict] = []
+        for page in self.__list_pages(name_query(basename(path), parent.id), fields=RESOLVE_FIELDS):
+            matches.extend(page)
+        if len(matches) == 0:
+            return None
+        return self.__add_file(parent_path, best_match(matches, want_dir))
 
     def ls(self, path : str) -> List[File]:
         """Tries to find the file at the path and all its children if it's a folder."""
+        return list(self.iter_ls(path))
 
-        if not self.fs.file_exists_at_path(path):
-            parent = dirname(path)
-            if parent == path:
-                assert path == "/"
-            self.ls(parent)
-            if not self.fs.file_exists_at_path(path):
-                return []
-
-        parent = self.fs.by_path(path).id
-
-        query = "'%s' in parents" % (parent)
-        fields = "nextPageToken, files(%s)" % (FILE_FIELDS)
-
-        results = self.__files().list(pageSize=500, q=query, fields=fields).execute()
-        items = results.get('files', [])
-        if items:
-            files : List[File] = []
-            for data in items:
-                f = self.__add_file(path, data)
-                if f is not None:
-                    files.append(f)
-            return files
-        return []
+    def iter_ls(self, path : str, page_size : int = MAX_PAGE_SIZE, fields : str = FILE_FIELDS,
+                order_by : Optional[str] = None) -> Iterator[File]:
+        """Like ls, but yields the children page by page as they arrive.
+
+        The [fields] need to include at least the FILE_FIELDS. [order_by] is passed on to the
+        API (e.g. 'folder,name'), so that sorted listings can still be streamed.
+        Folders that were listed completely within the listing TTL are served from memory."""
+
+        folder = self.resolve(path)
+        if folder is None:
+            return
+
+        if folder.is_dir and fields == FILE_FIELDS and self.fs.is_fresh(folder):
+            yield from sort_files(self.fs.children(folder), order_by)
+            return
 
-    def download(self, remote : str, local : str) -> None:
-        """Downloads the contents of the [remote] file and writes them to the [local] target."""
+        query = "'%s' in parents" % (folder.id)
 
-        if not self.fs.file_exists_at_path(remote):
+        listed : List[str] = []
+        for page in self.__list_pages(query, page_size, fields, order_by):
+            files = self.fs.add_files([File(folder.path, data) for data in page])
+            listed.extend(f.id for f in files)
+            yield from files
+        if folder.is_dir:
+            self.fs.mark_listed(folder, listed)
+
+    def download(self, remote : str, local : str, workers : int = 1, part_size : int = DEFAULT_PART_SIZE) -> Optional[int]:
+        """Downloads the contents of the [remote] file, writes them to the [local] target and returns the bytes
+        transferred, or None if there is no file to download.
+
+        Large files are written to [local].partial first, and an interrupted download continues where
+        it stopped as long as the remote file didn't change. With [workers] > 1, files larger than
+        [part_size] are fetched as concurrent byte ranges."""
+
+        f = self.resolve(remote)
+        if f is None:
             print("Can not download the file because we can't find anything at that path.", remote)
             return None
 
-        f = self.fs.by_path(remote)
-
         if f.is_dir:
             print("Can not download a directory.", remote)
             return None
 
+        return self.download_file(f, local, workers, part_size)
 
-        request = self.__files().get_media(fileId=f.id)
-        fh = io.FileIO(local, 'wb')
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            _status, done = downloader.next_chunk()
+    def download_file(self, f : File, local : str, workers : int = 1, part_size : int = DEFAULT_PART_SIZE) -> int:
+        """Downloads a single file we already know. Safe to call from worker threads.
 
-    def mv(self, path : str, to_folder : str) -> Optional[File]:
-        """Move the file at [path] to the given folder"""
+        Files larger than a single range request are downloaded resumably via a .partial file."""
+
+        def new_request():
+            return self.__files().get_media(fileId=f.id)
 
-        f = self.fs.by_path(path)
-        folder_id = self.fs.by_path(to_folder).id
+        size, md5, modified_time = f.size, f.md5, f.modified
+        if size is None:
+            # Files loaded from the cache don't know their size and checksum
+            data = self.__files().get(fileId=f.id, fields="size, md5Checksum, modifiedTime").execute()
+            size, md5, modified_time = int(data.get("size", 0)), data.get("md5Checksum"), data.get("modifiedTime")
 
-        # Retrieve the existing parents to remove
-        old_data = self.__files().get(fileId=f.id, fields='parents').execute()
-        previous_parents = ",".join(old_data.get('parents'))
-        # Move the f to the new folder
-        new_data = self.__files().update(
-            fileId=f.id,
-            addParents=folder_id,
-            removeParents=previous_parents,
-            fields=FILE_FIELDS).execute()
+        if size <= RANGE_CHUNK_SIZE:
+            return download_media(new_request(), local)
+        checkpoint = DownloadCheckpoint.start(local, f.id, md5 or modified_time, size, part_size if workers > 1 else size)
+        return download_resumable(new_request, checkpoint, workers)
 
-        self.__rm_file(f)
-        return self.__add_file(to_folder, new_data)
+    def download_tree(self, remote_dir : str, local_dir : str, workers : int = 4) -> Optional[TransferStats]:
+        """Mirrors the folder hierarchy at [remote_dir] into [local_dir], downloading [workers] files at a time."""
+
+        folder = self.resolve(remote_dir)
+        if folder is None or not folder.is_dir:
+            print("Can not download the tree because there is no folder at that path.", remote_dir)
+            return None
+
+        self.ls_all(folder.path, max_workers=workers)
+        files = self.fs.files_below(folder.path)
+
+        # Create the local directories up front, so that the workers only have to write files
+        os.makedirs(local_dir, exist_ok=True)
+        for f in files:
+            if f.is_dir:
+                os.makedirs(join(local_dir, relpath(f.path, folder.path)), exist_ok=True)
+
+        downloadable = []
+        for f in files:
+            if f.is_dir:
+                continue
+            if not f.is_downloadable:
+                print("Skipping %s, because Google Docs can't be downloaded." % (f.path))
+                continue
+            downloadable.append(f)
+
+        stats = TransferStats()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for f, target in local_targets(downloadable, folder.path, local_dir):
+                futures[pool.submit(self.download_file, f, target)] = f
+
+            for future in as_completed(futures):
+                try:
+                    stats.add(future.result())
+                except HttpError as e:
+                    stats.fail()
+                    print("Failed to download %s: %s" % (futures[future].path, e))
+        stats.finish()
+
+        print(stats.summary("Downloaded"))
+        return stats
+
+    def mv(self, path : str, to_folder : str) -> Optional[File]:
+        """Move the file at [path] to the given folder"""
+
+        moved = self.mv_many([path], to_folder)
+        return moved[0] if len(moved) > 0 else None
+
+    def mv_many(self, paths : List[str], to_folder : str) -> List[File]:
+        """Moves all files at the [paths] to the given folder with as few batch requests as possible.
+
+        Returns the moved files. Files that couldn't be found or moved are reported and skipped."""
+        return self.mv_files(self.__resolve_all(paths), to_folder)
+
+    def mv_files(self, files : List[File], to_folder : str) -> List[File]:
+        """Like mv_many, but for files that were already looked up (e.g. by glob), which also tells
+        apart files with the same path."""
+
+        folder = self.resolve(to_folder)
+        if folder is None or not folder.is_dir:
+            print("Can not move the files because there is no folder at the path.", to_folder)
+            return []
+
+        requests = []
+        for f in unique_files(files):
+            # Our fs already knows the parents, so they don't need to be fetched first
+            request = self.__files().update(
+                fileId=f.id,
+                addParents=folder.id,
+                removeParents=",".join(f.parents),
+                fields=FILE_FIELDS)
+            requests.append((f, request))
+
+        moved = []
+        for f, data, error in self.__execute_batches(requests):
+            if error is not None:
+                print("Failed to move %s: %s" % (f.path, error))
+                self.__forget_if_gone(f, error)
+                continue
+            # Adding it at the new path re-paths everything below it
+            new_file = self.__add_file(folder.path, data)
+            if new_file is not None:
+                moved.append(new_file)
+        return moved
+
+    def __resolve_all(self, paths : List[str]) -> List[File]:
+        files = []
+        for path in paths:
+            f = self.resolve(path)
+            if f is None:
+                print("Can not find anything at the path.", path)
+            else:
+                files.append(f)
+        return files
+
+    def __execute_batches(self, requests : List[Tuple[Any, Any]]) -> List[Tuple[Any, Any, Optional[HttpError]]]:
+        """Sends the (key, request) pairs in batches of up to MAX_BATCH_SIZE calls.
+
+        Returns each key (e.g. the file a call is about) with either the response of its call or the
+        error that the call failed with. Calls that were throttled are sent again after a backoff."""
+
+        results = []
+        attempt = 0
+        while len(requests) > 0:
+            retry = []
+            for start in range(0, len(requests), MAX_BATCH_SIZE):
+                chunk = requests[start:start + MAX_BATCH_SIZE]
+                for (key, request), (response, error) in zip(chunk, self.__execute_batch(chunk)):
+                    if error is not None and is_retryable(error.resp, error.content) and attempt < MAX_RETRIES:
+                        retry.append((key, request))
+                    else:
+                        results.append((key, response, error))
+            if len(retry) > 0:
+                time.sleep(backoff_delay(attempt))
+            requests = retry
+            attempt += 1
+        return results
+
+    def __execute_batch(self, requests : List[Tuple[Any, Any]]) -> List[Tuple[Any, Optional[HttpError]]]:
+        """Returns the response or error of each call, in the order of the requests."""
+
+        responses : Dict[str, Tuple[Any, Optional[HttpError]]] = {}
+
+        def callback(request_id, response, exception):
+            responses[request_id] = (response, exception)
+
+        batch = self.__api.new_batch_http_request(callback)
+        for i, (_key, request) in enumerate(requests):
+            batch.add(request, request_id=str(i))
+        batch.execute()
+
+        return [responses[str(i)] for i in range(len(requests))]
+
+    def __forget_if_gone(self, f : File, error : HttpError) -> None:
+        if error.resp.status == 404:
+            # Somebody else deleted it already, so our fs is stale
+            self.__rm_file(f)
+
+    def glob(self, pattern : str) -> List[File]:
+        """Returns the files whose paths match the pattern, which may use shell wildcards in any component.
+
+        Folders with wildcards below them are listed, the other components are only resolved."""
+
+        matches = [ self.fs.by_path("/") ]
+        for component in [c for c in pattern.split("/") if c != ""]:
+            if not any(c in component for c in "*?["):
+                matches = [f for f in (self.resolve(join(m.path, component)) for m in matches if m.is_dir) if f is not None]
+                continue
+            expanded : List[File] = []
+            for m in matches:
+                if m.is_dir:
+                    expanded.extend(f for f in self.ls(m.path) if fnmatch.fnmatchcase(f.name, component))
+            matches = expanded
+        return sorted(matches, key=lambda f: f.path)
 
     def mkdir(self, remote : str) -> Optional[File]:
         """Creates a new folder if nothing exists at that path yet."""
 
-        self.ls(dirname(remote))
-        if self.fs.file_exists_at_path(remote):
+        remote = absolute_path(remote)
+        if self.__locate_file(remote):
             # Something already exists at that path
             print("Can not create directory because something already exists at the path.", remote)
             return None
@@ -121,43 +469,273 @@ class Drive():
         folder_name = basename(remote)
         parent_path = dirname(remote)
 
-        parent = self.fs.by_path(parent_path).id
+        parent = self.resolve(parent_path)
+        if parent is None:
+            print("Can not create directory because the parent folder does not exist.", parent_path)
+            return None
 
         file_metadata = {
             "name": folder_name,
-            "mimeType": 'application/vnd.google-apps.folder',
-            "parents": [parent]
+            "mimeType": File.FOLDER_MIME_TYPE,
+            "parents": [parent.id]
         }
         f = self.__files().create(body=file_metadata, fields=FILE_FIELDS).execute()
-        return self.__add_file(parent_path, f)
+        folder = self.__add_file(parent.path, f)
+        if folder is not None:
+            # It's empty, so its children don't need to be looked up
+            self.fs.mark_listed(folder)
+        return folder
+
+    def makedirs(self, remote : str) -> Optional[File]:
+        """Creates the folder at [remote] together with all missing parents (like mkdir -p) and returns it."""
+
+        remote = absolute_path(remote)
+        f = self.resolve(remote)
+        if f is not None:
+            if not f.is_dir:
+                print("Can not create directory because a file exists at the path.", remote)
+                return None
+            return f
+
+        if self.makedirs(dirname(remote)) is None:
+            return None
+        return self.mkdir(remote)
 
+    def upload(self, local : str, remote : str, chunk_size : int = DEFAULT_UPLOAD_CHUNK_SIZE,
+               progress : Optional[Callable[[int, int], None]] = None) -> Optional[File]:
+        """Upload the given [local] file to the [remote] location
 
-    def upload(self, local : str, remote : str) -> Optional[File]:
-        """Upload the given [local] file to the [remote] location"""
+        Small files are sent in a single request. Larger ones are uploaded resumably in chunks of
+        [chunk_size] bytes (a multiple of 256 KB), and an interrupted upload continues where it
+        stopped when it's retried. [progress] is called with the bytes sent and the total size."""
 
+        remote = absolute_path(remote)
         file_name = basename(remote)
         parent_path = dirname(remote)
 
         if self.__locate_file(remote):
             print("Can not upload file because the remote file exists already.", remote)
             return None
-        if not self.__locate_file(parent_path):
+        parent = self.resolve(parent_path)
+        if parent is None:
             print("Can not upload file because folder does not exist.", parent_path)
             return None
 
-        file_metadata = {'name': file_name, 'parents': [ self.fs.by_path(parent_path).id ]}
-        media = MediaFileUpload(local)
-        f = self.__files().create(body=file_metadata, media_body=media, fields=FILE_FIELDS).execute()
-        return self.__add_file(parent_path, f)
+        file_metadata = {'name': file_name, 'parents': [ parent.id ]}
+
+        def new_request(media):
+            return self.__files().create(body=file_metadata, media_body=media, fields=FILE_FIELDS)
+
+        f = self.__send_media(local, new_request, parent.id, file_name, chunk_size, progress)
+        return self.__add_file(parent.path, f)
+
+    def update(self, local : str, remote : str, chunk_size : int = DEFAULT_UPLOAD_CHUNK_SIZE,
+               progress : Optional[Callable[[int, int], None]] = None) -> Optional[File]:
+        """Replaces the contents of the existing [remote] file with the [local] file (see upload)."""
+
+        f = self.resolve(remote)
+        if f is None or f.is_dir:
+            print("Can not update the file because there is no file at the path.", remote)
+            return None
+
+        data = self.__update_file(local, f, chunk_size, progress)
+        return self.__add_file(dirname(f.path), data)
+
+    def upload_files(self, uploads : List[Tuple[str, str]], workers : int = 4,
+                     chunk_size : int = DEFAULT_UPLOAD_CHUNK_SIZE) -> List[Tuple[str, Optional[File], Optional[HttpError]]]:
+        """Uploads each (local, remote) pair with [workers] files at a time, creating the missing folders and
+        replacing the contents of files that exist already (like update).
+
+        Returns each remote path in the order of the [uploads], with the uploaded file or with None and the error
+        it failed with (or None, if the file couldn't be uploaded at all, which is reported)."""
+        # pylint: disable=R0914
+
+        results : List[Tuple[str, Optional[File], Optional[HttpError]]] = []
+        # Folders are created and looked up on this thread, so the workers only send the contents
+        prepared = []
+        for local, remote in uploads:
+            remote = absolute_path(remote)
+            results.append((remote, None, None))
+            f = self.resolve(remote)
+            if f is not None and f.is_dir:
+                print("Can not upload file because a folder exists at the path.", remote)
+                continue
+            parent = self.makedirs(dirname(remote)) if f is None else None
+            if f is None and parent is None:
+                continue
+            prepared.append((len(results) - 1, local, f, parent))
+        ids = self.__generate_ids(sum(1 for _i, _local, f, _parent in prepared if f is None))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for index, local, f, parent in prepared:
+                if f is not None:
+                    future = pool.submit(self.__update_file, local, f, chunk_size)
+                else:
+                    assert parent is not None
+                    future = pool.submit(self.__upload_file, local, parent, ids.pop(), chunk_size,
+                                         basename(results[index][0]))
+                futures[future] = index
+
+            for future in as_completed(futures):
+                index = futures[future]
+                remote = results[index][0]
+                try:
+                    data = future.result()
+                except HttpError as e:
+                    results[index] = (remote, None, e)
+                    continue
+                results[index] = (remote, self.__add_file(dirname(remote), data), None)
+        return results
+
+    def upload_tree(self, local_dir : str, remote_dir : str, workers : int = 4,
+                    chunk_size : int = DEFAULT_UPLOAD_CHUNK_SIZE) -> Optional[TransferStats]:
+        """Mirrors the folder hierarchy at [local_dir] into [remote_dir], uploading [workers] files at a time.
+
+        Missing folders are created level by level in batch requests, with ids that are generated up front.
+        The files of a folder start uploading as soon as it exists. Files that exist already are skipped."""
+        # pylint: disable=R0914
+
+        if not os.path.isdir(local_dir):
+            print("Can not upload the tree because there is no local directory at that path.", local_dir)
+            return None
+        root = self.makedirs(remote_dir)
+        if root is None:
+            return None
+        self.ls_all(root.path, max_workers=workers)
+
+        folders, files = walk_by_depth(local_dir)
+        # Enough ids for everything, so that nothing needs to be looked up after it was created
+        ids = self.__generate_ids(sum(len(rels) for rels in folders.values()) + sum(len(rels) for rels in files.values()))
+
+        stats = TransferStats()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures : Dict[Future, str] = {}
+            for depth in range(0, max(list(files.keys()) + list(folders.keys())) + 1):
+                # The folders at this depth only need their parents, which were created in the previous round
+                self.__create_folders(folders.get(depth, []), root.path, ids)
+
+                pending = []
+                for rel in files.get(depth, []):
+                    remote = join(root.path, rel.replace(os.sep, "/"))
+                    if self.fs.file_exists_at_path(remote):
+                        print("Skipping %s, because the remote file exists already." % (remote))
+                    elif self.fs.file_exists_at_path(dirname(remote)):
+                        pending.append((rel, remote))
+                    else:
+                        print("Skipping %s, because its folder couldn't be created." % (remote))
+                        stats.fail()
+                for rel, remote in pending:
+                    future = pool.submit(self.__upload_file, join(local_dir, rel), self.fs.by_path(dirname(remote)),
+                                         ids.pop(), chunk_size)
+                    futures[future] = remote
+            self.__collect_uploads(futures, stats)
+        stats.finish()
+
+        print(stats.summary("Uploaded"))
+        return stats
+
+    def __collect_uploads(self, futures : Dict[Future, str], stats : TransferStats) -> None:
+        """Adds the uploaded files to our fs as they complete, which only happens on this thread."""
+
+        for future in as_completed(futures):
+            try:
+                data = future.result()
+            except HttpError as e:
+                stats.fail()
+                print("Failed to upload %s: %s" % (futures[future], e))
+                continue
+            self.__add_file(dirname(futures[future]), data)
+            stats.add(int(data.get("size", 0)))
+
+    def __create_folders(self, rels : List[str], base_path : str, ids : List[str]) -> None:
+        """Creates the folders at the relative paths below [base_path] that don't exist yet with batch requests.
+        Takes their ids from the pre-generated [ids]."""
+
+        missing = []
+        for rel in rels:
+            remote = join(base_path, rel.replace(os.sep, "/"))
+            if not self.fs.file_exists_at_path(remote) and self.fs.file_exists_at_path(dirname(remote)):
+                missing.append(remote)
+
+        requests = []
+        for remote in missing:
+            file_metadata = {
+                "id": ids.pop(),
+                "name": basename(remote),
+                "mimeType": File.FOLDER_MIME_TYPE,
+                "parents": [self.fs.by_path(dirname(remote)).id]
+            }
+            requests.append((remote, self.__files().create(body=file_metadata, fields=FILE_FIELDS)))
+
+        for remote, data, error in self.__execute_batches(requests):
+            if error is not None:
+                print("Failed to create the folder %s: %s" % (remote, error))
+            else:
+                self.__add_file(dirname(remote), data)
+
+    def __generate_ids(self, count : int) -> List[str]:
+        """Returns [count] ids for new files, so that they don't need to be looked up after creating them."""
+
+        ids : List[str] = []
+        while len(ids) < count:
+            result = self.__files().generateIds(count=min(count - len(ids), MAX_PAGE_SIZE), space="drive").execute()
+            ids.extend(result["ids"])
+        return ids
+
+    def __upload_file(self, local : str, parent : File, file_id : str, chunk_size : int, name : Optional[str] = None):
+        """Uploads a new file below the [parent] with the given id (and the [name] of the local file if there is
+        none). Safe to call from worker threads."""
+
+        name = name if name is not None else basename(local)
+        file_metadata = {'id': file_id, 'name': name, 'parents': [ parent.id ]}
+
+        def new_request(media):
+            return self.__files().create(body=file_metadata, media_body=media, fields=FILE_FIELDS)
+
+        return self.__send_media(local, new_request, parent.id, name, chunk_size, None)
+
+    def __update_file(self, local : str, f : File, chunk_size : int,
+                      progress : Optional[Callable[[int, int], None]] = None):
+        """Replaces the contents of the file. Safe to call from worker threads."""
+
+        def new_request(media):
+            return self.__files().update(fileId=f.id, media_body=media, fields=FILE_FIELDS)
+
+        return self.__send_media(local, new_request, f.id, f.name, chunk_size, progress)
+
+    def __send_media(self, local : str, new_request : Callable, target_id : str, name : str, chunk_size : int,
+                     progress : Optional[Callable[[int, int], None]]):
+        """Sends the [local] file with the request that new_request(media_body) creates. Small files are sent
+        at once, large ones resumably with a session that is keyed by the [target_id] and [name]."""
+        # pylint: disable=R0913
+
+        if os.path.getsize(local) <= RESUMABLE_THRESHOLD:
+            return new_request(MediaFileUpload(local)).execute()
+
+        request = new_request(MediaFileUpload(local, chunksize=chunk_size, resumable=True))
+        session = UploadSession(join(self.__state_dir, "uploads"), local, target_id, name)
+        return upload_resumable(request, session, progress)
 
     def print_fs(self) -> None:
         """Prints information about all files that are currently cached locally."""
         self.fs.print()
 
-    def ls_all(self) -> None:
-        """Retrieves information about all non-trashed files in the drive"""
+    def ls_all(self, path : str = "/", flat : bool = False, max_workers : int = 1) -> None:
+        """Retrieves information about all non-trashed files in the drive (or below the given path).
 
-        frontier = [ "/" ]
+        With [flat] the whole drive is listed in a single paged query, independent of the path.
+        With [max_workers] > 1 the folders are listed concurrently."""
+
+        if flat:
+            self.__ls_all_flat()
+            return
+        path = absolute_path(path)
+        if max_workers > 1:
+            self.__ls_all_concurrent(path, max_workers)
+            return
+
+        frontier = [ path ]
         while len(frontier) > 0:
             path = frontier.pop(0)
             children = self.ls(path)
@@ -165,18 +743,105 @@ class Drive():
                 if f.is_dir and not f.trashed:
                     frontier.append(f.path)
 
+    def __ls_all_flat(self) -> None:
+        """Pages through every non-trashed file at once and rebuilds the tree from the parents."""
+
+        children : Dict[str, List[Dict]] = {}
+        for page in self.__list_pages("trashed = false"):
+            for data in page:
+                # Every file gets a single path in our fs, so like ls we only follow the first parent.
+                parents = data.get('parents', [])
+                if len(parents) > 0:
+                    children.setdefault(parents[0], []).append(data)
+
+        # Parents may be listed after their children, so paths are only assigned once everything is known.
+        # Files that can't be reached from the root (e.g. shared with us, or in folders we can't see) are skipped.
+        frontier = [ ("/", self.__root_id()) ]
+        while len(frontier) > 0:
+            path, folder_id = frontier.pop()
+            files = self.fs.add_files([File(path, data) for data in children.pop(folder_id, [])])
+            self.fs.mark_listed(self.fs.by_path(path), [f.id for f in files])
+            for f in files:
+                if f.is_dir:
+                    frontier.append((f.path, f.id))
+
+    def __list_children(self, folder_ids : List[str]) -> List[Dict]:
+        """Lists the children of all given folders with a single (paged) query. Runs on worker threads."""
+
+        query = "(%s) and trashed = false" % (" or ".join("'%s' in parents" % (folder_id) for folder_id in folder_ids))
+        items : List[Dict] = []
+        for page in self.__list_pages(query):
+            items.extend(page)
+        return items
+
+    def __ls_all_concurrent(self, path : str, max_workers : int) -> None:
+        """Lists the tree below [path] breadth-first with a pool of workers.
+
+        Sibling folders are coalesced into multi-parent queries and the results are split up by parent.
+        Only the workers talk to the API, our fs is only touched from this thread."""
+
+        start = self.resolve(path)
+        if start is None or not start.is_dir:
+            return
+
+        root_id = self.__root_id()
+        pending : List[File] = [ start ]
+        running : Dict[Future, Dict[str, File]] = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < max_workers:
+                    # Don't coalesce so much that workers stay idle
+                    size = min(PARENTS_PER_QUERY, math.ceil(len(pending) / (max_workers - len(running))))
+                    batch, pending = pending[:size], pending[size:]
+                    # Children reference the real id of the root folder, not its 'root' alias
+                    folders = { (root_id if f.id == "root" else f.id): f for f in batch }
+                    running[pool.submit(self.__list_children, list(folders.keys()))] = folders
+
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    files = self.__add_children(running.pop(future), future.result())
+                    pending.extend(f for f in files if f.is_dir)
+
+    def __add_children(self, folders : Dict[str, File], items : List[Dict]) -> List[File]:
+        """Adds the results of a multi-parent query to our fs, each below the folder it was listed for."""
+
+        files = []
+        for data in items:
+            parent = next(folders[p] for p in data.get('parents', []) if p in folders)
+            files.append(File(parent.path, data))
+        added = self.fs.add_files(files)
+        for folder in folders.values():
+            self.fs.mark_listed(folder, [f.id for f in added if dirname(f.path) == folder.path])
+        return added
+
     def rm(self, remote) -> None:
         """Moves the given file to the trash."""
 
-        if not self.__locate_file(remote):
-            print("Can not find anything at the path.", remote)
-            return None
+        self.rm_many([remote])
+
+    def rm_many(self, paths : List[str]) -> List[File]:
+        """Moves all files at the [paths] to the trash with as few batch requests as possible.
+
+        Returns the trashed files. Files that couldn't be found or trashed are reported and skipped."""
+
+        return self.rm_files(self.__resolve_all(paths))
+
+    def rm_files(self, files : List[File]) -> List[File]:
+        """Like rm_many, but for files that were already looked up (e.g. by glob)."""
 
-        f = self.fs.by_path(remote)
         metadata = {
             "trashed": True
         }
-
-        _new_data = self.__files().update(fileId=f.id, body=metadata, fields=FILE_FIELDS).execute()
-        self.__rm_file(f)
-        return None
+        requests = [(f, self.__files().update(fileId=f.id, body=metadata, fields=FILE_FIELDS))
+                    for f in unique_files(files)]
+
+        trashed = []
+        for f, _data, error in self.__execute_batches(requests):
+            if error is not None:
+                print("Failed to move %s to the trash: %s" % (f.path, error))
+                self.__forget_if_gone(f, error)
+                continue
+            self.__rm_file(f)
+            trashed.append(f)
+        return trashed
@@ -1,6 +1,4 @@
-from googleapiclient.discovery import build # type: ignore
-from httplib2 import Http # type: ignore
-from ..api_utils import init_credentials
+from ..api_utils import build_service, get_credentials
 
 DRIVE_READONLY = "https://www.googleapis.com/auth/drive.readonly"
 DRIVE_FULL     = "https://www.googleapis.com/auth/drive"
@@ -10,9 +8,24 @@ class DriveApi:
     """Handles interactions with the Google Drive filesystem."""
 
     def __init__(self, scope, credentials, token) -> None:
-        creds = init_credentials(credentials, token, scope)
-        self.__service = build('drive', 'v3', http=creds.authorize(Http()))
+        self.__scope = scope
+        self.__credentials = credentials
+        self.__token = token
+        # Authorize right away, so that any interactive flow happens before the first request
+        get_credentials(credentials, token, scope)
+
+    def __service(self):
+        # Every thread gets its own service, since the underlying transport is not thread-safe.
+        return build_service('drive', 'v3', self.__credentials, self.__token, self.__scope)
 
     def files(self):
         # pylint: disable=E1101
-        return self.__service.files()
+        return self.__service().files()
+
+    def changes(self):
+        # pylint: disable=E1101
+        return self.__service().changes()
+
+    def new_batch_http_request(self, callback):
+        # pylint: disable=E1101
+        return self.__service().new_batch_http_request(callback=callback)
@@ -1,33 +1,61 @@
+import sys
 import datetime
 from os.path import join
 
 
 class File():
-    """Represents what we know about a file on the Google Drive."""
+    """Represents what we know about a file on the Google Drive.
+
+    Listings can hold millions of files, so only the fields we use are kept (in slots), repeated
+    strings like the mime type and parent ids are interned, and timestamps are parsed on access."""
+
+    FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+    SPREADSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+    # Docs, Sheets, etc. have no binary content and need to be exported instead of downloaded
+    GOOGLE_APPS_MIME_PREFIX = "application/vnd.google-apps."
+
+    __slots__ = ("id", "name", "parents", "mime_type", "trashed", "size", "md5", "modified", "path")
 
     def __init__(self, base_path, data):
-        self.data = data
         self.id = data['id']
         self.name = data['name']
-        self.parents = data['parents']
-        self.is_dir = data['mimeType'] == "application/vnd.google-apps.folder"
+        self.parents = tuple(sys.intern(parent) for parent in data['parents'])
+        self.mime_type = sys.intern(data['mimeType'])
+        self.trashed = data.get("trashed", False)
 
-        if "trashed" in data:
-            self.trashed = data["trashed"]
-        else:
-            self.trashed = False
-
-        if "modifiedTime" in data:
-            self.modified_time = datetime.datetime.strptime(
-                data["modifiedTime"], "%Y-%m-%dT%H:%M:%S.%fZ")
+        # Folders and Google Docs have no size
+        self.size = int(data["size"]) if "size" in data else None
+        self.md5 = data.get("md5Checksum")
+        # The modifiedTime as the API sent it (or None), see modified_time for the parsed value
+        self.modified = data.get("modifiedTime")
 
         self.path = join(base_path, self.name)
 
+    @property
+    def is_dir(self):
+        return self.mime_type == File.FOLDER_MIME_TYPE
+
+    @property
+    def is_spreadsheet(self):
+        return self.mime_type == File.SPREADSHEET_MIME_TYPE
+
+    @property
+    def is_downloadable(self):
+        return not self.mime_type.startswith(File.GOOGLE_APPS_MIME_PREFIX)
+
+    @property
+    def modified_time(self):
+        """The modifiedTime as a datetime, or None if we don't know it."""
+
+        if self.modified is None:
+            return None
+        return datetime.datetime.strptime(self.modified, "%Y-%m-%dT%H:%M:%S.%fZ")
+
     @staticmethod
     def ROOT():
         return File("/", {
             "id": "root",
             "name": "",
             "parents": [],
-            "mimeType": "application/vnd.google-apps.folder"
+            "mimeType": File.FOLDER_MIME_TYPE
         })
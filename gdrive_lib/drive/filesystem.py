@@ -1,26 +1,160 @@
-from typing import List, Optional, Dict
+import time
+from os.path import dirname
+from typing import Iterable, List, Optional, Dict
 from .file import File
+from .cache import FilesystemCache
+
+# How long (in seconds) the children of a completely listed folder are served from memory
+DEFAULT_LISTING_TTL = 60.0
 
 class Filesystem:
+    """Tree index of the files we know about on the Drive.
+
+    Every folder has a map of its children, so that subtrees can be re-pathed or evicted without
+    scanning all paths. Folders that were listed completely remember when that happened, and
+    are considered fresh for [listing_ttl] seconds (0 disables this)."""
+
     __by_id : Dict[str, File]
     __by_path : Dict[str, File]
+    # Keyed by the id of the parent folder within our tree ('root' for the root folder), then by file id
+    __children : Dict[str, Dict[str, File]]
+    __listed_at : Dict[str, float]
+    __cache : Optional[FilesystemCache]
+    root_id : Optional[str]
+    listing_ttl : float
 
-    def __init__(self):
+    def __init__(self, cache : Optional[FilesystemCache] = None, listing_ttl : float = DEFAULT_LISTING_TTL):
         self.__by_id = {}
         self.__by_path = {}
+        self.__children = {}
+        self.__listed_at = {}
+        self.__cache = None
+        self.root_id = None
+        self.listing_ttl = listing_ttl
         self.add_file(File.ROOT())
-    
+
+        if cache is not None:
+            # Parents have shorter paths than their children, so they are always linked first
+            self.add_files(sorted(cache.load(), key=lambda f: len(f.path)))
+            root_id = cache.get_meta("root_id")
+            if root_id is not None:
+                self.set_root_id(root_id)
+            self.__cache = cache
+
+    @property
+    def cache(self) -> Optional[FilesystemCache]:
+        return self.__cache
+
     def add_file(self, file : File) -> Optional[File]:
         if not file.trashed:
-            self.__by_id[file.id] = file
-            self.__by_path[file.path] = file
+            self.add_files([file])
             return file
         else:
             return None
 
+    def add_files(self, files : Iterable[File]) -> List[File]:
+        """Adds all non-trashed files and writes them to the cache in one go.
+
+        If a known file shows up at a different path it was moved or renamed, and everything below it is re-pathed."""
+
+        added = [f for f in files if not f.trashed]
+        moved : List[File] = []
+        for f in added:
+            known = self.__by_id.get(f.id)
+            if known is not None and known.path != f.path:
+                moved.extend(self.__repath_below(known, f.path))
+            if known is not None:
+                self.__unlink(known)
+            self.__link(f)
+        if self.__cache is not None and len(added) + len(moved) > 0:
+            self.__cache.put(added + moved)
+        return added
+
     def remove_file(self, file : File) -> None:
-        del self.__by_id[file.id]
-        del self.__by_path[file.path]
+        """Removes the file and, if it's a folder, everything we know below it."""
+
+        removed = [file] + self.__descendants(file)
+        for f in removed:
+            self.__unlink(f)
+            if self.__by_id.get(f.id) is f:
+                del self.__by_id[f.id]
+            self.__children.pop(f.id, None)
+            self.__listed_at.pop(f.id, None)
+        if self.__cache is not None:
+            self.__cache.delete([f.id for f in removed])
+
+    def apply_change(self, change : Dict) -> None:
+        """Updates the tree with a single entry from the changes feed."""
+
+        known = self.by_id(change["fileId"])
+        data = change.get("file")
+
+        if change.get("removed") or data is None or data.get("trashed"):
+            if known is not None:
+                self.remove_file(known)
+            return
+
+        parents = [self.by_id(parent_id) for parent_id in data.get("parents", [])]
+        parent = next((p for p in parents if p is not None), None)
+
+        if parent is not None:
+            # Renames and moves re-path everything below the file
+            self.add_file(File(parent.path, data))
+        elif known is not None:
+            # Moved somewhere we don't know, so its whole subtree is gone from our tree
+            self.remove_file(known)
+
+    def __parent(self, file : File) -> Optional[File]:
+        parent_path = dirname(file.path)
+        if parent_path == file.path:
+            return None
+        return self.__by_path.get(parent_path)
+
+    def __link(self, file : File) -> None:
+        self.__by_id[file.id] = file
+        self.__by_path[file.path] = file
+        parent = self.__parent(file)
+        if parent is not None:
+            self.__children.setdefault(parent.id, {})[file.id] = file
+
+    def __unlink(self, file : File) -> None:
+        """Takes the file out of its parent and the path index, but keeps its children."""
+
+        parent = self.__parent(file)
+        if parent is not None and parent.id in self.__children:
+            self.__children[parent.id].pop(file.id, None)
+        if self.__by_path.get(file.path) is file:
+            del self.__by_path[file.path]
+
+    def __descendants(self, folder : File) -> List[File]:
+        result : List[File] = []
+        frontier = [ folder ]
+        while len(frontier) > 0:
+            children = list(self.__children.get(frontier.pop().id, {}).values())
+            result.extend(children)
+            frontier.extend(children)
+        return result
+
+    def __repath_below(self, folder : File, new_path : str) -> List[File]:
+        """Moves everything below the folder to the new path and returns the moved files."""
+
+        descendants = self.__descendants(folder)
+        prefix_length = len(folder.path)
+        for f in descendants:
+            if self.__by_path.get(f.path) is f:
+                del self.__by_path[f.path]
+        for f in descendants:
+            f.path = new_path + f.path[prefix_length:]
+            self.__by_path[f.path] = f
+        return descendants
+
+    def set_root_id(self, root_id : str) -> None:
+        """Registers the real id of the root folder, which files use in their parents."""
+
+        self.root_id = root_id
+        self.__by_id[root_id] = self.__by_path["/"]
+        if self.__cache is not None:
+            self.__cache.set_meta("root_id", root_id)
 
     def file_exists_at_path(self, path : str) -> bool:
         return path in self.__by_path
@@ -30,14 +164,42 @@ class Filesystem:
             return self.__by_id[file_id]
         else:
             return None
-    
+
     def by_path(self, path) -> File:
         if path in self.__by_path:
             return self.__by_path[path]
         else:
-            raise BaseException("Looking up unknown file")
+            raise KeyError("Looking up unknown file %s" % (path))
+
+    def children(self, folder : File) -> List[File]:
+        """Returns the known children of the folder."""
+        return list(self.__children.get(folder.id, {}).values())
+
+    def mark_listed(self, folder : File, listed_ids : Optional[Iterable[str]] = None) -> None:
+        """Records that all children of the folder were just listed.
+
+        With [listed_ids], known children that weren't part of the listing are evicted."""
+
+        if listed_ids is not None:
+            listed = set(listed_ids)
+            for child in self.children(folder):
+                if child.id not in listed:
+                    self.remove_file(child)
+        self.__listed_at[folder.id] = time.monotonic()
+
+    def is_fresh(self, folder : File) -> bool:
+        """Returns true if the folder was listed completely within the last [listing_ttl] seconds."""
+
+        listed_at = self.__listed_at.get(folder.id)
+        return listed_at is not None and time.monotonic() - listed_at < self.listing_ttl
+
+    def files_below(self, path : str) -> List[File]:
+        """Returns all known files below the given folder path."""
+
+        if path not in self.__by_path:
+            return []
+        return self.__descendants(self.__by_path[path])
 
     def print(self) -> None:
         for path, _f in sorted(self.__by_path.items()):
             print(path)
-
@@ -0,0 +1,277 @@
+"""Keeps a local folder and a Drive folder in sync, transferring only what changed."""
+
+import os
+import json
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from os.path import join, dirname, relpath
+from googleapiclient.errors import HttpError # type: ignore
+from .drive import Drive, absolute_path
+from .file import File
+from .transfer import TransferStats, format_size
+
+# Both live in the local folder and are never synced themselves
+MANIFEST_NAME = ".gdrive-manifest.json"
+TRASH_DIR = ".gdrive-trash"
+
+DOWNLOAD = "download"
+UPLOAD = "upload"
+UPDATE = "update"
+DELETE = "delete"
+
+class Manifest:
+    """Remembers what was transferred last time for each relative path, on both sides.
+
+    An entry holds the remote id, md5, size and modifiedTime, and the local size and mtime.
+    A file is unchanged on a side if it still matches what the entry recorded for that side."""
+
+    entries : Dict[str, Dict]
+
+    def __init__(self, local_dir : str) -> None:
+        self.path = join(local_dir, MANIFEST_NAME)
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                self.entries = json.load(fh)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, rel : str) -> Optional[Dict]:
+        return self.entries.get(rel)
+
+    def record(self, rel : str, remote : File, local : str) -> None:
+        stat = os.stat(local)
+        self.entries[rel] = {
+            "id": remote.id,
+            "md5": remote.md5,
+            "size": remote.size,
+            "modified": remote.modified,
+            "local_size": stat.st_size,
+            "local_mtime": stat.st_mtime_ns
+        }
+
+    def forget(self, rel : str) -> None:
+        self.entries.pop(rel, None)
+
+    def save(self) -> None:
+        with open(self.path + ".tmp", "w", encoding="utf-8") as fh:
+            json.dump(self.entries, fh)
+        os.replace(self.path + ".tmp", self.path)
+
+class SyncAction:
+    """A single transfer (or deletion) that a sync is going to make."""
+
+    def __init__(self, kind : str, rel : str, size : int, remote : Optional[File] = None) -> None:
+        self.kind = kind
+        self.rel = rel
+        self.size = size
+        self.remote = remote
+
+class SyncPlan:
+    """Everything a sync would do. Printing it is the dry-run."""
+
+    actions : List[SyncAction]
+    adopted : List[Tuple[str, File]]
+
+    def __init__(self) -> None:
+        self.actions = []
+        # Files that were identical on both sides, but not in the manifest yet
+        self.adopted = []
+        self.unchanged = 0
+        self.skipped = 0
+
+    def add(self, kind : str, rel : str, size : int, remote : Optional[File] = None) -> None:
+        self.actions.append(SyncAction(kind, rel, size, remote))
+
+    def print(self) -> None:
+        for action in sorted(self.actions, key=lambda a: a.rel):
+            print("%-8s %s" % (action.kind, action.rel))
+        print(self.summary())
+
+    def summary(self) -> str:
+        parts = []
+        for kind in [DOWNLOAD, UPLOAD, UPDATE, DELETE]:
+            actions = [a for a in self.actions if a.kind == kind]
+            if len(actions) > 0:
+                parts.append("%d to %s (%s)" % (len(actions), kind, format_size(sum(a.size for a in actions))))
+        parts.append("%d unchanged" % (self.unchanged + len(self.adopted)))
+        if self.skipped > 0:
+            parts.append("%d skipped" % (self.skipped))
+        return ", ".join(parts)
+
+class Sync:
+    """Syncs [remote_dir] into [local_dir] (or the other way around with [upload]).
+
+    Only new or changed files are transferred. With [delete], files that were synced before but are gone
+    from the source are moved to the trash on the target: the Drive trash, or .gdrive-trash locally."""
+
+    def __init__(self, drive : Drive, remote_dir : str, local_dir : str,
+                 upload : bool = False, delete : bool = False, workers : int = 4) -> None:
+        # pylint: disable=R0913
+        self.drive = drive
+        self.remote_dir = absolute_path(remote_dir)
+        self.local_dir = local_dir
+        self.upload = upload
+        self.delete = delete
+        self.workers = workers
+        self.manifest = Manifest(local_dir)
+
+    def __remote_files(self) -> Optional[Dict[str, File]]:
+        folder = self.drive.resolve(self.remote_dir)
+        if folder is None and self.upload and len(self.manifest.entries) == 0:
+            # The first upload creates the folder
+            return {}
+        if folder is None or not folder.is_dir:
+            print("There is no folder at %s on the drive." % (self.remote_dir))
+            return None
+        self.drive.ls_all(folder.path, max_workers=self.workers)
+        return {relpath(f.path, folder.path): f for f in self.drive.fs.files_below(folder.path) if not f.is_dir}
+
+    def __local_files(self) -> Dict[str, os.stat_result]:
+        files = {}
+        for root, dirs, names in os.walk(self.local_dir):
+            if root == self.local_dir:
+                dirs[:] = [d for d in dirs if d != TRASH_DIR]
+                names = [n for n in names if n not in (MANIFEST_NAME, MANIFEST_NAME + ".tmp")]
+            for name in names:
+                path = join(root, name)
+                files[relpath(path, self.local_dir)] = os.stat(path)
+        return files
+
+    def plan(self) -> Optional[SyncPlan]:
+        """Compares both sides with the manifest and decides what needs to be transferred.
+        Returns None if the sync can't be done safely, without changing anything."""
+
+        remote = self.__remote_files()
+        if remote is None:
+            return None
+        local = self.__local_files()
+        source = local if self.upload else remote
+        if self.delete and len(source) == 0 and len(self.manifest.entries) > 0:
+            # More likely a wrong path than everything being deleted since the last sync
+            print("Refusing to delete all synced files, because %s is empty." % (
+                self.local_dir if self.upload else self.remote_dir))
+            return None
+        plan = SyncPlan()
+
+        for rel in sorted(set(remote.keys()) | set(local.keys())):
+            entry = self.manifest.get(rel)
+            f, stat = remote.get(rel), local.get(rel)
+            remote_same = f is not None and entry is not None and entry["id"] == f.id and \
+                (entry["md5"], entry["size"]) == (f.md5, f.size) and \
+                (f.md5 is not None or entry["modified"] == f.modified)
+            local_same = stat is not None and entry is not None and \
+                (entry["local_size"], entry["local_mtime"]) == (stat.st_size, stat.st_mtime_ns)
+
+            if f is not None and not f.is_downloadable:
+                # Google Docs have no content we could compare or transfer
+                plan.skipped += 1
+            elif remote_same and local_same:
+                plan.unchanged += 1
+            elif f is not None and stat is not None and entry is None and self.__same_content(f, stat, rel):
+                plan.adopted.append((rel, f))
+            elif self.upload:
+                self.__plan_upload(plan, rel, f, stat, remote_same)
+            else:
+                self.__plan_download(plan, rel, f, stat, local_same)
+        return plan
+
+    def __plan_download(self, plan : SyncPlan, rel : str, f : Optional[File], stat : Optional[os.stat_result],
+                        local_same : bool) -> None:
+        # pylint: disable=R0913
+        if f is not None:
+            plan.add(DOWNLOAD, rel, f.size or 0, f)
+        elif self.manifest.get(rel) is not None and local_same and self.delete:
+            # Deleted on the Drive since the last sync and not touched locally
+            assert stat is not None
+            plan.add(DELETE, rel, stat.st_size)
+
+    def __plan_upload(self, plan : SyncPlan, rel : str, f : Optional[File], stat : Optional[os.stat_result],
+                      remote_same : bool) -> None:
+        # pylint: disable=R0913
+        if stat is not None:
+            plan.add(UPDATE if f is not None else UPLOAD, rel, stat.st_size, f)
+        elif self.manifest.get(rel) is not None and remote_same and self.delete:
+            # Deleted locally since the last sync and not touched on the Drive
+            assert f is not None
+            plan.add(DELETE, rel, f.size or 0, f)
+
+    def __same_content(self, f : File, stat : os.stat_result, rel : str) -> bool:
+        """Checks whether a file that exists on both sides already has the same contents."""
+
+        if f.md5 is None or f.size != stat.st_size:
+            return False
+        md5 = hashlib.md5()
+        with open(join(self.local_dir, rel), "rb") as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b""):
+                md5.update(block)
+        return md5.hexdigest() == f.md5
+
+    def run(self, plan : SyncPlan) -> TransferStats:
+        """Executes the plan and records every successful transfer in the manifest."""
+
+        os.makedirs(self.local_dir, exist_ok=True)
+        for rel, f in plan.adopted:
+            self.manifest.record(rel, f, join(self.local_dir, rel))
+
+        stats = TransferStats()
+        try:
+            if self.upload:
+                self.__run_upload(plan, stats)
+            else:
+                self.__run_download(plan, stats)
+        finally:
+            self.manifest.save()
+            stats.finish()
+        return stats
+
+    def __run_download(self, plan : SyncPlan, stats : TransferStats) -> None:
+        for action in plan.actions:
+            if action.kind == DELETE:
+                self.__trash_local(action.rel)
+            else:
+                os.makedirs(dirname(join(self.local_dir, action.rel)), exist_ok=True)
+
+        downloads = [a for a in plan.actions if a.kind == DOWNLOAD]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            for action in downloads:
+                assert action.remote is not None
+                futures[pool.submit(self.drive.download_file, action.remote, join(self.local_dir, action.rel))] = action
+            for future in as_completed(futures):
+                action = futures[future]
+                try:
+                    future.result()
+                except HttpError as e:
+                    stats.fail()
+                    print("Failed to download %s: %s" % (action.rel, e))
+                    continue
+                assert action.remote is not None
+                self.manifest.record(action.rel, action.remote, join(self.local_dir, action.rel))
+                stats.add(action.size)
+
+    def __run_upload(self, plan : SyncPlan, stats : TransferStats) -> None:
+        deletes = [a for a in plan.actions if a.kind == DELETE]
+        trashed = {f.id for f in self.drive.rm_files([a.remote for a in deletes if a.remote is not None])}
+        for action in deletes:
+            if action.remote is not None and action.remote.id in trashed:
+                self.manifest.forget(action.rel)
+
+        uploads = [a for a in plan.actions if a.kind in (UPLOAD, UPDATE)]
+        results = self.drive.upload_files([(join(self.local_dir, a.rel), join(self.remote_dir, a.rel)) for a in uploads],
+                                          self.workers)
+        for action, (_remote, f, error) in zip(uploads, results):
+            if f is None:
+                stats.fail()
+                if error is not None:
+                    print("Failed to %s %s: %s" % (action.kind, action.rel, error))
+                continue
+            self.manifest.record(action.rel, f, join(self.local_dir, action.rel))
+            stats.add(action.size)
+
+    def __trash_local(self, rel : str) -> None:
+        target = join(self.local_dir, TRASH_DIR, rel)
+        os.makedirs(dirname(target), exist_ok=True)
+        shutil.move(join(self.local_dir, rel), target)
+        self.manifest.forget(rel)
@@ -0,0 +1,316 @@
+"""Helpers for moving file contents between the local host and the Drive."""
+
+import io
+import os
+import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from googleapiclient.errors import HttpError # type: ignore
+from googleapiclient.http import MediaIoBaseDownload # type: ignore
+
+# Size of the byte ranges a large file is split into for parallel downloads
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+# Size of a single range request within a part, which bounds the memory each worker needs
+RANGE_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Files up to this size are sent in a single multipart request, larger ones in resumable chunks
+RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+# Must be a multiple of 256 KB
+DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+PARTIAL_SUFFIX = ".partial"
+CHECKPOINT_SUFFIX = ".partial.json"
+
+def format_size(size : float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024
+    return "%.1f TB" % (size)
+
+class TransferStats:
+    """Aggregates what a (parallel) transfer moved, so that we can report the throughput."""
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.__started = time.time()
+        self.__finished : Optional[float] = None
+        self.__lock = threading.Lock()
+
+    def add(self, size : int) -> None:
+        with self.__lock:
+            self.files += 1
+            self.bytes += size
+
+    def fail(self) -> None:
+        with self.__lock:
+            self.failed += 1
+
+    def finish(self) -> None:
+        self.__finished = time.time()
+
+    @property
+    def seconds(self) -> float:
+        end = self.__finished if self.__finished is not None else time.time()
+        return end - self.__started
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second"""
+        return self.bytes / max(self.seconds, 1e-9)
+
+    def summary(self, verb : str) -> str:
+        text = "%s %d files (%s) in %.1fs (%s/s)" % (
+            verb, self.files, format_size(self.bytes), self.seconds, format_size(self.throughput))
+        if self.failed > 0:
+            text += ", %d failed" % (self.failed)
+        return text
+
+def download_media(request, local : str) -> int:
+    """Writes the contents of the given get_media [request] to the [local] file. Returns the bytes written."""
+
+    with io.FileIO(local, 'wb') as fh:
+        downloader = MediaIoBaseDownload(fh, request)
+        done = False
+        while done is False:
+            _status, done = downloader.next_chunk()
+        return fh.tell()
+
+def split_ranges(size : int, part_size : int) -> List[Tuple[int, int]]:
+    """Splits [0, size) into half-open byte ranges of at most [part_size] bytes."""
+    return [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+class DownloadCheckpoint:
+    """Remembers how much of each byte range of a .partial download has been received.
+
+    The checkpoint is stored next to the download target and is only valid for the exact
+    remote file [version] (md5 or modifiedTime) it was started for."""
+
+    ranges : List[List[int]]
+
+    def __init__(self, local : str, file_id : str, version : str, size : int, ranges : List[List[int]]) -> None:
+        # pylint: disable=R0913
+        self.local = local
+        self.partial = local + PARTIAL_SUFFIX
+        self.path = local + CHECKPOINT_SUFFIX
+        self.file_id = file_id
+        self.version = version
+        self.size = size
+        # [start, end, received] for each range
+        self.ranges = ranges
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def start(local : str, file_id : str, version : str, size : int, part_size : int) -> "DownloadCheckpoint":
+        """Continues the stored checkpoint for this version of the file, or starts over with ranges of [part_size]."""
+
+        checkpoint = DownloadCheckpoint.load(local, file_id, version, size)
+        if checkpoint is not None and os.path.exists(checkpoint.partial) and os.path.getsize(checkpoint.partial) == size:
+            return checkpoint
+
+        # The remote file changed (or we never started), so nothing we have can be reused
+        ranges = [[start, end, 0] for start, end in split_ranges(size, part_size)]
+        checkpoint = DownloadCheckpoint(local, file_id, version, size, ranges)
+        with open(checkpoint.partial, 'wb') as fh:
+            fh.truncate(size)
+        checkpoint.save()
+        return checkpoint
+
+    @staticmethod
+    def load(local : str, file_id : str, version : str, size : int) -> Optional["DownloadCheckpoint"]:
+        """Returns the stored checkpoint, if there is one for this version of the file."""
+
+        try:
+            with open(local + CHECKPOINT_SUFFIX, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        if (data.get("file_id"), data.get("version"), data.get("size")) != (file_id, version, size):
+            return None
+        return DownloadCheckpoint(local, file_id, version, size, data["ranges"])
+
+    def remaining(self) -> List[Tuple[int, int]]:
+        return [(start + received, end) for start, end, received in self.ranges if start + received < end]
+
+    def received(self, offset : int, length : int) -> None:
+        """Records that [length] bytes at [offset] have been written to the .partial file."""
+
+        with self.__lock:
+            for entry in self.ranges:
+                if entry[0] + entry[2] == offset:
+                    entry[2] += length
+                    break
+            self.save()
+
+    def save(self) -> None:
+        data = {"file_id": self.file_id, "version": self.version, "size": self.size, "ranges": self.ranges}
+        with open(self.path + ".tmp", "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def download_resumable(new_request : Callable, checkpoint : DownloadCheckpoint, workers : int = 1) -> int:
+    """Fetches the byte ranges that are still missing according to the [checkpoint] into the .partial file,
+    and renames it to the target once it's complete.
+
+    [new_request] creates a get_media request for the file. It is called on each worker thread,
+    so that every worker uses its own transport. Returns the number of bytes that were transferred."""
+
+    remaining = checkpoint.remaining()
+    fd = os.open(checkpoint.partial, os.O_WRONLY)
+    lock = threading.Lock()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [pool.submit(_download_range, new_request, fd, lock, checkpoint, start, end)
+                       for start, end in remaining]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+    os.replace(checkpoint.partial, checkpoint.local)
+    checkpoint.remove()
+    return sum(end - start for start, end in remaining)
+
+def _download_range(new_request : Callable, fd : int, lock : threading.Lock,
+                    checkpoint : DownloadCheckpoint, start : int, end : int) -> None:
+    # pylint: disable=R0913
+    request = new_request()
+    chunks = RangeDownload(request, fd, lock, checkpoint, start, end)
+    while not chunks.done:
+        chunks.received(*request.http.request(request.uri, method="GET", headers=chunks.headers()))
+
+class RangeDownload:
+    """Fetches the byte range [start, end) of a get_media [request] in chunks of RANGE_CHUNK_SIZE and writes
+    them into the .partial file [fd]. Sending the requests is up to the caller, which may be async."""
+
+    def __init__(self, request, fd : int, lock : threading.Lock, checkpoint : DownloadCheckpoint,
+                 start : int, end : int) -> None:
+        # pylint: disable=R0913
+        self.request = request
+        self.fd = fd
+        self.lock = lock
+        self.checkpoint = checkpoint
+        self.offset = start
+        self.end = end
+
+    @property
+    def done(self) -> bool:
+        return self.offset >= self.end
+
+    def headers(self) -> Dict[str, str]:
+        """Returns the headers of the request for the next chunk."""
+
+        headers = dict(self.request.headers)
+        headers["range"] = "bytes=%d-%d" % (self.offset, self.__last())
+        return headers
+
+    def received(self, resp, content : bytes) -> None:
+        """Writes the response to the request for the next chunk, or raises an HttpError if it failed."""
+
+        # A plain 200 means that the server ignored the range, which is only fine if we got exactly that range.
+        if resp.status not in (200, 206) or len(content) == 0 or \
+                (resp.status == 200 and len(content) != self.__last() - self.offset + 1):
+            raise HttpError(resp, content, uri=self.request.uri)
+
+        write_at(self.fd, self.lock, content, self.offset)
+        self.checkpoint.received(self.offset, len(content))
+        self.offset += len(content)
+
+    def __last(self) -> int:
+        return min(self.offset + RANGE_CHUNK_SIZE, self.end) - 1
+
+def write_at(fd : int, lock : threading.Lock, data : bytes, offset : int) -> None:
+    """Writes the [data] at the [offset] of the file, while other threads may be writing elsewhere in it."""
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while len(view) > 0:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        # No positional writes (e.g. on Windows), so the seek and the write need to happen together
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+class UploadSession:
+    """Persists the session URI of a resumable upload, so that it can continue after a restart.
+
+    The session is keyed by the local file (path, size and mtime) and the remote target, so a changed
+    local file never continues an old session."""
+
+    def __init__(self, session_dir : str, local : str, parent_id : str, name : str) -> None:
+        stat = os.stat(local)
+        key = "\n".join([os.path.abspath(local), str(stat.st_size), str(stat.st_mtime_ns), parent_id, name])
+        self.path = os.path.join(session_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+        self.size = stat.st_size
+
+    def load(self) -> Optional[str]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                return json.load(fh)["uri"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, uri : str) -> None:
+        # Anyone who knows the URI can upload to the session, so only we may read it
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        fd = os.open(self.path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as fh:
+            json.dump({"uri": uri}, fh)
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def upload_resumable(request, session : UploadSession, progress : Optional[Callable[[int, int], None]] = None):
+    """Executes a resumable upload [request] chunk by chunk and returns the created file's metadata.
+
+    If the [session] has a stored URI that the server still knows, the upload continues from the
+    offset the server reports. [progress] is called with the bytes sent so far and the total size."""
+
+    uri = session.load()
+    if uri is not None:
+        resp, content = request.http.request(uri, method="PUT", headers={
+            "Content-Range": "bytes */%d" % (session.size),
+            "content-length": "0"
+        })
+        if resp.status in (200, 201):
+            # Everything was uploaded before we got to hear about it
+            session.remove()
+            return request.postproc(resp, content)
+        if resp.status == 308:
+            request.resumable_uri = uri
+            request.resumable_progress = int(resp["range"].rsplit("-", 1)[1]) + 1 if "range" in resp else 0
+        # Any other status means the session expired, so we start a new one
+
+    response = None
+    saved = uri is not None and request.resumable_uri == uri
+    try:
+        while response is None:
+            status, response = request.next_chunk()
+            if not saved and request.resumable_uri is not None:
+                session.save(request.resumable_uri)
+                saved = True
+            if status is not None and progress is not None:
+                progress(status.resumable_progress, status.total_size)
+    except BaseException:
+        if not saved and request.resumable_uri is not None:
+            session.save(request.resumable_uri)
+        raise
+
+    session.remove()
+    if progress is not None:
+        progress(session.size, session.size)
+    return response
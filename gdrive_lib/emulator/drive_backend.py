@@ -0,0 +1,324 @@
+"""In-memory model of the Drive v3 files, changes and upload endpoints."""
+
+import datetime
+import hashlib
+import itertools
+import json
+import threading
+import uuid
+from email.parser import BytesParser
+from typing import Any, Dict, List, Optional, Tuple
+from .query import parse_query
+
+FOLDER = "application/vnd.google-apps.folder"
+ROOT_ID = "0AEmulatedRoot"
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+def json_response(data : Any, status : int = 200) -> Response:
+    return status, {"content-type": "application/json; charset=UTF-8"}, json.dumps(data).encode("utf-8")
+
+def error_response(status : int, reason : str, message : str) -> Response:
+    return json_response({"error": {
+        "code": status,
+        "message": message,
+        "errors": [{"domain": "global", "reason": reason, "message": message}]
+    }}, status)
+
+class DriveBackend:
+    """Keeps the metadata and contents of all emulated Drive files."""
+
+    files : Dict[str, Dict[str, Any]]
+    contents : Dict[str, bytes]
+    # Ids of the children of each folder (in the order they were added), so that listing a folder
+    # doesn't need to look at every file
+    children : Dict[str, Dict[str, None]]
+    changes : List[str]
+
+    def __init__(self, max_page_size : int = 1000) -> None:
+        self.max_page_size = max_page_size
+        self.files = {}
+        self.contents = {}
+        self.children = {}
+        self.changes = []
+        self.__uploads : Dict[str, Dict[str, Any]] = {}
+        # Results of list calls that have more pages, by page token
+        self.__listings : Dict[str, List[Dict[str, Any]]] = {}
+        self.__ids = itertools.count()
+        self.__clock = datetime.datetime(2020, 1, 1)
+        self.__lock = threading.RLock()
+        self.files[ROOT_ID] = {
+            "id": ROOT_ID, "name": "My Drive", "parents": [], "mimeType": FOLDER,
+            "trashed": False, "modifiedTime": self.__now(), "createdTime": self.__now()
+        }
+
+    def __now(self) -> str:
+        self.__clock += datetime.timedelta(seconds=1)
+        # Much faster than strftime, which matters for trees with millions of files
+        return self.__clock.isoformat(timespec="milliseconds") + "Z"
+
+    def new_id(self) -> str:
+        return "emu%08d" % next(self.__ids)
+
+    def resolve_id(self, file_id : str) -> str:
+        return ROOT_ID if file_id == "root" else file_id
+
+    # Direct manipulation (used to build synthetic trees)
+
+    def add(self, name : str, parent : str, mime_type : str = "text/plain",
+            content : Optional[bytes] = None, file_id : Optional[str] = None) -> Dict[str, Any]:
+        """Adds a file without going through the HTTP layer."""
+        with self.__lock:
+            now = self.__now()
+            data : Dict[str, Any] = {
+                "id": file_id or self.new_id(),
+                "name": name,
+                "parents": [self.resolve_id(parent)],
+                "mimeType": mime_type,
+                "trashed": False,
+                "modifiedTime": now,
+                "createdTime": now
+            }
+            self.files[data["id"]] = data
+            self.children.setdefault(data["parents"][0], {})[data["id"]] = None
+            if mime_type != FOLDER and not mime_type.startswith("application/vnd.google-apps."):
+                content = content or b""
+                self.contents[data["id"]] = content
+                data["size"] = str(len(content))
+                data["md5Checksum"] = hashlib.md5(content).hexdigest()
+            self.changes.append(data["id"])
+            return data
+
+    def mkdir(self, name : str, parent : str = "root") -> Dict[str, Any]:
+        return self.add(name, parent, FOLDER)
+
+    def set_content(self, file_id : str, content : bytes) -> None:
+        with self.__lock:
+            data = self.files[file_id]
+            self.contents[file_id] = content
+            data["size"] = str(len(content))
+            data["md5Checksum"] = hashlib.md5(content).hexdigest()
+            data["modifiedTime"] = self.__now()
+            self.changes.append(file_id)
+
+    # Endpoints
+
+    def list_files(self, params : Dict[str, str]) -> Response:
+        page_size = min(int(params.get("pageSize", 100)), self.max_page_size)
+        listing, _, offset_text = params.get("pageToken", "").partition(":")
+        offset = int(offset_text or 0)
+        with self.__lock:
+            matches = self.__listings.get(listing)
+        if matches is None:
+            if listing != "":
+                return error_response(400, "invalid", "Invalid Value")
+            matches = self.__match(params)
+
+        page = matches[offset:offset + page_size]
+        result : Dict[str, Any] = {"files": page}
+        with self.__lock:
+            if offset + page_size < len(matches):
+                # Later pages are served from the same result, like the API does
+                listing = listing or uuid.uuid4().hex
+                result["nextPageToken"] = "%s:%d" % (listing, offset + page_size)
+                self.__listings[listing] = matches
+            else:
+                self.__listings.pop(listing, None)
+        return json_response(result)
+
+    def __match(self, params : Dict[str, str]) -> List[Dict[str, Any]]:
+        predicate, parents = parse_query(params.get("q", "trashed = false"), {"root": ROOT_ID})
+        with self.__lock:
+            if parents is None:
+                candidates = list(self.files.values())
+            else:
+                candidates = [self.files[i] for parent in parents for i in self.children.get(parent, ())]
+            matches = [dict(f) for f in candidates if f["id"] != ROOT_ID and predicate(f)]
+        for key in reversed(params.get("orderBy", "").split(",")):
+            key = key.strip()
+            if key == "":
+                continue
+            field, _, direction = key.partition(" ")
+            if field == "folder":
+                matches.sort(key=lambda f: f["mimeType"] != FOLDER, reverse=direction == "desc")
+            else:
+                matches.sort(key=lambda f, field=field: f.get(field, ""), # type: ignore
+                             reverse=direction == "desc")
+        return matches
+
+    def get_file(self, file_id : str, params : Dict[str, str], headers : Dict[str, str]) -> Response:
+        file_id = self.resolve_id(file_id)
+        with self.__lock:
+            if file_id not in self.files:
+                return error_response(404, "notFound", "File not found: %s." % file_id)
+            data = dict(self.files[file_id])
+            content = self.contents.get(file_id)
+        if params.get("alt") != "media":
+            return json_response(data)
+        if content is None:
+            return error_response(403, "fileNotDownloadable", "Only files with binary content can be downloaded.")
+        return self.__ranged(content, headers)
+
+    @staticmethod
+    def __ranged(content : bytes, headers : Dict[str, str]) -> Response:
+        header = {k.lower(): v for k, v in headers.items()}.get("range")
+        if header is None:
+            return 200, {"content-length": str(len(content))}, content
+        start_text, _, end_text = header.replace("bytes=", "").partition("-")
+        start = int(start_text)
+        end = min(int(end_text) if end_text else len(content) - 1, len(content) - 1)
+        if start >= len(content):
+            return 416, {"content-range": "bytes */%d" % len(content)}, b""
+        return 206, {
+            "content-range": "bytes %d-%d/%d" % (start, end, len(content)),
+            "content-length": str(end - start + 1)
+        }, content[start:end + 1]
+
+    def create_file(self, metadata : Dict[str, Any], content : Optional[bytes]) -> Response:
+        with self.__lock:
+            parents = [self.resolve_id(p) for p in metadata.get("parents", [ROOT_ID])]
+            for parent in parents:
+                if parent not in self.files:
+                    return error_response(404, "notFound", "File not found: %s." % parent)
+            file_id = metadata.get("id") or self.new_id()
+            if file_id in self.files:
+                return error_response(409, "duplicate", "A file already exists with the provided ID.")
+            data = self.add(metadata["name"], parents[0], metadata.get("mimeType", "application/octet-stream"),
+                            content, file_id)
+            self.__reparent(file_id, data["parents"], parents)
+            data["parents"] = parents
+            return json_response(dict(data))
+
+    def update_file(self, file_id : str, params : Dict[str, str], metadata : Dict[str, Any],
+                    content : Optional[bytes]) -> Response:
+        file_id = self.resolve_id(file_id)
+        with self.__lock:
+            if file_id not in self.files:
+                return error_response(404, "notFound", "File not found: %s." % file_id)
+            data = self.files[file_id]
+            for key in ("name", "trashed", "mimeType"):
+                if key in metadata:
+                    data[key] = metadata[key]
+            parents = list(data["parents"])
+            for removed in filter(None, params.get("removeParents", "").split(",")):
+                if self.resolve_id(removed) in parents:
+                    parents.remove(self.resolve_id(removed))
+            for added in filter(None, params.get("addParents", "").split(",")):
+                if self.resolve_id(added) not in self.files:
+                    return error_response(404, "notFound", "File not found: %s." % added)
+                parents.append(self.resolve_id(added))
+            self.__reparent(file_id, data["parents"], parents)
+            data["parents"] = parents
+            data["modifiedTime"] = self.__now()
+            if content is not None:
+                self.set_content(file_id, content)
+            self.changes.append(file_id)
+            return json_response(dict(data))
+
+    def __reparent(self, file_id : str, old : List[str], new : List[str]) -> None:
+        for parent in old:
+            self.children.get(parent, {}).pop(file_id, None)
+        for parent in new:
+            self.children.setdefault(parent, {})[file_id] = None
+
+    def delete_file(self, file_id : str) -> Response:
+        with self.__lock:
+            data = self.files.pop(self.resolve_id(file_id), None)
+            if data is not None:
+                self.__reparent(data["id"], data["parents"], [])
+            self.contents.pop(self.resolve_id(file_id), None)
+            self.changes.append(self.resolve_id(file_id))
+        return 204, {}, b""
+
+    def generate_ids(self, params : Dict[str, str]) -> Response:
+        count = int(params.get("count", 10))
+        return json_response({"kind": "drive#generatedIds", "space": "drive",
+                              "ids": [self.new_id() for _ in range(count)]})
+
+    def start_page_token(self) -> Response:
+        with self.__lock:
+            return json_response({"startPageToken": str(len(self.changes))})
+
+    def list_changes(self, params : Dict[str, str]) -> Response:
+        start = int(params["pageToken"])
+        page_size = min(int(params.get("pageSize", 100)), self.max_page_size)
+        with self.__lock:
+            end = min(start + page_size, len(self.changes))
+            changes = []
+            for file_id in self.changes[start:end]:
+                if file_id in self.files:
+                    changes.append({"fileId": file_id, "removed": False, "file": dict(self.files[file_id])})
+                else:
+                    changes.append({"fileId": file_id, "removed": True})
+            result : Dict[str, Any] = {"changes": changes}
+            if end < len(self.changes):
+                result["nextPageToken"] = str(end)
+            else:
+                result["newStartPageToken"] = str(end)
+        return json_response(result)
+
+    # Uploads
+
+    def upload(self, method : str, file_id : Optional[str], params : Dict[str, str],
+               headers : Dict[str, str], body : bytes, base_uri : str) -> Response:
+        # pylint: disable=R0913
+        upload_type = params.get("uploadType", "media")
+        if upload_type == "multipart":
+            metadata, content = self.__split_multipart(headers, body)
+        elif upload_type == "resumable":
+            return self.__start_session(method, file_id, params, headers, body, base_uri)
+        else:
+            metadata, content = {}, body
+        if file_id is None:
+            return self.create_file(metadata, content)
+        return self.update_file(file_id, params, metadata, content)
+
+    @staticmethod
+    def __split_multipart(headers : Dict[str, str], body : bytes) -> Tuple[Dict[str, Any], bytes]:
+        content_type = {k.lower(): v for k, v in headers.items()}["content-type"]
+        message = BytesParser().parsebytes(b"content-type: " + content_type.encode("ascii") + b"\r\n\r\n" + body)
+        parts : Any = message.get_payload()
+        metadata = json.loads(parts[0].get_payload())
+        content = parts[1].get_payload(decode=True)
+        return metadata, content
+
+    def __start_session(self, method : str, file_id : Optional[str], params : Dict[str, str],
+                        headers : Dict[str, str], body : bytes, base_uri : str) -> Response:
+        # pylint: disable=R0913
+        lowered = {k.lower(): v for k, v in headers.items()}
+        session = uuid.uuid4().hex
+        with self.__lock:
+            self.__uploads[session] = {
+                "method": method,
+                "file_id": file_id,
+                "params": params,
+                "metadata": json.loads(body) if body else {},
+                "size": int(lowered.get("x-upload-content-length", -1)),
+                "data": bytearray()
+            }
+        return 200, {"location": "%s?uploadType=resumable&upload_id=%s" % (base_uri, session)}, b""
+
+    def upload_chunk(self, session : str, headers : Dict[str, str], body : bytes) -> Response:
+        lowered = {k.lower(): v for k, v in headers.items()}
+        with self.__lock:
+            if session not in self.__uploads:
+                return error_response(404, "notFound", "Upload session not found.")
+            upload = self.__uploads[session]
+            content_range = lowered.get("content-range", "")
+            spec, _, total = content_range.replace("bytes ", "").partition("/")
+            if spec not in ("*", ""):
+                start = int(spec.split("-")[0])
+                if start != len(upload["data"]):
+                    return error_response(400, "badContentRange", "Chunk does not continue the upload.")
+                upload["data"].extend(body)
+            if total not in ("*", "") and len(upload["data"]) >= int(total):
+                del self.__uploads[session]
+                content = bytes(upload["data"])
+                if upload["file_id"] is None:
+                    return self.create_file(upload["metadata"], content)
+                return self.update_file(upload["file_id"], upload["params"], upload["metadata"], content)
+            received = len(upload["data"])
+        headers_out = {"content-length": "0"}
+        if received > 0:
+            headers_out["range"] = "bytes=0-%d" % (received - 1)
+        return 308, headers_out, b""
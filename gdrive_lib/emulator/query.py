@@ -0,0 +1,125 @@
+"""Evaluates the subset of the Drive search query language used by this library."""
+
+import re
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+Predicate = Callable[[Dict[str, Any]], bool]
+# A predicate, and the folders that all matching files are in (None if they can be anywhere)
+Term = Tuple[Predicate, Optional[Set[str]]]
+
+TOKEN = re.compile(r"\s*(?:(\()|(\))|'((?:[^'\\]|\\.)*)'|(!=|<=|>=|=|<|>)|([A-Za-z_]+))")
+
+def parse_query(query : str, aliases : Optional[Dict[str, str]] = None) -> Term:
+    """Compiles a Drive query (e.g. "'x' in parents and trashed = false") into a predicate.
+
+    Also returns the parent folders the query is restricted to, so that only their children need to be checked."""
+    parser = _QueryParser(query, aliases or {})
+    term = parser.parse_or()
+    if parser.peek() != (None, None):
+        raise ValueError("Unexpected trailing tokens in query: %s" % query)
+    return term
+
+class _QueryParser:
+    tokens : List[Tuple[Any, Any]]
+
+    def __init__(self, query : str, aliases : Dict[str, str]) -> None:
+        self.aliases = aliases
+        self.tokens = []
+        self.pos = 0
+        offset = 0
+        query = query.strip()
+        while offset < len(query):
+            match = TOKEN.match(query, offset)
+            if match is None:
+                raise ValueError("Can not parse query at offset %d: %s" % (offset, query))
+            offset = match.end()
+            if match.group(1):
+                self.tokens.append(("(", None))
+            elif match.group(2):
+                self.tokens.append((")", None))
+            elif match.group(3) is not None:
+                self.tokens.append(("str", re.sub(r"\\(.)", r"\1", match.group(3))))
+            elif match.group(4):
+                self.tokens.append(("op", match.group(4)))
+            else:
+                self.tokens.append(("word", match.group(5)))
+            while offset < len(query) and query[offset].isspace():
+                offset += 1
+
+    def peek(self) -> Tuple[Any, Any]:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self) -> Tuple[Any, Any]:
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse_or(self) -> Term:
+        terms = [self.parse_and()]
+        while self.peek() == ("word", "or"):
+            self.take()
+            terms.append(self.parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        predicates = [predicate for predicate, _parents in terms]
+        # Any alternative may match, so the parents are only known if every alternative restricts them
+        parents : Optional[Set[str]] = set()
+        for _predicate, term_parents in terms:
+            parents = parents | term_parents if parents is not None and term_parents is not None else None
+        return (lambda f: any(predicate(f) for predicate in predicates)), parents
+
+    def parse_and(self) -> Term:
+        terms = [self.parse_not()]
+        while self.peek() == ("word", "and"):
+            self.take()
+            terms.append(self.parse_not())
+        if len(terms) == 1:
+            return terms[0]
+        predicates = [predicate for predicate, _parents in terms]
+        parents = next((term_parents for _predicate, term_parents in terms if term_parents is not None), None)
+        return (lambda f: all(predicate(f) for predicate in predicates)), parents
+
+    def parse_not(self) -> Term:
+        if self.peek() == ("word", "not"):
+            self.take()
+            inner, _parents = self.parse_atom()
+            return (lambda f: not inner(f)), None
+        return self.parse_atom()
+
+    def parse_atom(self) -> Term:
+        kind, value = self.take()
+        if kind == "(":
+            inner = self.parse_or()
+            if self.take()[0] != ")":
+                raise ValueError("Unbalanced parentheses in query")
+            return inner
+        if kind == "str":
+            if self.take() != ("word", "in"):
+                raise ValueError("Expected 'in' after string literal")
+            _kind, field = self.take()
+            value = self.aliases.get(value, value)
+            return (lambda f: value in f.get(field, [])), ({value} if field == "parents" else None)
+        if kind == "word":
+            return self.parse_comparison(value), None
+        raise ValueError("Unexpected token in query: %s" % value)
+
+    def parse_comparison(self, field : str) -> Predicate:
+        _kind, op = self.take()
+        kind, literal = self.take()
+        if kind == "word":
+            literal = {"true": True, "false": False}[literal]
+        if op == "=":
+            return lambda f: f.get(field, False if isinstance(literal, bool) else None) == literal
+        if op == "!=":
+            return lambda f: f.get(field, False if isinstance(literal, bool) else None) != literal
+        if op == ">":
+            return lambda f: f.get(field, "") > literal
+        if op == ">=":
+            return lambda f: f.get(field, "") >= literal
+        if op == "<":
+            return lambda f: f.get(field, "") < literal
+        if op == "<=":
+            return lambda f: f.get(field, "") <= literal
+        raise ValueError("Unsupported operator in query: %s" % op)
@@ -0,0 +1,358 @@
+"""In-memory model of the Sheets v4 spreadsheets and values endpoints."""
+
+import re
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from .drive_backend import DriveBackend, Response, error_response, json_response
+
+SPREADSHEET = "application/vnd.google-apps.spreadsheet"
+DEFAULT_ROWS = 1000
+DEFAULT_COLUMNS = 26
+
+# (sheet title or None for the first sheet, first row, first column, end row, end column), 0-based and
+# end-exclusive, with None for an open end
+GridRange = Tuple[Optional[str], int, int, Optional[int], Optional[int]]
+
+CELL = re.compile(r"^([A-Z]{0,3})([0-9]*)$")
+NUMBER = re.compile(r"^-?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$")
+
+def column_index(letters : str) -> int:
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+def column_letters(index : int) -> str:
+    letters = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+def parse_range(text : str) -> GridRange:
+    """Parses A1 notation like "'My Sheet'!A1:C10", "Sheet1", "A:Z" or "B2"."""
+
+    sheet : Optional[str] = None
+    if "!" in text:
+        sheet, text = text.rsplit("!", 1)
+    elif not CELL.match(text.split(":")[0]):
+        # Only a sheet name
+        return unquote(text), 0, 0, None, None
+    if sheet is not None:
+        sheet = unquote(sheet)
+
+    start, _, end = text.partition(":")
+    start_match, end_match = CELL.match(start), CELL.match(end or start)
+    if start_match is None or end_match is None:
+        raise ValueError("Unable to parse range: %s" % (text))
+    row0 = int(start_match.group(2)) - 1 if start_match.group(2) else 0
+    col0 = column_index(start_match.group(1)) if start_match.group(1) else 0
+    row1 = int(end_match.group(2)) if end_match.group(2) else None
+    col1 = column_index(end_match.group(1)) + 1 if end_match.group(1) else None
+    return sheet, row0, col0, row1, col1
+
+def unquote(title : str) -> str:
+    if len(title) >= 2 and title[0] == title[-1] == "'":
+        return title[1:-1].replace("''", "'")
+    return title
+
+def unformatted(value : str) -> Any:
+    """Returns the value as the API renders it unformatted, i.e. numbers and booleans as such."""
+
+    if value in ("TRUE", "FALSE"):
+        return value == "TRUE"
+    if NUMBER.match(value):
+        number = float(value)
+        return int(number) if number.is_integer() and abs(number) < 2 ** 53 else number
+    return value
+
+def format_range(title : str, row0 : int, col0 : int, row1 : int, col1 : int) -> str:
+    return "'%s'!%s%d:%s%d" % (title.replace("'", "''"), column_letters(col0), row0 + 1,
+                                column_letters(max(col0, col1 - 1)), max(row0 + 1, row1))
+
+def trim(rows : List[List[str]]) -> List[List[str]]:
+    """Drops empty trailing cells and rows, like the API does in its responses."""
+
+    trimmed = []
+    for row in rows:
+        end = len(row)
+        while end > 0 and row[end - 1] == "":
+            end -= 1
+        trimmed.append(row[:end])
+    while len(trimmed) > 0 and len(trimmed[-1]) == 0:
+        trimmed.pop()
+    return trimmed
+
+class Sheet:
+    """A single tab, whose cells are kept as a list of rows (which may be shorter than the grid)."""
+
+    def __init__(self, sheet_id : int, title : str, index : int, rows : int, columns : int) -> None:
+        # pylint: disable=R0913
+        self.sheet_id = sheet_id
+        self.title = title
+        self.index = index
+        self.row_count = rows
+        self.column_count = columns
+        self.cells : List[List[str]] = []
+
+    def properties(self) -> Dict[str, Any]:
+        return {
+            "sheetId": self.sheet_id,
+            "title": self.title,
+            "index": self.index,
+            "sheetType": "GRID",
+            "gridProperties": {"rowCount": self.row_count, "columnCount": self.column_count}
+        }
+
+    def read(self, row0 : int, col0 : int, row1 : int, col1 : int) -> List[List[str]]:
+        return trim([row[col0:col1] for row in self.cells[row0:row1]])
+
+    def check(self, row0 : int, col0 : int, values : List[List[Any]]) -> None:
+        """Raises the error of the API if the values with their top left corner at the cell don't fit into the grid."""
+
+        width = max([len(row) for row in values] + [0])
+        if row0 + len(values) > self.row_count or col0 + width > self.column_count:
+            raise ValueError("Range (%s) exceeds grid limits. Max rows: %d, max columns: %d" % (
+                format_range(self.title, row0, col0, row0 + len(values), col0 + width), self.row_count,
+                self.column_count))
+
+    def write(self, row0 : int, col0 : int, values : List[List[Any]], grow : bool = False) -> Tuple[int, int]:
+        """Writes the values with their top left corner at the cell, growing the grid if [grow] is set (like
+        appends do). Returns the end row and column that were written."""
+
+        width = max([len(row) for row in values] + [0])
+        if not grow:
+            self.check(row0, col0, values)
+        self.row_count = max(self.row_count, row0 + len(values))
+        self.column_count = max(self.column_count, col0 + width)
+        while len(self.cells) < row0 + len(values):
+            self.cells.append([])
+        for offset, row in enumerate(values):
+            cells = self.cells[row0 + offset]
+            if len(cells) < col0 + len(row):
+                cells.extend([""] * (col0 + len(row) - len(cells)))
+            for i, value in enumerate(row):
+                cells[col0 + i] = "" if value is None else str(value)
+        return row0 + len(values), col0 + width
+
+    def clear(self, row0 : int, col0 : int, row1 : int, col1 : int) -> None:
+        for row in self.cells[row0:row1]:
+            for i in range(col0, min(col1, len(row))):
+                row[i] = ""
+
+    def used_rows(self) -> int:
+        return len(trim(self.cells))
+
+    def insert(self, dimension : str, start : int, end : int) -> None:
+        if dimension == "ROWS":
+            self.cells[start:start] = [[] for _ in range(end - start)]
+            self.row_count += end - start
+        else:
+            for row in self.cells:
+                if len(row) > start:
+                    row[start:start] = [""] * (end - start)
+            self.column_count += end - start
+
+    def delete(self, dimension : str, start : int, end : int) -> None:
+        if dimension == "ROWS":
+            del self.cells[start:end]
+            self.row_count -= end - start
+        else:
+            for row in self.cells:
+                del row[start:end]
+            self.column_count -= end - start
+
+class SheetsBackend:
+    """Keeps the emulated spreadsheets, which also exist as files in the Drive backend."""
+
+    spreadsheets : Dict[str, List[Sheet]]
+
+    def __init__(self, drive : DriveBackend) -> None:
+        self.drive = drive
+        self.spreadsheets = {}
+        self.__sheet_ids = 0
+        self.__lock = threading.RLock()
+
+    # Direct manipulation (used to set up benchmarks)
+
+    def create(self, name : str, parent : str = "root", sheets : Optional[Dict[str, List[List[Any]]]] = None) -> str:
+        """Creates a spreadsheet with the given tabs and their values and returns its id."""
+
+        with self.__lock:
+            file_id = self.drive.add(name, parent, SPREADSHEET)["id"]
+            self.spreadsheets[file_id] = []
+            for title, values in (sheets or {"Sheet1": []}).items():
+                self.add_sheet(file_id, title).write(0, 0, values, grow=True)
+            return file_id
+
+    def add_sheet(self, file_id : str, title : str, rows : int = DEFAULT_ROWS, columns : int = DEFAULT_COLUMNS) -> Sheet:
+        with self.__lock:
+            self.__sheet_ids += 1
+            sheets = self.spreadsheets[file_id]
+            sheet = Sheet(self.__sheet_ids, title, len(sheets), rows, columns)
+            sheets.append(sheet)
+            return sheet
+
+    def values(self, file_id : str, title : str) -> List[List[str]]:
+        """Returns all values of the tab, trimmed like the API would."""
+
+        with self.__lock:
+            return trim([list(row) for row in self.__sheet(file_id, title).cells])
+
+    def __sheet(self, file_id : str, title : Optional[str]) -> Sheet:
+        sheets = self.spreadsheets[file_id]
+        for sheet in sheets:
+            if title is None or sheet.title == title:
+                return sheet
+        raise ValueError("Unable to parse range: %s" % (title))
+
+    def __sheet_by_id(self, file_id : str, sheet_id : int) -> Sheet:
+        for sheet in self.spreadsheets[file_id]:
+            if sheet.sheet_id == sheet_id:
+                return sheet
+        raise ValueError("No grid with id: %d" % (sheet_id))
+
+    # Endpoints
+
+    def dispatch(self, route : str, path : str, params : Dict[str, List[str]], body : bytes) -> Response:
+        """Answers a request for one of the sheets.* routes of the transport."""
+
+        parts = path.split("/")
+        file_id = parts[3].split(":")[0]
+        with self.__lock:
+            if file_id not in self.spreadsheets:
+                return error_response(404, "notFound", "Requested entity was not found.")
+            data = json.loads(body) if body else {}
+            try:
+                return self.__dispatch(route, file_id, "/".join(parts[5:]), params, data)
+            except (ValueError, KeyError, IndexError) as e:
+                return error_response(400, "badRequest", str(e))
+
+    def __dispatch(self, route : str, file_id : str, cell_range : str, params : Dict[str, List[str]],
+                   data : Dict[str, Any]) -> Response:
+        # pylint: disable=R0911,R0913
+        if route == "sheets.get":
+            return json_response({
+                "spreadsheetId": file_id,
+                "properties": {"title": self.drive.files[file_id]["name"]},
+                "sheets": [{"properties": sheet.properties()} for sheet in self.spreadsheets[file_id]]
+            })
+        if route == "sheets.batchUpdate":
+            replies = [self.__update(file_id, request) for request in data.get("requests", [])]
+            return json_response({"spreadsheetId": file_id, "replies": replies})
+        if route == "sheets.values.get":
+            return json_response(self.__read(file_id, cell_range, params))
+        if route == "sheets.values.batchGet":
+            return json_response({"spreadsheetId": file_id,
+                                  "valueRanges": [self.__read(file_id, r, params) for r in params.get("ranges", [])]})
+        if route == "sheets.values.update":
+            return json_response(self.__write(file_id, cell_range, data.get("values", [])))
+        if route == "sheets.values.batchUpdate":
+            # Nothing is written if any of the ranges doesn't fit
+            for d in data.get("data", []):
+                title, row0, col0, _row1, _col1 = parse_range(d["range"])
+                self.__sheet(file_id, title).check(row0, col0, d.get("values", []))
+            responses = [self.__write(file_id, d["range"], d.get("values", [])) for d in data.get("data", [])]
+            return json_response({
+                "spreadsheetId": file_id,
+                "totalUpdatedCells": sum(r["updatedCells"] for r in responses),
+                "responses": responses
+            })
+        if route == "sheets.values.append":
+            return json_response(self.__append(file_id, cell_range.rsplit(":", 1)[0], data.get("values", [])))
+        if route == "sheets.values.clear":
+            self.__clear(file_id, cell_range.rsplit(":", 1)[0])
+            return json_response({"spreadsheetId": file_id})
+        if route == "sheets.values.batchClear":
+            for r in data.get("ranges", []):
+                self.__clear(file_id, r)
+            return json_response({"spreadsheetId": file_id})
+        return error_response(404, "notFound", "Unknown endpoint %s" % (route))
+
+    def __bounds(self, file_id : str, cell_range : str) -> Tuple[Sheet, int, int, int, int]:
+        title, row0, col0, row1, col1 = parse_range(cell_range)
+        sheet = self.__sheet(file_id, title)
+        return sheet, row0, col0, \
+            min(row1 if row1 is not None else sheet.row_count, sheet.row_count), \
+            min(col1 if col1 is not None else sheet.column_count, sheet.column_count)
+
+    def __read(self, file_id : str, cell_range : str, params : Dict[str, List[str]]) -> Dict[str, Any]:
+        sheet, row0, col0, row1, col1 = self.__bounds(file_id, cell_range)
+        result : Dict[str, Any] = {"range": format_range(sheet.title, row0, col0, row1, col1), "majorDimension": "ROWS"}
+        values : List[List[Any]] = sheet.read(row0, col0, row1, col1)
+        if params.get("valueRenderOption", ["FORMATTED_VALUE"])[0] != "FORMATTED_VALUE":
+            values = [[unformatted(value) for value in row] for row in values]
+        if len(values) > 0:
+            result["values"] = values
+        return result
+
+    def __write(self, file_id : str, cell_range : str, values : List[List[Any]], grow : bool = False) -> Dict[str, Any]:
+        title, row0, col0, _row1, _col1 = parse_range(cell_range)
+        sheet = self.__sheet(file_id, title)
+        row1, col1 = sheet.write(row0, col0, values, grow)
+        return {
+            "spreadsheetId": file_id,
+            "updatedRange": format_range(sheet.title, row0, col0, row1, col1),
+            "updatedRows": len(values),
+            "updatedColumns": col1 - col0,
+            "updatedCells": sum(len(row) for row in values)
+        }
+
+    def __append(self, file_id : str, cell_range : str, values : List[List[Any]]) -> Dict[str, Any]:
+        title, _row0, col0, _row1, _col1 = parse_range(cell_range)
+        sheet = self.__sheet(file_id, title)
+        start = sheet.used_rows()
+        # Appends insert the rows they need
+        updates = self.__write(file_id, "'%s'!%s%d" % (sheet.title, column_letters(col0), start + 1), values, True)
+        return {"spreadsheetId": file_id, "updates": updates}
+
+    def __clear(self, file_id : str, cell_range : str) -> None:
+        sheet, row0, col0, row1, col1 = self.__bounds(file_id, cell_range)
+        sheet.clear(row0, col0, row1, col1)
+
+    def __update(self, file_id : str, request : Dict[str, Any]) -> Dict[str, Any]:
+        """Applies a single request of a spreadsheets.batchUpdate and returns its reply."""
+
+        kind, spec = next(iter(request.items()))
+        if kind == "addSheet":
+            properties = spec.get("properties", {})
+            grid = properties.get("gridProperties", {})
+            title = properties.get("title", "Sheet%d" % (len(self.spreadsheets[file_id]) + 1))
+            if any(sheet.title == title for sheet in self.spreadsheets[file_id]):
+                raise ValueError("A sheet with the name \"%s\" already exists." % (title))
+            sheet = self.add_sheet(file_id, title, grid.get("rowCount", DEFAULT_ROWS),
+                                   grid.get("columnCount", DEFAULT_COLUMNS))
+            return {"addSheet": {"properties": sheet.properties()}}
+        if kind == "deleteSheet":
+            self.spreadsheets[file_id].remove(self.__sheet_by_id(file_id, spec["sheetId"]))
+            return {}
+        if kind in ("insertDimension", "deleteDimension"):
+            dimension_range = spec["range"]
+            sheet = self.__sheet_by_id(file_id, dimension_range["sheetId"])
+            size = sheet.row_count if dimension_range["dimension"] == "ROWS" else sheet.column_count
+            start, end = dimension_range.get("startIndex", 0), dimension_range.get("endIndex", size)
+            if kind == "insertDimension":
+                sheet.insert(dimension_range["dimension"], start, end)
+            else:
+                sheet.delete(dimension_range["dimension"], start, min(end, size))
+            return {}
+        if kind == "appendDimension":
+            sheet = self.__sheet_by_id(file_id, spec["sheetId"])
+            size = sheet.row_count if spec["dimension"] == "ROWS" else sheet.column_count
+            sheet.insert(spec["dimension"], size, size + spec["length"])
+            return {}
+        if kind == "updateSheetProperties":
+            properties = spec["properties"]
+            sheet = self.__sheet_by_id(file_id, properties["sheetId"])
+            sheet.title = properties.get("title", sheet.title)
+            grid = properties.get("gridProperties", {})
+            sheet.row_count = grid.get("rowCount", sheet.row_count)
+            sheet.column_count = grid.get("columnCount", sheet.column_count)
+            # Cells outside of the grid are gone
+            del sheet.cells[sheet.row_count:]
+            for row in sheet.cells:
+                del row[sheet.column_count:]
+            return {}
+        raise ValueError("Unsupported request: %s" % (kind))
@@ -0,0 +1,204 @@
+"""An httplib2.Http stand-in that routes Google API requests to the in-memory backends."""
+
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from email.parser import FeedParser
+from typing import Any, Dict, Tuple
+import httplib2 # type: ignore
+from .drive_backend import DriveBackend, Response, error_response
+from .sheets_backend import SheetsBackend
+
+DRIVE_HOST = "www.googleapis.com"
+SHEETS_HOST = "sheets.googleapis.com"
+
+class Emulator:
+    """Holds the emulated services together with latency and throttling settings.
+
+    Every request waits [latency] seconds, list calls return at most [max_page_size] files, and a
+    [throttle_rate] share of the requests (outside of batches) fails with a 429."""
+
+    def __init__(self, latency : float = 0.0, max_page_size : int = 1000,
+                 throttle_rate : float = 0.0, seed : int = 0) -> None:
+        self.drive = DriveBackend(max_page_size)
+        self.sheets = SheetsBackend(self.drive)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.requests : Dict[str, int] = {}
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+
+    def http(self) -> "EmulatorHttp":
+        return EmulatorHttp(self)
+
+    def credentials(self) -> "EmulatorCredentials":
+        """Stands in for the OAuth credentials, see api_utils.use_backend."""
+        return EmulatorCredentials(self)
+
+    def count(self, operation : str) -> None:
+        with self.__lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def throttled(self) -> bool:
+        with self.__lock:
+            return self.throttle_rate > 0 and self.__random.random() < self.throttle_rate
+
+class EmulatorCredentials:
+    """Authorizes transports for the emulator, without any tokens that could expire."""
+
+    invalid = False
+    access_token = "emulated"
+    access_token_expired = False
+
+    def __init__(self, emulator : Emulator) -> None:
+        self.emulator = emulator
+
+    def authorize(self, _http) -> "EmulatorHttp":
+        return self.emulator.http()
+
+    def refresh(self, _http) -> None:
+        pass
+
+class EmulatorHttp:
+    """Answers requests the same way httplib2.Http.request would."""
+
+    def __init__(self, emulator : Emulator) -> None:
+        self.emulator = emulator
+        self.timeout = None
+        self.redirect_codes = httplib2.Http().redirect_codes
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=None, connection_type=None) -> Tuple[httplib2.Response, bytes]:
+        # pylint: disable=W0613,R0913
+        if body is not None and hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if self.emulator.latency > 0:
+            time.sleep(self.emulator.latency)
+        status, response_headers, content = self.dispatch(uri, method, body or b"", headers or {})
+        response_headers = dict(response_headers)
+        response_headers["status"] = str(status)
+        return httplib2.Response(response_headers), content
+
+    def dispatch(self, uri : str, method : str, body : bytes, headers : Dict[str, str]) -> Response:
+        # pylint: disable=R0911,R0912
+        parsed = urllib.parse.urlparse(uri)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        path = urllib.parse.unquote(parsed.path)
+        route = self.__route(parsed.netloc, method, path, params)
+        self.emulator.count(route)
+        if route != "batch" and self.emulator.throttled():
+            return error_response(429, "rateLimitExceeded", "Rate Limit Exceeded")
+        drive = self.emulator.drive
+        if route == "batch":
+            return self.__batch(parsed.netloc, body, headers)
+        if route == "drive.files.list":
+            return drive.list_files(params)
+        if route == "drive.files.create":
+            return drive.create_file(json.loads(body), None)
+        if route == "drive.files.generateIds":
+            return drive.generate_ids(params)
+        if route in ("drive.files.get", "drive.files.get_media"):
+            return drive.get_file(path.rsplit("/", 1)[1], params, headers)
+        if route == "drive.files.update":
+            return drive.update_file(path.rsplit("/", 1)[1], params, json.loads(body) if body else {}, None)
+        if route == "drive.files.delete":
+            return drive.delete_file(path.rsplit("/", 1)[1])
+        if route == "drive.changes.getStartPageToken":
+            return drive.start_page_token()
+        if route == "drive.changes.list":
+            return drive.list_changes(params)
+        if route == "drive.upload.chunk":
+            return drive.upload_chunk(params["upload_id"], headers, body)
+        if route == "drive.upload":
+            match = re.match(r"^/upload/drive/v3/files(?:/([^/]+))?$", path)
+            assert match is not None
+            base_uri = "https://%s%s" % (parsed.netloc, parsed.path)
+            return drive.upload(method, match.group(1), params, headers, body, base_uri)
+        if route.startswith("sheets."):
+            return self.emulator.sheets.dispatch(route, path, urllib.parse.parse_qs(parsed.query), body)
+        return error_response(404, "notFound", "Unknown endpoint %s %s" % (method, uri))
+
+    @staticmethod
+    def __route(host : str, method : str, path : str, params : Dict[str, str]) -> str:
+        # pylint: disable=R0911,R0912
+        if path.startswith("/batch/"):
+            return "batch"
+        if host == SHEETS_HOST:
+            if re.match(r"^/v4/spreadsheets/[^/]+:batchUpdate$", path):
+                return "sheets.batchUpdate"
+            if re.match(r"^/v4/spreadsheets/[^/]+/values:batchGet$", path):
+                return "sheets.values.batchGet"
+            if re.match(r"^/v4/spreadsheets/[^/]+/values:batchUpdate$", path):
+                return "sheets.values.batchUpdate"
+            if re.match(r"^/v4/spreadsheets/[^/]+/values:batchClear$", path):
+                return "sheets.values.batchClear"
+            if re.match(r"^/v4/spreadsheets/[^/]+/values/.+:append$", path):
+                return "sheets.values.append"
+            if re.match(r"^/v4/spreadsheets/[^/]+/values/.+:clear$", path):
+                return "sheets.values.clear"
+            if re.match(r"^/v4/spreadsheets/[^/]+/values/.+$", path):
+                return "sheets.values.get" if method == "GET" else "sheets.values.update"
+            if re.match(r"^/v4/spreadsheets/[^/]+$", path):
+                return "sheets.get"
+            return "unknown"
+        if path.startswith("/upload/drive/v3/files"):
+            if "upload_id" in params:
+                return "drive.upload.chunk"
+            return "drive.upload"
+        if path == "/drive/v3/files":
+            return "drive.files.list" if method == "GET" else "drive.files.create"
+        if path == "/drive/v3/files/generateIds":
+            return "drive.files.generateIds"
+        if path.startswith("/drive/v3/files/"):
+            if method == "PATCH":
+                return "drive.files.update"
+            if method == "DELETE":
+                return "drive.files.delete"
+            return "drive.files.get_media" if params.get("alt") == "media" else "drive.files.get"
+        if path == "/drive/v3/changes/startPageToken":
+            return "drive.changes.getStartPageToken"
+        if path == "/drive/v3/changes":
+            return "drive.changes.list"
+        return "unknown"
+
+    def __batch(self, host : str, body : bytes, headers : Dict[str, str]) -> Response:
+        # pylint: disable=R0914
+        content_type = {k.lower(): v for k, v in headers.items()}["content-type"]
+        parser = FeedParser()
+        parser.feed("content-type: %s\r\n\r\n" % content_type)
+        parser.feed(body.decode("utf-8"))
+        message = parser.close()
+        parts : Any = message.get_payload()
+        if len(parts) > 100:
+            return error_response(400, "limitExceeded", "A maximum of 100 calls can be batched.")
+        boundary = "batch_emulated"
+        out = []
+        for part in parts:
+            content_id = part["Content-ID"]
+            status, response_headers, content = self.__batch_part(host, part.get_payload())
+            lines = ["--%s" % boundary, "Content-Type: application/http",
+                     "Content-ID: <response-%s>" % content_id[1:-1], "",
+                     "HTTP/1.1 %d %s" % (status, "OK" if status < 300 else "Error")]
+            for key, value in response_headers.items():
+                lines.append("%s: %s" % (key, value))
+            lines.append("")
+            lines.append(content.decode("utf-8"))
+            out.append("\r\n".join(lines))
+        out.append("--%s--" % boundary)
+        return 200, {"content-type": "multipart/mixed; boundary=%s" % boundary}, "\r\n".join(out).encode("utf-8")
+
+    def __batch_part(self, host : str, payload : str) -> Response:
+        request_line, rest = payload.split("\n", 1)
+        method, path, _version = request_line.strip().split(" ", 2)
+        head, _, part_body = rest.replace("\r\n", "\n").partition("\n\n")
+        part_headers : Dict[str, str] = {}
+        for line in head.split("\n"):
+            if ":" in line:
+                key, value = line.split(":", 1)
+                part_headers[key.strip()] = value.strip()
+        return self.dispatch("https://%s%s" % (host, path), method, part_body.encode("utf-8"), part_headers)
@@ -0,0 +1,46 @@
+"""Builds synthetic folder trees in the emulated Drive, e.g. for benchmarks."""
+
+from typing import List
+from .drive_backend import DriveBackend
+
+def balanced(drive : DriveBackend, depth : int, fanout : int, files : int, parent : str = "root",
+             size : int = 0) -> int:
+    """Adds [files] files of [size] bytes and [fanout] folders to the parent, and the same below every folder
+    down to [depth] levels. Returns the number of files and folders that were added."""
+    # pylint: disable=R0913
+
+    content = b"x" * size
+    added = 0
+    level = [ drive.resolve_id(parent) ]
+    for current in range(depth + 1):
+        next_level : List[str] = []
+        for folder in level:
+            for i in range(files):
+                drive.add("file%d.txt" % (i), folder, content=content)
+            added += files
+            if current < depth:
+                next_level.extend(drive.mkdir("dir%d" % (i), folder)["id"] for i in range(fanout))
+                added += fanout
+        level = next_level
+    return added
+
+def sized(drive : DriveBackend, count : int, fanout : int = 10, files : int = 100, parent : str = "root") -> int:
+    """Adds a balanced tree that is just deep enough to hold about [count] files and folders, e.g. 1M."""
+
+    depth = 0
+    while (files + fanout) * sum(fanout ** level for level in range(depth + 1)) < count:
+        depth += 1
+    return balanced(drive, depth, fanout, files, parent)
+
+def wide(drive : DriveBackend, folders : int, files : int, parent : str = "root") -> int:
+    """Adds [folders] sibling folders with [files] files each."""
+
+    added = 0
+    for i in range(folders):
+        folder = drive.mkdir("dir%d" % (i), parent)["id"]
+        added += 1 + balanced(drive, 0, 0, files, folder)
+    return added
+
+def deep(drive : DriveBackend, depth : int, files : int, parent : str = "root") -> int:
+    """Adds a chain of [depth] nested folders with [files] files in each."""
+    return balanced(drive, depth, 1, files, parent)
@@ -0,0 +1,262 @@
+"""Paces all requests to an API so that parallel work stays within the quotas instead of failing."""
+
+import os
+import json
+import time
+import email
+import random
+import socket
+import asyncio
+import threading
+from typing import Any, Dict, List, Tuple
+from httplib2 import HttpLib2Error # type: ignore
+from .stats import record_request
+
+# Requests per second and burst size of the per-user quotas (Drive: 12,000 per minute, Sheets: 60 per minute)
+RATE_LIMITS = {
+    "drive": (200.0, 200),
+    "sheets": (1.0, 60)
+}
+INITIAL_CONCURRENCY = 8
+MAX_CONCURRENCY = 64
+
+MAX_RETRIES = 7
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 32.0
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# Sending these again has the same effect as sending them once (PATCH too, as the Drive and Sheets APIs only
+# use it to set fields)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "PATCH", "DELETE")
+# Failures to connect or to get a response (socket.timeout is only an alias of TimeoutError since Python 3.10,
+# and httplib2 wraps some failures like unknown hosts into its own errors)
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, socket.timeout, HttpLib2Error)
+# A 403 with one of these reasons is a throttled request, any other 403 is a real permission error
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+class TokenBucket:
+    """Hands out [rate] tokens per second, with up to [burst] tokens saved up."""
+
+    def __init__(self, rate : float, burst : int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a token is available and takes it."""
+        time.sleep(self.reserve())
+
+    def reserve(self) -> float:
+        """Takes the next token right away and returns how many seconds to wait before using it.
+
+        Unlike acquire this never blocks, so that coroutines can wait with asyncio.sleep instead."""
+
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(float(self.burst), self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            # Tokens may go negative, which queues up the callers behind each other
+            self.__tokens -= 1
+            return max(0.0, -self.__tokens / self.rate)
+
+class AdaptiveConcurrency:
+    """Limits the requests in flight with AIMD: the limit grows by one per limit successful requests,
+    and is halved when we're throttled (at most once per second, as throttled responses arrive in bursts)."""
+
+    def __init__(self, initial : int = INITIAL_CONCURRENCY, maximum : int = MAX_CONCURRENCY) -> None:
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.__active = 0
+        self.__decreased_at = 0.0
+        self.__condition = threading.Condition()
+        # Coroutines waiting for a slot, with the loop that needs to wake them up
+        self.__waiters : List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def acquire(self) -> None:
+        with self.__condition:
+            while self.__active >= int(self.limit):
+                self.__condition.wait()
+            self.__active += 1
+
+    async def acquire_async(self) -> None:
+        """Like acquire, but waits on the event loop instead of blocking it."""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.__condition:
+                if self.__active < int(self.limit):
+                    self.__active += 1
+                    return
+                waiter = loop.create_future()
+                self.__waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, throttled : bool) -> None:
+        with self.__condition:
+            self.__active -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self.__decreased_at >= 1.0:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.__decreased_at = now
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.__condition.notify_all()
+            for loop, waiter in self.__waiters:
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(_wake, waiter)
+            self.__waiters = []
+
+def _wake(waiter : asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+class Scheduler:
+    """Sends the requests of all threads for one API and user through a token bucket and an adaptive
+    concurrency limit, and retries throttled and failed requests with exponential backoff and jitter."""
+
+    def __init__(self, rate : float, burst : int, max_retries : int = MAX_RETRIES) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.retries = 0
+        self.__lock = threading.Lock()
+
+    def count_retry(self) -> None:
+        """Counts a request that is sent again, from any thread."""
+        with self.__lock:
+            self.retries += 1
+
+    def request(self, send, uri, method, body, headers, *args, **kwargs) -> Tuple[Any, Any]:
+        """Sends a request with [send] (like httplib2.Http.request), retrying it while that makes sense."""
+        # pylint: disable=R0913
+
+        # A stream was consumed by the first attempt, so only requests with plain bodies can be sent again
+        can_retry = body is None or isinstance(body, (bytes, str))
+        idempotent = is_idempotent(uri, method, body, headers)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.concurrency.acquire()
+            resp, content, throttled = None, None, False
+            started = time.perf_counter()
+            try:
+                resp, content = send(uri, method, body, headers, *args, **kwargs)
+                throttled = is_throttled(resp, content)
+            except CONNECTION_ERRORS:
+                if not can_retry or not idempotent or attempt >= self.max_retries:
+                    raise
+            finally:
+                self.concurrency.release(throttled)
+                record_request(uri, method, body, resp, content, started, attempt > 0)
+
+            if (resp is not None and not is_retryable(resp, content, idempotent)) or not can_retry or \
+                    attempt >= self.max_retries:
+                return resp, content
+
+            self.count_retry()
+            time.sleep(backoff_delay(attempt, resp))
+            attempt += 1
+
+class ScheduledHttp:
+    """Routes all requests of an (authorized) httplib2 transport through a scheduler.
+
+    The transport itself can be shared by several of these, e.g. for different APIs."""
+
+    def __init__(self, http, scheduler : Scheduler) -> None:
+        self.http = http
+        self.scheduler = scheduler
+        # googleapiclient looks for the credentials here to refresh them before batches
+        self.credentials = getattr(http.request, "credentials", None)
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        # pylint: disable=W1113
+        return self.scheduler.request(self.http.request, uri, method, body, headers, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+def backoff_delay(attempt : int, resp = None) -> float:
+    """Exponential backoff with full jitter, but never shorter than what the server asked for."""
+
+    delay = random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+    retry_after = resp.get("retry-after") if resp is not None else None
+    if retry_after is not None and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+def is_retryable(resp, content, idempotent : bool = True) -> bool:
+    """Returns true if the request failed in a way that may succeed when it's sent again later.
+
+    Throttled requests were never processed, but other failures may have been, so they are only retried
+    for [idempotent] requests."""
+    return is_throttled(resp, content) or (idempotent and resp.status in RETRYABLE_STATUSES)
+
+def is_idempotent(uri : str, method : str, body, headers) -> bool:
+    """Returns true if sending the request twice can't do anything twice. Besides the idempotent methods
+    that's starting a resumable upload session, and creating a file with an id that we generated (where
+    the second attempt fails if the first one went through)."""
+
+    method = method.upper()
+    if method in IDEMPOTENT_METHODS:
+        return True
+    if method != "POST":
+        return False
+    if "uploadType=resumable" in uri:
+        return True
+    metadata = request_metadata(body, headers)
+    return isinstance(metadata, dict) and "id" in metadata
+
+def request_metadata(body, headers) -> Any:
+    """Returns the JSON that a request sends, or the JSON part of a multipart upload (None if there is none)."""
+
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    content_type = {key.lower(): value for key, value in (headers or {}).items()}.get("content-type", "")
+    if content_type.startswith("multipart/"):
+        message = email.message_from_bytes(("Content-Type: %s\r\n\r\n" % (content_type)).encode("utf-8") + body)
+        parts = list(message.walk())[1:]
+        if len(parts) == 0:
+            return None
+        body = parts[0].get_payload(decode=True)
+    try:
+        return json.loads(body)
+    except (ValueError, TypeError):
+        return None
+
+def is_throttled(resp, content) -> bool:
+    """Returns true if the response says that we exceeded a rate limit."""
+
+    if resp.status == 429:
+        return True
+    if resp.status != 403:
+        return False
+    try:
+        error = json.loads(content)["error"]
+    except (ValueError, KeyError, TypeError):
+        return False
+    return error.get("status") == "RESOURCE_EXHAUSTED" or \
+        any(e.get("reason") in RATE_LIMIT_REASONS for e in error.get("errors", []))
+
+_schedulers : Dict[Tuple[str, str], Scheduler] = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(api : str, token : str) -> Scheduler:
+    """Returns the scheduler that all clients of the [api] with the same user [token] share."""
+
+    key = (api, os.path.abspath(token))
+    with _schedulers_lock:
+        if key not in _schedulers:
+            rate, burst = RATE_LIMITS[api]
+            _schedulers[key] = Scheduler(rate, burst)
+        return _schedulers[key]
+
+def reset_schedulers() -> None:
+    """Forgets all schedulers, so that clients created from now on start with a full quota."""
+
+    with _schedulers_lock:
+        _schedulers.clear()
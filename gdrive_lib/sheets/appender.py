@@ -0,0 +1,135 @@
+"""Appends rows to a sheet in batches, for producers that emit them one at a time."""
+
+import time
+import threading
+from typing import Any, List, Optional
+from .spreadsheet import Spreadsheet
+
+DEFAULT_MAX_ROWS = 10000
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+DEFAULT_INTERVAL = 5.0
+
+def body_size(rows : List[List[Any]]) -> int:
+    """Returns about how many bytes the rows take up in the JSON body of a request."""
+    return sum(sum(len(str(value)) + 3 for value in row) + 2 for row in rows)
+
+class SheetAppender:
+    """Buffers rows and appends them below the data of the sheet with values().append, once [max_rows]
+    rows or [max_bytes] bytes are buffered, or [interval] seconds after the first buffered row.
+
+    Rows of all threads are appended in the order in which append() was called. Use it as a context
+    manager, or call close(), so that the remaining rows are flushed:
+
+        with SheetAppender(spreadsheet, "Metrics") as appender:
+            for row in rows:
+                appender.append(row)
+    """
+    # pylint: disable=R0902
+
+    __buffer : List[List[Any]]
+    __error : Optional[BaseException]
+
+    def __init__(self, spreadsheet : Spreadsheet, sheet_name : str, max_rows : int = DEFAULT_MAX_ROWS,
+                 max_bytes : int = DEFAULT_MAX_BYTES, interval : Optional[float] = DEFAULT_INTERVAL) -> None:
+        # pylint: disable=R0913
+        self.spreadsheet = spreadsheet
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.rows_appended = 0
+        self.__buffer = []
+        self.__bytes = 0
+        self.__first_buffered = 0.0
+        self.__error = None
+        self.__closed = False
+        # Guards the buffer, while the send lock keeps the batches in order
+        self.__lock = threading.Condition()
+        self.__send_lock = threading.Lock()
+        self.__timer : Optional[threading.Thread] = None
+
+    def __enter__(self) -> "SheetAppender":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def append(self, row : List[Any]) -> None:
+        self.append_rows([row])
+
+    def append_rows(self, rows : List[List[Any]]) -> None:
+        """Buffers the rows, and appends the buffer right away if it's full."""
+
+        with self.__lock:
+            self.__raise_error()
+            if self.__closed:
+                raise RuntimeError("The appender is closed")
+            if len(self.__buffer) == 0:
+                self.__first_buffered = time.monotonic()
+                self.__lock.notify_all()
+            self.__buffer.extend(rows)
+            self.__bytes += body_size(rows)
+            full = len(self.__buffer) >= self.max_rows or self.__bytes >= self.max_bytes
+            if self.interval is not None and self.__timer is None:
+                self.__timer = threading.Thread(target=self.__flush_periodically, daemon=True)
+                self.__timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends all buffered rows."""
+
+        with self.__send_lock:
+            with self.__lock:
+                rows = self.__buffer
+                self.__buffer, self.__bytes = [], 0
+            if len(rows) == 0:
+                return
+            try:
+                self.spreadsheet.append_data(rows, self.sheet_name)
+            except BaseException:
+                with self.__lock:
+                    # Keep the rows, so that a later flush can try again (the timer after another interval)
+                    self.__buffer[:0] = rows
+                    self.__bytes += body_size(rows)
+                    self.__first_buffered = time.monotonic()
+                raise
+            self.rows_appended += len(rows)
+
+    def close(self) -> None:
+        """Flushes the remaining rows and stops the timer."""
+
+        with self.__lock:
+            self.__closed = True
+            self.__lock.notify_all()
+        if self.__timer is not None:
+            self.__timer.join()
+            self.__timer = None
+        with self.__lock:
+            self.__error = None
+        self.flush()
+
+    def __flush_periodically(self) -> None:
+        assert self.interval is not None
+        with self.__lock:
+            while not self.__closed:
+                if len(self.__buffer) == 0:
+                    self.__lock.wait()
+                    continue
+                remaining = self.__first_buffered + self.interval - time.monotonic()
+                if remaining > 0:
+                    self.__lock.wait(remaining)
+                    continue
+                self.__lock.release()
+                try:
+                    self.flush()
+                except BaseException as e: # pylint: disable=W0703
+                    # Raised by the next append instead
+                    self.__error = e
+                finally:
+                    self.__lock.acquire()
+
+    def __raise_error(self) -> None:
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
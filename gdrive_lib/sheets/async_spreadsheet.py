@@ -0,0 +1,36 @@
+"""Asyncio counterpart of Spreadsheet."""
+
+from typing import Any, List
+from .sheets_api import SheetsApi
+from .spreadsheet import a1_range
+from ..aio import AsyncTransport
+
+class AsyncSpreadsheet:
+    __api : SheetsApi
+    __transport : AsyncTransport
+    file_id : str
+
+    def __init__(self, api, transport, file_id) -> None:
+        self.__api = api
+        self.__transport = transport
+        self.file_id = file_id
+
+    async def get_data(self, sheet_name=None, cell_range=None) -> List[Any]:
+        """Returns all values in the range within the given sheet, or all of its values without a range."""
+
+        request = self.__api.values().get(spreadsheetId=self.file_id, range=a1_range(sheet_name, cell_range))
+        result = await self.__transport.execute(request)
+        return result.get('values', [])
+
+    async def write_data(self, values, sheet_name=None, cell="A1") -> None:
+        """Writes the given values into the cells within the given sheet."""
+
+        cell = a1_range(sheet_name, cell)
+        request = self.__api.values().update(
+            spreadsheetId=self.file_id,
+            range=cell,
+            body={ "values": values },
+            valueInputOption="USER_ENTERED")
+        await self.__transport.execute(request)
+
+        return values
@@ -0,0 +1,76 @@
+"""Finds the cells in which two versions of a sheet differ, so that only those need to be written."""
+
+import itertools
+from typing import Any, Iterable, Iterator, List, NamedTuple, Tuple
+
+# About what every additional range of a request costs, in cells
+RANGE_OVERHEAD = 8
+
+class ChangedRange(NamedTuple):
+    """A rectangle of cells with its top left corner at [row] and [col] (0-based)."""
+    row : int
+    col : int
+    values : List[List[str]]
+
+def cell_text(value : Any) -> str:
+    """Returns the value as it would be written in a csv file, e.g. for the unformatted values of the API."""
+
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return "%d" % (value)
+    return str(value)
+
+def trim_row(row : List[str]) -> List[str]:
+    """Drops empty trailing cells, which the API leaves out of its responses."""
+
+    end = len(row)
+    while end > 0 and row[end - 1] == "":
+        end -= 1
+    return row[:end]
+
+def changed_columns(before : List[str], after : List[str], cols : int) -> Tuple[int, int]:
+    """Returns the first and the end column in which the rows differ, or (0, 0) if they don't."""
+
+    width = min(cols, max(len(before), len(after)))
+    differs = [c for c in range(width)
+               if (before[c] if c < len(before) else "") != (after[c] if c < len(after) else "")]
+    if len(differs) == 0:
+        return 0, 0
+    return differs[0], differs[-1] + 1
+
+def changed_ranges(old : Iterable[List[str]], new : Iterable[List[str]], rows : int, cols : int,
+                   max_cells : int) -> Iterator[ChangedRange]:
+    """Yields the ranges in which the [new] rows differ from the [old] ones, in a sheet that is resized to
+    [rows] and [cols] (so nothing beyond that needs to be written). Cells that only the old rows have are
+    cleared with empty values. Consecutive changed rows are merged into one range of at most [max_cells]."""
+    # pylint: disable=R0914
+
+    empty : List[str] = []
+    block : List[Tuple[int, int, List[str]]] = []
+    start, left, right, useful = 0, 0, 0, 0
+    for index, (before, after) in enumerate(itertools.zip_longest(old, new, fillvalue=empty)):
+        if index >= rows:
+            break
+        before, after = trim_row(before), trim_row(after)
+        first, end = changed_columns(before, after, cols)
+        if len(block) > 0:
+            merged = (len(block) + 1) * (max(right, end) - min(left, first))
+            # Unchanged cells in a range are written again, so a range may hold at most as many of them as changed
+            # ones (plus what an additional range costs), which keeps the total within twice the changed cells
+            if end == first or merged > max_cells or merged > 2 * (useful + end - first) + RANGE_OVERHEAD:
+                yield _range(start, left, right, block)
+                block = []
+        if end == first:
+            continue
+        if len(block) == 0:
+            start, left, right, useful = index, first, end, 0
+        left, right = min(left, first), max(right, end)
+        useful += end - first
+        block.append((first, end, after))
+    if len(block) > 0:
+        yield _range(start, left, right, block)
+
+def _range(start : int, left : int, right : int, block : List[Tuple[int, int, List[str]]]) -> ChangedRange:
+    values = [[row[c] if c < len(row) else "" for c in range(left, right)] for _first, _end, row in block]
+    return ChangedRange(start, left, values)
@@ -0,0 +1,46 @@
+"""Exports all spreadsheets below a Drive folder as CSV files."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+from googleapiclient.errors import HttpError # type: ignore
+from ..drive.drive import Drive, local_targets
+from ..drive.transfer import TransferStats
+from .sheets import Sheets
+
+DEFAULT_WORKERS = 8
+
+def export_spreadsheets(drive : Drive, sheets : Sheets, remote_dir : str, local_dir : str,
+                        workers : int = DEFAULT_WORKERS) -> Optional[TransferStats]:
+    """Writes every sheet of every spreadsheet below [remote_dir] to <local_dir>/<path of the spreadsheet>/
+    <sheet name>.csv, exporting [workers] spreadsheets at a time. Each spreadsheet takes two requests,
+    which all go through the shared Sheets quota."""
+    # pylint: disable=R0914
+
+    folder = drive.resolve(remote_dir)
+    if folder is None or not folder.is_dir:
+        print("Can not export the spreadsheets because there is no folder at that path.", remote_dir)
+        return None
+
+    drive.ls_all(folder.path, max_workers=workers)
+    spreadsheets = [f for f in drive.fs.files_below(folder.path) if f.is_spreadsheet]
+    os.makedirs(local_dir, exist_ok=True)
+
+    stats = TransferStats()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for f, target in local_targets(spreadsheets, folder.path, local_dir):
+            futures[pool.submit(sheets.get_spreadsheet(f.id).export_csv, target)] = f
+
+        for future in as_completed(futures):
+            try:
+                for _path, size in future.result():
+                    stats.add(size)
+            except (HttpError, OSError) as e:
+                # Skip the workbook (e.g. if the disk is full or a name isn't allowed), but export the others
+                stats.fail()
+                print("Failed to export %s: %s" % (futures[future].path, e))
+    stats.finish()
+
+    print(stats.summary("Exported"))
+    return stats
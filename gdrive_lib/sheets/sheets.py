@@ -1,5 +1,7 @@
 from .sheets_api import SheetsApi
 from .spreadsheet import Spreadsheet
+from .async_spreadsheet import AsyncSpreadsheet
+from ..aio import AsyncTransport, DEFAULT_POOL_SIZE
 
 class Sheets:
     def __init__(self, scope, credentials, token) -> None:
@@ -7,3 +9,22 @@ class Sheets:
 
     def get_spreadsheet(self, file_id : str) -> Spreadsheet:
         return Spreadsheet(self.__api, file_id)
+
+class AsyncSheets:
+    """Hands out AsyncSpreadsheets, which all share one pooled async transport."""
+
+    def __init__(self, scope, credentials, token, pool_size=DEFAULT_POOL_SIZE) -> None:
+        self.__api = SheetsApi(scope, credentials, token)
+        self.__transport = AsyncTransport("sheets", scope, credentials, token, pool_size)
+
+    def get_spreadsheet(self, file_id : str) -> AsyncSpreadsheet:
+        return AsyncSpreadsheet(self.__api, self.__transport, file_id)
+
+    async def __aenter__(self) -> "AsyncSheets":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.__transport.close()
@@ -1,9 +1,7 @@
 """Manage queries and permissions for Sheets API"""
 
 from typing import Any
-from googleapiclient.discovery import build # type: ignore
-from httplib2 import Http # type: ignore
-from ..api_utils import init_credentials
+from ..api_utils import build_service, get_credentials
 
 SHEET_READONLY = "https://www.googleapis.com/auth/spreadsheets.readonly"
 SHEET_FULL     = "https://www.googleapis.com/auth/spreadsheets"
@@ -12,18 +10,20 @@ class SheetsApi:
     """Handles interactions with Sheet documents."""
 
     def __init__(self, scope, credentials, token) -> None:
-        creds = init_credentials(credentials, token, scope)
-        self.__service = build('sheets', 'v4', http=creds.authorize(Http()))
+        self.__scope = scope
+        self.__credentials = credentials
+        self.__token = token
+        get_credentials(credentials, token, scope)
 
     def __api(self) -> Any:
         # pylint: disable=E1101
-        return self.__service.spreadsheets()
+        return build_service('sheets', 'v4', self.__credentials, self.__token, self.__scope).spreadsheets()
 
     def values(self) -> Any:
         return self.__api().values()
 
-    def get(self, spreadsheet_id) -> Any:
-        return self.__api().get(spreadsheetId=spreadsheet_id)
+    def get(self, spreadsheet_id, fields=None) -> Any:
+        return self.__api().get(spreadsheetId=spreadsheet_id, fields=fields)
 
     def batch_update(self, file_id, requests) -> None:
         """Send the given batch update [requests] for the given file"""
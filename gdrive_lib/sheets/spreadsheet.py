@@ -1,8 +1,118 @@
 """Handles operations on Google Spreadsheets."""
 
+import os
+import re
 import csv
-from typing import Any, List, Optional
+import itertools
+import contextlib
+from os.path import dirname, join
+from urllib.parse import quote
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
 from .sheets_api import SheetsApi
+from .delta import cell_text, changed_ranges
+
+# Cells per request when iterating rows, which keeps the responses at a few MB
+CELLS_PER_REQUEST = 200000
+# Sheets can't have more columns than this, so ranges up to it include every column
+LAST_COLUMN = "ZZZ"
+# Names of devices, which Windows doesn't allow as file names (with any extension)
+RESERVED_NAMES = {"CON", "PRN", "AUX", "NUL"} | {"%s%d" % (port, n) for port in ("COM", "LPT") for n in range(1, 10)}
+
+def column_letters(count : int) -> str:
+    """Returns the name of the [count]th column, e.g. 1 -> A and 27 -> AA."""
+
+    letters = ""
+    while count > 0:
+        count, rest = divmod(count - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+def cell_position(cell : str) -> Tuple[int, int]:
+    """Returns the row and column index of a cell in A1 notation, e.g. (2, 1) for B3."""
+
+    match = re.match(r"^([A-Za-z]*)(\d*)$", cell)
+    if match is None:
+        raise ValueError("Unable to parse cell: %s" % (cell))
+    col = 0
+    for letter in match.group(1).upper():
+        col = col * 26 + ord(letter) - ord("A") + 1
+    return int(match.group(2)) - 1 if match.group(2) else 0, max(0, col - 1)
+
+def csv_size(local : str, delimiter : str = ',') -> Tuple[int, int]:
+    """Returns the rows and the most columns of any row in the csv file, without keeping it in memory."""
+
+    rows, cols = 0, 0
+    with open(local, "r", encoding="utf-8", newline="") as fh:
+        for line in csv.reader(fh, delimiter=delimiter):
+            rows += 1
+            cols = max(cols, len(line))
+    return rows, cols
+
+def _copy_rows(rows : Iterable[List[str]], writer) -> Iterator[List[str]]:
+    for row in rows:
+        writer.writerow(row)
+        yield row
+
+def _same_cell(formula : Any, formatted : str, text : str) -> bool:
+    """Returns true if a cell that was written with USER_ENTERED still holds the [text] of a csv cell, which
+    it may store as a number (e.g. 1.50 as 1.5) or show formatted (e.g. 50% or 2024-01-31)."""
+
+    if text in (cell_text(formula), formatted):
+        return True
+    if isinstance(formula, (int, float)) and not isinstance(formula, bool):
+        try:
+            return float(text) == formula
+        except ValueError:
+            return False
+    return False
+
+def _match_rendered(rendered : Iterable[Tuple[List[Any], List[str]]],
+                    new : Iterable[List[str]]) -> Tuple[Iterator[List[str]], Iterator[List[str]]]:
+    """Turns the (FORMULA, FORMATTED_VALUE) renderings of the old rows into old rows that changed_ranges can
+    compare with the [new] ones: cells that match either rendering take the new text."""
+
+    def old_row(forms : Optional[Tuple[List[Any], List[str]]], row : Optional[List[str]]) -> List[str]:
+        if forms is None:
+            return []
+        formula, formatted = forms
+        cells = []
+        for c, value in enumerate(formula):
+            shown = formatted[c] if c < len(formatted) else ""
+            if row is not None and c < len(row) and _same_cell(value, shown, row[c]):
+                cells.append(row[c])
+            else:
+                cells.append(cell_text(value))
+        return cells
+
+    # Both sides are consumed in lockstep, so tee only ever holds a row
+    olds, news = itertools.tee(itertools.zip_longest(rendered, new, fillvalue=None))
+    return (old_row(forms, row) for forms, row in olds), ((row or []) for _forms, row in news)
+
+def a1_range(sheet_name : Optional[str], cell_range : Optional[str]) -> str:
+    """Returns the range in A1 notation, which is the whole sheet if there is no [cell_range]."""
+
+    if sheet_name is None:
+        return cell_range or "A:%s" % (LAST_COLUMN)
+    quoted = "'%s'" % (sheet_name.replace("'", "''"))
+    return quoted if cell_range is None else "%s!%s" % (quoted, cell_range)
+
+def file_names(titles : List[str], ext : str) -> List[str]:
+    """Returns a distinct file name for each sheet title, which is valid on Windows as well. Characters that
+    aren't allowed are replaced with '_', and repeated names (ignoring case) get a number appended."""
+
+    names, used = [], set()
+    for title in titles:
+        name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", title).rstrip(". ") or "_"
+        if name.split(".")[0].upper() in RESERVED_NAMES:
+            name = "_" + name
+        unique, number = name, 0
+        while unique.lower() in used:
+            number += 1
+            unique = "%s (%d)" % (name, number)
+        used.add(unique.lower())
+        names.append(unique + ext)
+    return names
 
 class Spreadsheet:
     __api : SheetsApi
@@ -13,49 +123,233 @@ class Spreadsheet:
         self.file_id = file_id
 
 
-    def get_data(self, sheet_name=None, cell_range="A:Z") -> List[Any]:
-        """Returns all values in the range A:Z within the given sheet."""
-
-        if sheet_name is not None:
-            cell_range = "%s!%s" % (sheet_name, cell_range)
+    def get_data(self, sheet_name=None, cell_range=None) -> List[Any]:
+        """Returns all values in the range within the given sheet, or all of its values without a range."""
 
+        cell_range = a1_range(sheet_name, cell_range)
         result = self.__api.values().get(spreadsheetId=self.file_id, range=cell_range).execute()
         values = result.get('values', [])
         return values
 
-    def upload_csv(self, local, sheet_name, delimiter=',', cell="A1") -> None:
-        """Reads all values from the csv file and writes it to the remote sheet."""
-        spreadsheet = self.__api.get(self.file_id).execute()
+    def iter_rows(self, sheet_name=None, chunk_rows : Optional[int] = None, windows : int = 1,
+                  value_render_option : str = "FORMATTED_VALUE") -> Iterator[List[Any]]:
+        """Yields the rows of the given sheet (or the first one) in windows of [chunk_rows] rows, so that
+        sheets of any size can be read with flat memory. Each values().batchGet fetches [windows] windows,
+        and the next one is already on its way while the rows of the previous one are consumed.
+
+        Like get_data, empty trailing cells and rows are left out. The values are rendered according to
+        [value_render_option], e.g. FORMULA returns numbers as numbers and formulas instead of their results."""
+        # pylint: disable=R0914
+
+        title, rows, cols = self.__grid_size(sheet_name)
+        if chunk_rows is None:
+            chunk_rows = max(1, CELLS_PER_REQUEST // max(1, cols))
+        starts = list(range(0, rows, chunk_rows))
+        batches = [starts[i:i + windows] for i in range(0, len(starts), windows)]
+        last_column = column_letters(max(1, cols))
+
+        def fetch(batch : List[int]) -> List[List[Any]]:
+            ranges = [a1_range(title, "A%d:%s%d" % (start + 1, last_column, min(rows, start + chunk_rows)))
+                      for start in batch]
+            result = self.__api.values().batchGet(spreadsheetId=self.file_id, ranges=ranges,
+                                                  valueRenderOption=value_render_option).execute()
+            return [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+
+        # Index of the next row to yield, empty rows are only yielded once there are rows after them
+        emitted = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(fetch, batches[0]) if len(batches) > 0 else None
+            for i, batch in enumerate(batches):
+                assert pending is not None
+                values = pending.result()
+                pending = pool.submit(fetch, batches[i + 1]) if i + 1 < len(batches) else None
+                for start, window in zip(batch, values):
+                    for offset, row in enumerate(window):
+                        if len(row) == 0:
+                            continue
+                        for _ in range(start + offset - emitted):
+                            yield []
+                        yield row
+                        emitted = start + offset + 1
+
+    def export_csv(self, local_dir : str) -> List[Tuple[str, int]]:
+        """Writes every sheet into [local_dir] as <sheet name>.csv (see file_names), with one request for the
+        list of sheets and one values().batchGet for all of their values. Returns the paths and sizes of the files."""
+
+        spreadsheet = self.__api.get(self.file_id, fields="sheets.properties(title,sheetType)").execute()
+        # Charts that live in their own sheet have no values
+        titles = [sheet['properties']['title'] for sheet in spreadsheet.get('sheets', [])
+                  if sheet['properties'].get('sheetType', 'GRID') == 'GRID']
+        if len(titles) == 0:
+            return []
+        result = self.__api.values().batchGet(spreadsheetId=self.file_id,
+                                              ranges=[a1_range(title, None) for title in titles]).execute()
+
+        os.makedirs(local_dir, exist_ok=True)
+        written = []
+        for name, value_range in zip(file_names(titles, ".csv"), result.get('valueRanges', [])):
+            path = join(local_dir, name)
+            with open(path, "w", encoding="utf-8", newline="") as fh:
+                csv.writer(fh).writerows(value_range.get('values', []))
+            written.append((path, os.path.getsize(path)))
+        return written
+
+    def __grid_size(self, sheet_name) -> Tuple[str, int, int]:
+        """Returns the title, rows and columns of the given sheet (or the first one)."""
+
+        spreadsheet = self.__api.get(self.file_id, fields="sheets.properties").execute()
+        for sheet in spreadsheet['sheets']:
+            properties = sheet['properties']
+            # Charts that live in their own sheet don't have a grid
+            if 'gridProperties' in properties and sheet_name in (None, properties['title']):
+                grid = properties['gridProperties']
+                return properties['title'], grid.get('rowCount', 0), grid.get('columnCount', 0)
+        raise ValueError("There is no sheet %s in the spreadsheet" % (sheet_name))
+
+    def append_data(self, values, sheet_name=None) -> None:
+        """Writes the given values into new rows below the data of the given sheet."""
+
+        self.__api.values().append(
+            spreadsheetId=self.file_id,
+            range=a1_range(sheet_name, "A1"),
+            body={ "values": values },
+            valueInputOption="USER_ENTERED",
+            insertDataOption="INSERT_ROWS").execute()
+
+    def upload_csv(self, local, sheet_name, delimiter=',', cell="A1", block_rows : Optional[int] = None,
+                   workers : int = 4, size : Optional[Tuple[int, int]] = None,
+                   progress : Optional[Callable[[int, int], None]] = None) -> None:
+        """Writes all values of the csv file into the remote sheet, which is resized to fit them first.
+
+        The file is streamed in blocks of [block_rows] rows, of which up to [workers] are sent at once
+        with values().batchUpdate, so that files of any size are uploaded with flat memory. The size of the
+        data (rows, columns) is counted in a quick first pass unless it's given as [size]. [progress] is
+        called with the rows written so far and the total rows."""
+        # pylint: disable=R0913,R0914
+
+        rows, cols = size if size is not None else csv_size(local, delimiter)
+        row0, col0 = cell_position(cell)
+        spreadsheet = self.__api.get(self.file_id, fields="sheets.properties").execute()
 
         matching_sheets = [sheet for sheet in spreadsheet['sheets']
                     if sheet['properties']['title'] == sheet_name]
 
-        sheet : Optional[str] = None
-        if len(matching_sheets) > 0:
-            sheet = matching_sheets[0]
+        # Every sheet needs at least one row and column
+        grid_rows, grid_cols = max(1, row0 + rows), max(1, col0 + cols)
+        if len(matching_sheets) == 0:
+            self.add_sheet(sheet_name, grid_rows, grid_cols)
+        else:
+            self.resize_sheet(matching_sheets[0], grid_rows, grid_cols)
 
-        with open(local, "r") as fh:
+        if block_rows is None:
+            block_rows = max(1, CELLS_PER_REQUEST // max(1, cols))
+        written = 0
+        with open(local, "r", encoding="utf-8", newline="") as fh, ThreadPoolExecutor(max_workers=workers) as pool:
+            pending : Set[Future] = set()
             reader = csv.reader(fh, delimiter=delimiter)
-            lines = list(reader)
+            start = 0
+            while True:
+                block = list(itertools.islice(reader, block_rows))
+                if len(block) == 0:
+                    break
+                # Only [workers] blocks are read ahead of what the server has confirmed
+                while len(pending) >= workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    written += sum(future.result() for future in done)
+                    if progress is not None:
+                        progress(written, rows)
+                pending.add(pool.submit(self.__write_block, sheet_name, row0 + start, col0, block))
+                start += len(block)
+
+            for future in as_completed(pending):
+                written += future.result()
+                if progress is not None:
+                    progress(written, rows)
 
-            if sheet is None:
-                self.add_sheet(sheet_name)
+    def __write_block(self, sheet_name, row0 : int, col0 : int, block : List[List[str]]) -> int:
+        self.__batch_write([{
+            "range": a1_range(sheet_name, "%s%d" % (column_letters(col0 + 1), row0 + 1)),
+            "values": block
+        }])
+        return len(block)
+
+    def upload_csv_delta(self, local, sheet_name, delimiter=',', cache_dir : Optional[str] = None) -> int:
+        """Writes only the cells of the csv file that differ from the remote sheet, and resizes the sheet if
+        the data grew or shrank. Returns the number of cells that were written.
+
+        The current values are read from the sheet, or with a [cache_dir] from the snapshot that the last
+        delta upload of the sheet left there, which is only correct as long as nobody else edits it."""
+        # pylint: disable=R0914
+
+        rows, cols = csv_size(local, delimiter)
+        spreadsheet = self.__api.get(self.file_id, fields="sheets.properties").execute()
+        matching_sheets = [sheet for sheet in spreadsheet['sheets']
+                    if sheet['properties']['title'] == sheet_name]
+
+        snapshot = None
+        if cache_dir is not None:
+            snapshot = join(cache_dir, "sheets", self.file_id, "%s.csv" % (quote(sheet_name, safe="")))
+        with contextlib.ExitStack() as stack:
+            old : Iterable[List[str]] = []
+            rendered : Optional[Iterable[Tuple[List[Any], List[str]]]] = None
+            if len(matching_sheets) == 0:
+                self.add_sheet(sheet_name, max(1, rows), max(1, cols))
+            elif snapshot is not None and os.path.exists(snapshot):
+                old = csv.reader(stack.enter_context(open(snapshot, "r", encoding="utf-8", newline="")))
             else:
-                rows = len(lines)
-                cols = max([len(line) for line in lines])
-                self.resize_sheet(sheet, rows, cols)
-            self.write_data(lines, sheet_name=sheet_name, cell=cell)
+                # Compared with what the cells hold as well as what they show, see _match_rendered
+                rendered = itertools.zip_longest(self.iter_rows(sheet_name, value_render_option="FORMULA"),
+                                                 self.iter_rows(sheet_name), fillvalue=[])
+            if len(matching_sheets) > 0:
+                # Rows and columns that are deleted don't need to be read or cleared
+                self.resize_sheet(matching_sheets[0], max(1, rows), max(1, cols))
 
-    def add_sheet(self, sheet_name) -> None:
-        """Add a sheet with the given name to the file"""
+            fh = stack.enter_context(open(local, "r", encoding="utf-8", newline=""))
+            new : Iterable[List[str]] = csv.reader(fh, delimiter=delimiter)
+            if snapshot is not None:
+                os.makedirs(dirname(snapshot), exist_ok=True)
+                copy = stack.enter_context(open(snapshot + ".tmp", "w", encoding="utf-8", newline=""))
+                new = _copy_rows(new, csv.writer(copy))
+            if rendered is not None:
+                old, new = _match_rendered(rendered, new)
+
+            written, pending = 0, 0
+            data : List[Any] = []
+            # The whole grid is compared, since the sheet keeps at least one cell that an empty csv has to clear
+            for changed in changed_ranges(old, new, max(1, rows), max(1, cols), CELLS_PER_REQUEST):
+                cells = len(changed.values) * len(changed.values[0])
+                # Usually all changes fit into one request
+                if pending + cells > CELLS_PER_REQUEST:
+                    self.__batch_write(data)
+                    data, pending = [], 0
+                written += cells
+                pending += cells
+                data.append({
+                    "range": a1_range(sheet_name, "%s%d" % (column_letters(changed.col + 1), changed.row + 1)),
+                    "values": changed.values
+                })
+            self.__batch_write(data)
+
+        if snapshot is not None:
+            # Only once everything was written, otherwise the next upload has to read the sheet again
+            os.replace(snapshot + ".tmp", snapshot)
+        return written
+
+    def __batch_write(self, data : List[Any]) -> None:
+        if len(data) > 0:
+            body = { "valueInputOption": "USER_ENTERED", "data": data }
+            self.__api.values().batchUpdate(spreadsheetId=self.file_id, body=body).execute()
+
+    def add_sheet(self, sheet_name, rows=1, cols=1) -> None:
+        """Add a sheet with the given name and size to the file"""
 
         requests = [
             { "addSheet": {
                     "properties": {
                         "title": sheet_name,
                         "gridProperties": {
-                            "rowCount": 1,
-                            "columnCount": 1
+                            "rowCount": rows,
+                            "columnCount": cols
                         }
                     }
                 }
@@ -120,9 +414,7 @@ class Spreadsheet:
     def write_data(self, values, sheet_name=None, cell="A1") -> None:
         """Writes the given values into the cells within the given sheet."""
 
-        if sheet_name is not None:
-            cell = "%s!%s" % (sheet_name, cell)
-
+        cell = a1_range(sheet_name, cell)
         body = { "values": values }
 
         self.__api.values().update(
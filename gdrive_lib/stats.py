@@ -0,0 +1,314 @@
+"""Records what every API request cost, so that we can tell where the time of a run goes.
+
+Every attempt of a request (including retries, batches, media chunks and token refreshes) is recorded
+as a RequestEvent with the operation it belongs to, e.g. 'drive.files.list'. The recorder aggregates the
+events per operation and hands them to its sinks: callbacks for every event, or summaries that are
+written when the recorder is flushed (as text, JSON or in the Prometheus text format)."""
+
+import os
+import re
+import json
+import time
+import bisect
+import threading
+import urllib.parse
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, TextIO
+from .drive.transfer import format_size
+
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket catches everything else
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+AUTH_HOSTS = ("oauth2.googleapis.com", "accounts.google.com", "www.googleapis.com/oauth2")
+
+class RequestEvent(NamedTuple):
+    operation : str
+    method : str
+    status : int
+    seconds : float
+    sent : int
+    received : int
+    # Whether this attempt repeated an earlier one that failed
+    retry : bool
+
+class Histogram:
+    """Counts observations in the LATENCY_BUCKETS."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value : float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q : float) -> float:
+        """Estimates the [q] quantile, by interpolating within its bucket."""
+
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count > 0 and seen + count >= rank:
+                lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else lower * 2
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return LATENCY_BUCKETS[-1]
+
+class OperationStats:
+    """What all requests of one operation cost."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = Histogram()
+
+    def add(self, event : RequestEvent) -> None:
+        self.calls += 1
+        if event.status >= 400 or event.status == 0:
+            self.errors += 1
+        if event.retry:
+            self.retries += 1
+        self.bytes_sent += event.sent
+        self.bytes_received += event.received
+        self.latency.observe(event.seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "seconds": self.latency.sum,
+            "p50": self.latency.quantile(0.5),
+            "p90": self.latency.quantile(0.9),
+            "p99": self.latency.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.latency.counts))
+        }
+
+class Sink:
+    """Receives the events of a recorder. Summaries are only written when the recorder is flushed."""
+
+    def request(self, event : RequestEvent) -> None:
+        pass
+
+    def flush(self, operations : Dict[str, OperationStats]) -> None:
+        pass
+
+class CallbackSink(Sink):
+    """Calls [callback] with every RequestEvent, on the thread that sent the request."""
+
+    def __init__(self, callback : Callable[[RequestEvent], None]) -> None:
+        self.callback = callback
+
+    def request(self, event : RequestEvent) -> None:
+        self.callback(event)
+
+class TextSink(Sink):
+    """Prints a table with a line per operation, like 'gdrive --stats' does."""
+
+    def __init__(self, stream : Optional[TextIO] = None) -> None:
+        self.stream = stream
+
+    def flush(self, operations : Dict[str, OperationStats]) -> None:
+        print(format_summary(operations), file=self.stream)
+
+class JsonSink(Sink):
+    """Writes the totals of each operation to a JSON file."""
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+
+    def flush(self, operations : Dict[str, OperationStats]) -> None:
+        data = {operation : stats.to_dict() for operation, stats in sorted(operations.items())}
+        _write_atomically(self.path, json.dumps(data, indent=2))
+
+class PrometheusSink(Sink):
+    """Writes the totals in the Prometheus text format, e.g. for the textfile collector of the node exporter."""
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+
+    def flush(self, operations : Dict[str, OperationStats]) -> None:
+        lines = []
+        for name, kind, help_text in [
+                ("gdrive_requests_total", "counter", "Requests sent, including retries"),
+                ("gdrive_request_errors_total", "counter", "Requests that failed"),
+                ("gdrive_request_retries_total", "counter", "Requests that repeated a failed one"),
+                ("gdrive_sent_bytes_total", "counter", "Bytes sent in request bodies"),
+                ("gdrive_received_bytes_total", "counter", "Bytes received in response bodies"),
+                ("gdrive_request_duration_seconds", "histogram", "Time until the response was received")]:
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for operation, stats in sorted(operations.items()):
+                labels = 'operation="%s"' % (operation)
+                if kind == "histogram":
+                    lines.extend(_histogram_lines(name, labels, stats.latency))
+                    continue
+                value = {"gdrive_requests_total": stats.calls,
+                         "gdrive_request_errors_total": stats.errors,
+                         "gdrive_request_retries_total": stats.retries,
+                         "gdrive_sent_bytes_total": stats.bytes_sent,
+                         "gdrive_received_bytes_total": stats.bytes_received}[name]
+                lines.append("%s{%s} %d" % (name, labels, value))
+        _write_atomically(self.path, "\n".join(lines) + "\n")
+
+def _histogram_lines(name : str, labels : str, histogram : Histogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip([repr(b) for b in LATENCY_BUCKETS] + ["+Inf"], histogram.counts):
+        cumulative += count
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+    lines.append("%s_sum{%s} %f" % (name, labels, histogram.sum))
+    lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+    return lines
+
+def _write_atomically(path : str, text : str) -> None:
+    # Collectors may read the file at any time
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(path + ".tmp", path)
+
+class Recorder:
+    """Aggregates the events of all threads per operation and passes them on to the sinks."""
+
+    __operations : Dict[str, OperationStats]
+    __sinks : List[Sink]
+
+    def __init__(self) -> None:
+        self.__operations = {}
+        self.__sinks = []
+        self.__lock = threading.Lock()
+
+    def add_sink(self, sink : Sink) -> Sink:
+        with self.__lock:
+            self.__sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink : Sink) -> None:
+        with self.__lock:
+            self.__sinks.remove(sink)
+
+    def record(self, event : RequestEvent) -> None:
+        with self.__lock:
+            stats = self.__operations.get(event.operation)
+            if stats is None:
+                stats = self.__operations[event.operation] = OperationStats()
+            stats.add(event)
+            sinks = list(self.__sinks)
+        for sink in sinks:
+            sink.request(event)
+
+    def operations(self) -> Dict[str, OperationStats]:
+        with self.__lock:
+            return dict(self.__operations)
+
+    def flush(self) -> None:
+        """Lets every sink write its summary of what was recorded so far."""
+
+        operations = self.operations()
+        with self.__lock:
+            sinks = list(self.__sinks)
+        for sink in sinks:
+            sink.flush(operations)
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__operations = {}
+
+_recorder = Recorder()
+
+def get_recorder() -> Recorder:
+    """Returns the recorder that all clients of this process report to."""
+    return _recorder
+
+def operation_name(uri : str, method : str) -> str:
+    """Returns the API operation a request belongs to, e.g. 'drive.files.list' or 'sheets.values.get'."""
+    # pylint: disable=R0911,R0912
+
+    parsed = urllib.parse.urlparse(uri)
+    path = parsed.path
+    if any((parsed.netloc + path).startswith(host) for host in AUTH_HOSTS):
+        return "auth.token"
+    if path.startswith("/batch/"):
+        return "batch"
+    if parsed.netloc.startswith("sheets."):
+        match = re.match(r"^/v4/spreadsheets/[^/:]+(/values)?(?:/[^:]*)?(?::(\w+))?$", path)
+        if match is None:
+            return "sheets"
+        name = "sheets.values" if match.group(1) else "sheets"
+        if match.group(2) is not None:
+            return "%s.%s" % (name, match.group(2))
+        if match.group(1):
+            return name + (".get" if method == "GET" else ".update")
+        return name + ".get"
+    if path.startswith("/upload/drive/v3/files"):
+        return "drive.upload.chunk" if "upload_id=" in parsed.query else "drive.upload"
+    match = re.match(r"^/drive/v3/(files|changes)(?:/([^/]+))?(/.*)?$", path)
+    if match is None:
+        return "other"
+    resource, target = match.group(1), match.group(2)
+    if target is None:
+        return "drive.%s.%s" % (resource, "list" if method == "GET" else "create")
+    if target in ("generateIds", "startPageToken"):
+        return "drive.%s.%s" % (resource, target)
+    if method == "GET":
+        return "drive.files.get_media" if "alt=media" in parsed.query else "drive.%s.get" % (resource)
+    return "drive.%s.%s" % (resource, {"PATCH": "update", "DELETE": "delete"}.get(method, method.lower()))
+
+def record_request(uri : str, method : str, body, resp, content, started : float, retry : bool) -> None:
+    """Records an attempt of a request that was sent at [started] (from time.perf_counter)."""
+    # pylint: disable=R0913
+
+    seconds = time.perf_counter() - started
+    sent = len(body) if isinstance(body, (bytes, str)) else 0
+    received = len(content) if isinstance(content, (bytes, str)) else 0
+    status = resp.status if resp is not None else 0
+    _recorder.record(RequestEvent(operation_name(uri, method), method, status, seconds, sent, received, retry))
+
+def record_auth(started : float) -> None:
+    """Records the time it took to load (or interactively obtain) the credentials."""
+    _recorder.record(RequestEvent("auth.credentials", "", 200, time.perf_counter() - started, 0, 0, False))
+
+class AuthTimingHttp:
+    """Wraps the transport that oauth2client authorizes, and records the token refreshes it sends.
+
+    All other requests pass through it as well, but they are recorded by the scheduler."""
+
+    def __init__(self, http) -> None:
+        self.http = http
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        # pylint: disable=W1113
+        if operation_name(uri, method) != "auth.token":
+            return self.http.request(uri, method, body, headers, *args, **kwargs)
+        started = time.perf_counter()
+        resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+        record_request(uri, method, body, resp, content, started, False)
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+def format_summary(operations : Dict[str, OperationStats]) -> str:
+    """Returns a table with the calls, latencies and bytes of each operation."""
+
+    lines = ["%-26s %6s %6s %7s %8s %8s %8s %9s %10s %10s %12s" % (
+        "operation", "calls", "errors", "retries", "p50", "p90", "p99", "time", "sent", "received", "throughput")]
+    for operation, stats in sorted(operations.items(), key=lambda item: -item[1].latency.sum):
+        latency = stats.latency
+        moved = stats.bytes_sent + stats.bytes_received
+        # Summed over concurrent requests, so this is the throughput of a single request
+        throughput = "%s/s" % (format_size(moved / latency.sum)) if moved > 0 and latency.sum > 0 else "-"
+        lines.append("%-26s %6d %6d %7d %6.0fms %6.0fms %6.0fms %8.2fs %10s %10s %12s" % (
+            operation, stats.calls, stats.errors, stats.retries, 1000 * latency.quantile(0.5),
+            1000 * latency.quantile(0.9), 1000 * latency.quantile(0.99), latency.sum,
+            format_size(stats.bytes_sent), format_size(stats.bytes_received), throughput))
+    return "\n".join(lines)
@@ -24,6 +24,10 @@ setup(
         "mypy",
         "pylint"
     ],
+    extras_require={
+        # Lets AsyncDrive and AsyncSheets send their requests without threads
+        "async": ["aiohttp"]
+    },
     entry_points={
         "console_scripts": [
             "realpython=reader.__main__:main",
@@ -0,0 +1,26 @@
+"""Base class of the tests that talk to the emulator instead of Google."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from gdrive_lib.api_utils import use_backend
+from gdrive_lib.emulator.transport import Emulator
+from gdrive_lib.scheduler import reset_schedulers
+
+class EmulatorTestCase(unittest.TestCase):
+    """Plugs in a new emulator for every test, and keeps the user's cache directory in a temporary one."""
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        self.env = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmp.name})
+        self.env.start()
+        self.emulator = Emulator()
+        use_backend(self.emulator)
+        # Every test starts with a full quota
+        reset_schedulers()
+
+    def tearDown(self) -> None:
+        use_backend(None)
+        self.env.stop()
+        self.tmp.cleanup()
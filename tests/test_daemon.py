@@ -0,0 +1,62 @@
+"""Tests that a session outlives the commands that fail in it."""
+
+import os
+import io
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+from gdrive_lib.api_utils import use_backend
+from gdrive_lib.commander import run
+from gdrive_lib.daemon import Session, command_name
+from gdrive_lib.drive.filesystem import Filesystem
+from gdrive_lib.emulator.transport import Emulator
+
+class SessionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        # Sessions keep their cache in the user's cache directory
+        self.env = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmp.name})
+        self.env.start()
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.env.stop()
+        self.tmp.cleanup()
+        use_backend(None)
+
+    def test_survives_failing_command(self) -> None:
+        def run_command(argv, _session) -> None:
+            if argv[0] == "fail":
+                Filesystem().by_path("/missing")
+
+        session = Session(run_command)
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(session.run(["fail"], self.tmp.name), 1)
+        self.assertEqual(session.run(["ok"], self.tmp.name), 0)
+
+    def test_survives_failing_commander_command(self) -> None:
+        emulator = Emulator()
+        emulator.sheets.create("Book", sheets={"Data": [["a", "b"], ["1", "2"]]})
+        use_backend(emulator)
+
+        session = Session(run)
+        out = os.path.join(self.tmp.name, "data.csv")
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            self.assertEqual(session.run(["csv-download", "/Book", "Missing", out], self.tmp.name), 1)
+        self.assertIn("There is no sheet Missing", err.getvalue())
+        self.assertEqual(session.run(["csv-download", "/Book", "Data", out], self.tmp.name), 0)
+        with open(out) as fh:
+            self.assertEqual(fh.read().splitlines(), ["a,b", "1,2"])
+
+class CommandNameTest(unittest.TestCase):
+    def test_skips_global_options(self) -> None:
+        self.assertEqual(command_name(["shell"]), "shell")
+        self.assertEqual(command_name(["--stats", "shell"]), "shell")
+        self.assertEqual(command_name(["--stats-json", "out.json", "ls", "/"]), "ls")
+        self.assertEqual(command_name(["--stats-prometheus=out.prom", "daemon"]), "daemon")
+        self.assertIsNone(command_name(["--stats"]))
+
+if __name__ == "__main__":
+    unittest.main()
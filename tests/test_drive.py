@@ -0,0 +1,222 @@
+"""Tests the Drive client against the emulator: paths, listings, transfers and batch operations."""
+
+import os
+import io
+import unittest
+import contextlib
+from gdrive_lib.drive.drive import Drive
+from gdrive_lib.drive.drive_api import DRIVE_FULL
+from emulated import EmulatorTestCase
+
+def read(path : str) -> bytes:
+    with open(path, "rb") as fh:
+        return fh.read()
+
+class DriveTestCase(EmulatorTestCase):
+    """Serves a small tree from the emulator:
+
+        /top.txt
+        /docs/a.txt
+        /docs/b.txt
+        /docs/sub/c.txt
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        backend = self.emulator.drive
+        backend.add("top.txt", "root", content=b"top")
+        self.docs = backend.mkdir("docs")["id"]
+        backend.add("a.txt", self.docs, content=b"a")
+        backend.add("b.txt", self.docs, content=b"b")
+        self.sub = backend.mkdir("sub", self.docs)["id"]
+        backend.add("c.txt", self.sub, content=b"c")
+
+    def local_file(self, name : str, content : bytes) -> str:
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as fh:
+            fh.write(content)
+        return path
+
+    def content(self, drive : Drive, path : str) -> bytes:
+        f = drive.resolve(path)
+        assert f is not None
+        return self.emulator.drive.contents[f.id]
+
+class PathTest(DriveTestCase):
+    def test_ls_normalises_paths(self) -> None:
+        expected = ["/docs/a.txt", "/docs/b.txt", "/docs/sub"]
+        for path in ["/docs", "docs", "/docs/", "docs/sub/..", "//docs"]:
+            self.assertEqual(sorted(f.path for f in Drive(DRIVE_FULL).ls(path)), expected, path)
+
+    def test_ls_of_cached_folder_keeps_paths(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        drive.ls("/docs")
+        self.emulator.requests.clear()
+        self.assertEqual(sorted(f.path for f in drive.ls("docs/")), ["/docs/a.txt", "/docs/b.txt", "/docs/sub"])
+        self.assertNotIn("drive.files.list", self.emulator.requests)
+
+    def test_iter_ls_follows_pages(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        drive.resolve("/docs")
+        self.emulator.requests.clear()
+        files = drive.iter_ls("docs", page_size=1)
+        self.assertEqual(next(files).name, "a.txt")
+        self.assertEqual(self.emulator.requests, {"drive.files.list": 1})
+        self.assertEqual([f.name for f in files], ["b.txt", "sub"])
+        self.assertEqual(self.emulator.requests, {"drive.files.list": 3})
+
+    def test_resolve(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        c = drive.resolve("docs/sub/c.txt")
+        assert c is not None
+        self.assertEqual(c.path, "/docs/sub/c.txt")
+        self.assertIsNone(drive.resolve("/docs/missing.txt"))
+        self.assertIsNone(drive.resolve("/missing/c.txt"))
+
+    def test_mkdir_upload_update_with_relative_paths(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        folder = drive.mkdir("new/")
+        assert folder is not None
+        self.assertEqual(folder.path, "/new")
+
+        uploaded = drive.upload(self.local_file("x.txt", b"first"), "new/x.txt")
+        assert uploaded is not None
+        self.assertEqual(uploaded.path, "/new/x.txt")
+        self.assertEqual(self.content(drive, "/new/x.txt"), b"first")
+
+        updated = drive.update(self.local_file("y.txt", b"second"), "new//x.txt")
+        assert updated is not None
+        self.assertEqual((updated.id, updated.path), (uploaded.id, "/new/x.txt"))
+        self.assertEqual(self.content(Drive(DRIVE_FULL), "/new/x.txt"), b"second")
+
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertIsNone(drive.upload(self.local_file("x.txt", b"again"), "/new/x.txt"))
+            self.assertIsNone(drive.mkdir("/new"))
+        self.assertIn("exists already", out.getvalue())
+
+    def test_makedirs(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        folder = drive.makedirs("docs/one/two")
+        assert folder is not None
+        self.assertEqual(folder.path, "/docs/one/two")
+        self.assertEqual([f.path for f in Drive(DRIVE_FULL).ls("/docs/one")], ["/docs/one/two"])
+
+class ListingTest(DriveTestCase):
+    def test_ls_all(self) -> None:
+        expected = ["/docs", "/docs/a.txt", "/docs/b.txt", "/docs/sub", "/docs/sub/c.txt", "/top.txt"]
+        for flat, workers in [(False, 1), (False, 4), (True, 1)]:
+            drive = Drive(DRIVE_FULL)
+            drive.ls_all("/", flat=flat, max_workers=workers)
+            self.assertEqual(sorted(f.path for f in drive.fs.files_below("/")), expected, (flat, workers))
+
+    def test_ls_all_below_relative_path(self) -> None:
+        for workers in [1, 4]:
+            drive = Drive(DRIVE_FULL)
+            drive.ls_all("docs/", max_workers=workers)
+            self.assertEqual(sorted(f.path for f in drive.fs.files_below("/docs")),
+                             ["/docs/a.txt", "/docs/b.txt", "/docs/sub", "/docs/sub/c.txt"])
+
+    def test_ls_all_marks_folders_listed(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        drive.ls_all("/", max_workers=4)
+        self.emulator.requests.clear()
+        self.assertEqual([f.path for f in drive.ls("/docs/sub")], ["/docs/sub/c.txt"])
+        self.assertIsNone(drive.resolve("/docs/sub/missing.txt"))
+        self.assertEqual(self.emulator.requests, {})
+
+    def test_glob(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        self.assertEqual([f.path for f in drive.glob("/docs/*.txt")], ["/docs/a.txt", "/docs/b.txt"])
+        self.assertEqual([f.path for f in drive.glob("/*/s?b/*")], ["/docs/sub/c.txt"])
+        self.assertEqual([f.path for f in drive.glob("/docs/sub")], ["/docs/sub"])
+
+class TransferTest(DriveTestCase):
+    def test_download_tree(self) -> None:
+        self.emulator.drive.add("a.txt", self.docs, content=b"newer a")
+        for workers in [1, 4]:
+            local = os.path.join(self.tmp.name, "out%d" % (workers))
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = Drive(DRIVE_FULL).download_tree("docs/", local, workers=workers)
+            assert stats is not None
+            self.assertEqual((stats.files, stats.failed), (4, 0))
+            self.assertEqual(sorted(os.listdir(local)), ["a (1).txt", "a.txt", "b.txt", "sub"])
+            # The older one of two files with the same name keeps it
+            self.assertEqual(read(os.path.join(local, "a.txt")), b"a")
+            self.assertEqual(read(os.path.join(local, "a (1).txt")), b"newer a")
+            self.assertEqual(read(os.path.join(local, "sub", "c.txt")), b"c")
+
+    def test_download_tree_of_missing_folder(self) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(Drive(DRIVE_FULL).download_tree("/missing", os.path.join(self.tmp.name, "out")))
+
+    def test_upload_tree(self) -> None:
+        local = os.path.join(self.tmp.name, "tree")
+        os.makedirs(os.path.join(local, "one", "two"))
+        for rel in ["x.txt", os.path.join("one", "y.txt"), os.path.join("one", "two", "z.txt")]:
+            with open(os.path.join(local, rel), "w", encoding="utf-8") as fh:
+                fh.write(rel)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = Drive(DRIVE_FULL).upload_tree(local, "docs/up", workers=4)
+        assert stats is not None
+        self.assertEqual((stats.files, stats.failed), (3, 0))
+
+        drive = Drive(DRIVE_FULL)
+        drive.ls_all("/docs/up")
+        self.assertEqual(sorted(f.path for f in drive.fs.files_below("/docs/up")),
+                         ["/docs/up/one", "/docs/up/one/two", "/docs/up/one/two/z.txt", "/docs/up/one/y.txt", "/docs/up/x.txt"])
+        self.assertEqual(self.content(drive, "/docs/up/one/two/z.txt"), os.path.join("one", "two", "z.txt").encode())
+
+    def test_upload_files(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = drive.upload_files([
+                (self.local_file("n.txt", b"new"), "new/deep/n.txt"),
+                (self.local_file("a.txt", b"changed"), "docs/a.txt"),
+                (self.local_file("s.txt", b"folder"), "/docs/sub")
+            ], workers=2)
+
+        self.assertEqual([(remote, error) for remote, _f, error in results],
+                         [("/new/deep/n.txt", None), ("/docs/a.txt", None), ("/docs/sub", None)])
+        self.assertEqual([f.path if f is not None else None for _remote, f, _error in results],
+                         ["/new/deep/n.txt", "/docs/a.txt", None])
+        fresh = Drive(DRIVE_FULL)
+        self.assertEqual(self.content(fresh, "/new/deep/n.txt"), b"new")
+        self.assertEqual(self.content(fresh, "/docs/a.txt"), b"changed")
+
+class BatchTest(DriveTestCase):
+    def test_rm_many(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            trashed = drive.rm_many(["/docs/a.txt", "docs/sub", "/missing"])
+        self.assertIn("/missing", out.getvalue())
+        self.assertEqual([f.path for f in trashed], ["/docs/a.txt", "/docs/sub"])
+        self.assertTrue(self.emulator.drive.files[self.sub]["trashed"])
+        self.assertFalse(drive.fs.file_exists_at_path("/docs/sub/c.txt"))
+        self.assertEqual([f.path for f in Drive(DRIVE_FULL).ls("/docs")], ["/docs/b.txt"])
+
+    def test_rm_files_sends_batches(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        files = drive.glob("/docs/*")
+        self.emulator.requests.clear()
+        self.assertEqual(len(drive.rm_files(files + files[:1])), 3)
+        self.assertEqual(self.emulator.requests, {"batch": 1, "drive.files.update": 3})
+
+    def test_mv_many(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        moved = drive.mv_many(["/docs/a.txt", "top.txt"], "docs/sub/")
+        self.assertEqual([f.path for f in moved], ["/docs/sub/a.txt", "/docs/sub/top.txt"])
+        self.assertEqual(sorted(f.path for f in Drive(DRIVE_FULL).ls("/docs/sub")),
+                         ["/docs/sub/a.txt", "/docs/sub/c.txt", "/docs/sub/top.txt"])
+
+    def test_mv_folder_repaths_children(self) -> None:
+        drive = Drive(DRIVE_FULL)
+        drive.ls_all("/")
+        moved = drive.mv("/docs/sub", "/")
+        assert moved is not None
+        self.assertEqual(moved.path, "/sub")
+        self.assertTrue(drive.fs.file_exists_at_path("/sub/c.txt"))
+        self.assertFalse(drive.fs.file_exists_at_path("/docs/sub/c.txt"))
+
+if __name__ == "__main__":
+    unittest.main()
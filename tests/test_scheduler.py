@@ -0,0 +1,139 @@
+"""Tests which failed requests the scheduler sends again, and that async requests share its limits."""
+
+import json
+import asyncio
+import unittest
+import threading
+from typing import Any, List, Tuple
+from unittest import mock
+from httplib2 import Response # type: ignore
+from gdrive_lib.aio import AsyncTransport
+from gdrive_lib.api_utils import use_backend
+from gdrive_lib.drive.drive_api import DRIVE_FULL
+from gdrive_lib.emulator.transport import Emulator
+from gdrive_lib.scheduler import AdaptiveConcurrency, Scheduler, get_scheduler, is_idempotent, is_throttled, reset_schedulers
+
+class FakeServer:
+    """Answers with the given statuses in turn, where "error" fails to connect."""
+
+    def __init__(self, *statuses : Any) -> None:
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def send(self, _uri, _method, _body, _headers) -> Tuple[Any, bytes]:
+        status = self.statuses[min(self.calls, len(self.statuses) - 1)]
+        self.calls += 1
+        if status == "error":
+            raise ConnectionError("Connection reset")
+        return Response({"status": str(status)}), b"{}"
+
+class RetryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.backoff = mock.patch("gdrive_lib.scheduler.BASE_BACKOFF", 0.001)
+        self.backoff.start()
+        self.scheduler = Scheduler(1000.0, 1000)
+
+    def tearDown(self) -> None:
+        self.backoff.stop()
+
+    def request(self, server : FakeServer, method : str, body : Any = None) -> int:
+        resp, _content = self.scheduler.request(server.send, "https://example.com/files", method, body, {})
+        return resp.status
+
+    def test_idempotent_requests_are_retried(self) -> None:
+        for status in [503, 429, "error"]:
+            server = FakeServer(status, 200)
+            self.assertEqual(self.request(server, "GET"), 200)
+            self.assertEqual(server.calls, 2)
+
+    def test_other_requests_are_only_retried_when_throttled(self) -> None:
+        server = FakeServer(503, 200)
+        self.assertEqual(self.request(server, "POST", '{"name": "new"}'), 503)
+        self.assertEqual(server.calls, 1)
+
+        server = FakeServer("error", 200)
+        with self.assertRaises(ConnectionError):
+            self.request(server, "POST", '{"name": "new"}')
+        self.assertEqual(server.calls, 1)
+
+        server = FakeServer(429, 200)
+        self.assertEqual(self.request(server, "POST", '{"name": "new"}'), 200)
+        self.assertEqual(server.calls, 2)
+
+    def test_creates_with_generated_ids_are_retried(self) -> None:
+        server = FakeServer(503, 200)
+        self.assertEqual(self.request(server, "POST", '{"id": "generated", "name": "new"}'), 200)
+        self.assertEqual(server.calls, 2)
+
+    def test_gives_up_after_max_retries(self) -> None:
+        server = FakeServer(503)
+        self.assertEqual(self.request(server, "GET"), 503)
+        self.assertEqual(server.calls, self.scheduler.max_retries + 1)
+
+    def test_is_idempotent(self) -> None:
+        multipart = b'--B\nContent-Type: application/json\n\n{"id": "generated"}\n--B\nContent-Type: text/plain\n\nhi\n--B--'
+        headers = {"Content-Type": 'multipart/related; boundary="B"'}
+        self.assertTrue(is_idempotent("https://example.com/upload/files", "POST", multipart, headers))
+        self.assertFalse(is_idempotent("https://example.com/upload/files", "POST", multipart.replace(b'"id"', b'"name"'), headers))
+        self.assertTrue(is_idempotent("https://example.com/upload/files?uploadType=resumable", "POST", "{}", {}))
+        self.assertTrue(is_idempotent("https://example.com/files/1", "patch", "{}", {}))
+        self.assertFalse(is_idempotent("https://example.com/values:append", "POST", '{"values": [["id"]]}', {}))
+
+    def test_is_throttled(self) -> None:
+        rate_limited = json.dumps({"error": {"errors": [{"reason": "userRateLimitExceeded"}]}})
+        forbidden = json.dumps({"error": {"errors": [{"reason": "insufficientPermissions"}]}})
+        self.assertTrue(is_throttled(Response({"status": "429"}), b""))
+        self.assertTrue(is_throttled(Response({"status": "403"}), rate_limited))
+        self.assertFalse(is_throttled(Response({"status": "403"}), forbidden))
+
+class ConcurrencyTest(unittest.TestCase):
+    def test_limit_adapts(self) -> None:
+        limit = AdaptiveConcurrency(initial=4)
+        limit.acquire()
+        limit.release(throttled=True)
+        self.assertEqual(limit.limit, 2.0)
+        # Grows by one per [limit] successful requests
+        for _ in range(2):
+            limit.acquire()
+            limit.release(throttled=False)
+        self.assertAlmostEqual(limit.limit, 2.9)
+
+    def test_async_requests_share_the_limit(self) -> None:
+        emulator = Emulator(latency=0.02)
+        use_backend(emulator)
+        reset_schedulers()
+        self.addCleanup(use_backend, None)
+        scheduler = get_scheduler("drive", "token.json")
+        scheduler.concurrency = AdaptiveConcurrency(initial=2, maximum=2)
+
+        lock = threading.Lock()
+        active = [0]
+        # How many requests were in flight when each one was sent
+        in_flight : List[int] = []
+        real_request = emulator.http().request
+
+        def request(*args, **kwargs):
+            with lock:
+                active[0] += 1
+                in_flight.append(active[0])
+            try:
+                return real_request(*args, **kwargs)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        async def send_all() -> None:
+            transport = AsyncTransport("drive", DRIVE_FULL, "credentials.json", "token.json", pool_size=8)
+            try:
+                await asyncio.gather(*[transport.request("https://www.googleapis.com/drive/v3/files/root?fields=id")
+                                       for _ in range(8)])
+            finally:
+                await transport.close()
+
+        with mock.patch("gdrive_lib.emulator.transport.EmulatorHttp.request", side_effect=request):
+            asyncio.run(send_all())
+        self.assertEqual(len(in_flight), 8)
+        self.assertEqual(max(in_flight), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+"""Tests reading, uploading, appending and exporting sheets against the emulator."""
+
+import os
+import io
+import csv
+import time
+import threading
+import unittest
+import contextlib
+from typing import Any, List, Optional, Tuple
+from googleapiclient.errors import HttpError # type: ignore
+from gdrive_lib.drive.drive import Drive
+from gdrive_lib.drive.drive_api import DRIVE_READONLY
+from gdrive_lib.drive.transfer import TransferStats
+from gdrive_lib.sheets.appender import SheetAppender
+from gdrive_lib.sheets.export import export_spreadsheets
+from gdrive_lib.sheets.sheets import Sheets
+from gdrive_lib.sheets.sheets_api import SHEET_FULL
+from gdrive_lib.sheets.spreadsheet import Spreadsheet, file_names
+from emulated import EmulatorTestCase
+
+class SheetsTestCase(EmulatorTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.sheets = Sheets(SHEET_FULL, "credentials.json", "token.json")
+
+    def spreadsheet(self, **sheets : List[List[Any]]) -> Spreadsheet:
+        return self.sheets.get_spreadsheet(self.emulator.sheets.create("Book", sheets=sheets or None))
+
+    def write_csv(self, rows : List[List[str]]) -> str:
+        path = os.path.join(self.tmp.name, "data.csv")
+        with open(path, "w", encoding="utf-8", newline="") as fh:
+            csv.writer(fh).writerows(rows)
+        return path
+
+class ReadTest(SheetsTestCase):
+    def test_iter_rows_in_windows(self) -> None:
+        wide = [str(c) for c in range(30)]
+        rows = [["a"], wide, [], ["", "b"], ["c"], ["d"], ["e"]]
+        spreadsheet = self.spreadsheet()
+        spreadsheet.add_sheet("Data", len(rows), len(wide))
+        spreadsheet.write_data(rows, "Data")
+        self.emulator.requests.clear()
+        self.assertEqual(list(spreadsheet.iter_rows("Data", chunk_rows=2, windows=2)), rows)
+        self.assertEqual(self.emulator.requests["sheets.values.batchGet"], 2)
+
+    def test_iter_rows_renders_values(self) -> None:
+        spreadsheet = self.spreadsheet(Data=[["1.50", "x", "TRUE"]])
+        self.assertEqual(list(spreadsheet.iter_rows("Data")), [["1.50", "x", "TRUE"]])
+        self.assertEqual(list(spreadsheet.iter_rows("Data", value_render_option="FORMULA")), [[1.5, "x", True]])
+
+    def test_iter_rows_of_missing_sheet(self) -> None:
+        with self.assertRaises(ValueError):
+            list(self.spreadsheet().iter_rows("Missing"))
+
+    def test_file_names(self) -> None:
+        self.assertEqual(file_names(["a/b", "A/B", "CON", "x. ", "Sheet1"], ".csv"),
+                         ["a_b.csv", "A_B (1).csv", "_CON.csv", "x.csv", "Sheet1.csv"])
+
+class UploadTest(SheetsTestCase):
+    def test_upload_csv_in_blocks(self) -> None:
+        rows = [["name", "city"], ["Ann", "Zürich"], ["Bob", "a, b"], ["Cy", "\"quoted\""], ["Di", "x"]]
+        spreadsheet = self.spreadsheet()
+        progress : List[int] = []
+        spreadsheet.upload_csv(self.write_csv(rows), "Data", block_rows=2, workers=2,
+                               progress=lambda written, _total: progress.append(written))
+        self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"), rows)
+        self.assertEqual(self.emulator.requests["sheets.values.batchUpdate"], 3)
+        self.assertEqual(progress[-1], len(rows))
+
+    def test_upload_csv_shrinks_sheet(self) -> None:
+        spreadsheet = self.spreadsheet(Data=[["old"] * 3] * 4)
+        spreadsheet.upload_csv(self.write_csv([["new"]]), "Data")
+        self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"), [["new"]])
+
+    def test_delta_only_writes_changes(self) -> None:
+        spreadsheet = self.spreadsheet()
+        rows = [["a", "1.50"], ["b", "2"], ["c", "3"]]
+        self.assertEqual(spreadsheet.upload_csv_delta(self.write_csv(rows), "Data"), 6)
+        # The sheet holds 1.5, but still shows what was entered
+        self.assertEqual(spreadsheet.upload_csv_delta(self.write_csv(rows), "Data"), 0)
+
+        rows[1][1] = "two"
+        rows.append(["d"])
+        self.assertEqual(spreadsheet.upload_csv_delta(self.write_csv(rows), "Data"), 2)
+        self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"), rows)
+
+        self.assertEqual(spreadsheet.upload_csv_delta(self.write_csv(rows[:1]), "Data"), 0)
+        self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"), rows[:1])
+
+    def test_delta_of_empty_csv(self) -> None:
+        spreadsheet = self.spreadsheet(Data=[["a", "b"], ["c", "d"]])
+        # Only the cell that's left after shrinking the sheet needs to be cleared
+        self.assertEqual(spreadsheet.upload_csv_delta(self.write_csv([]), "Data"), 1)
+        self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"), [])
+
+    def test_delta_with_snapshot(self) -> None:
+        spreadsheet = self.spreadsheet()
+        cache_dir = os.path.join(self.tmp.name, "snapshots")
+        rows = [["a", "b"], ["c", "d"]]
+        self.assertEqual(spreadsheet.upload_csv_delta(self.write_csv(rows), "Data", cache_dir=cache_dir), 4)
+
+        self.emulator.requests.clear()
+        rows[0][0] = "changed"
+        self.assertEqual(spreadsheet.upload_csv_delta(self.write_csv(rows), "Data", cache_dir=cache_dir), 1)
+        self.assertNotIn("sheets.values.batchGet", self.emulator.requests)
+        self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"), rows)
+
+class AppenderTest(SheetsTestCase):
+    def test_appends_in_batches(self) -> None:
+        spreadsheet = self.spreadsheet(Data=[["header"]])
+        with SheetAppender(spreadsheet, "Data", max_rows=3, interval=None) as appender:
+            for i in range(7):
+                appender.append([str(i)])
+            self.assertEqual(appender.rows_appended, 6)
+        self.assertEqual(appender.rows_appended, 7)
+        self.assertEqual(self.emulator.requests["sheets.values.append"], 3)
+        self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"),
+                         [["header"]] + [[str(i)] for i in range(7)])
+
+    def test_keeps_order_of_each_thread(self) -> None:
+        spreadsheet = self.spreadsheet(Data=[])
+        with SheetAppender(spreadsheet, "Data", max_rows=10, interval=None) as appender:
+            def produce(name : str) -> None:
+                for i in range(50):
+                    appender.append([name, str(i)])
+            threads = [threading.Thread(target=produce, args=(str(n),)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        values = self.emulator.sheets.values(spreadsheet.file_id, "Data")
+        self.assertEqual(len(values), 200)
+        for n in range(4):
+            self.assertEqual([int(row[1]) for row in values if row[0] == str(n)], list(range(50)))
+
+    def test_flushes_after_interval(self) -> None:
+        spreadsheet = self.spreadsheet(Data=[])
+        with SheetAppender(spreadsheet, "Data", interval=0.05) as appender:
+            appender.append(["late"])
+            deadline = time.monotonic() + 5
+            while appender.rows_appended == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.emulator.sheets.values(spreadsheet.file_id, "Data"), [["late"]])
+
+    def test_reports_failures(self) -> None:
+        appender = SheetAppender(self.spreadsheet(), "Missing", max_rows=1, interval=None)
+        with self.assertRaises(HttpError):
+            appender.append(["a"])
+        # The rows are kept for another try
+        with self.assertRaises(HttpError):
+            appender.close()
+        with self.assertRaises(RuntimeError):
+            appender.append(["b"])
+
+class ExportTest(SheetsTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        backend = self.emulator.drive
+        reports = backend.mkdir("Reports")["id"]
+        year = backend.mkdir("2026", reports)["id"]
+        backend.add("notes.txt", reports, content=b"not a spreadsheet")
+        self.emulator.sheets.create("Sales", reports, sheets={"Q1/Q2": [["a", "1"]], "CON": [["b"]]})
+        self.emulator.sheets.create("Costs", year, sheets={"Sheet1": [["c", "2"]]})
+        self.emulator.sheets.create("Broken", year, sheets={"Sheet1": [["d"]]})
+
+    def export(self, local : str) -> Tuple[Optional[TransferStats], str]:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            stats = export_spreadsheets(Drive(DRIVE_READONLY), self.sheets, "Reports/", local, workers=4)
+        return stats, out.getvalue()
+
+    def read(self, path : str) -> List[List[str]]:
+        with open(path, "r", encoding="utf-8", newline="") as fh:
+            return list(csv.reader(fh))
+
+    def test_exports_every_sheet(self) -> None:
+        local = os.path.join(self.tmp.name, "out")
+        stats, _out = self.export(local)
+        assert stats is not None
+        self.assertEqual((stats.files, stats.failed), (4, 0))
+        self.assertEqual(sorted(os.listdir(os.path.join(local, "Sales"))), ["Q1_Q2.csv", "_CON.csv"])
+        self.assertEqual(self.read(os.path.join(local, "Sales", "Q1_Q2.csv")), [["a", "1"]])
+        self.assertEqual(self.read(os.path.join(local, "2026", "Costs", "Sheet1.csv")), [["c", "2"]])
+        self.assertFalse(os.path.exists(os.path.join(local, "notes.txt")))
+
+    def test_failing_workbook_is_skipped(self) -> None:
+        local = os.path.join(self.tmp.name, "out")
+        os.makedirs(os.path.join(local, "2026"))
+        # Takes the place of the workbook's folder
+        with open(os.path.join(local, "2026", "Broken"), "w", encoding="utf-8") as fh:
+            fh.write("in the way")
+
+        stats, out = self.export(local)
+        assert stats is not None
+        self.assertEqual((stats.files, stats.failed), (3, 1))
+        self.assertIn("Failed to export /Reports/2026/Broken", out)
+        self.assertEqual(self.read(os.path.join(local, "2026", "Costs", "Sheet1.csv")), [["c", "2"]])
+
+    def test_missing_folder(self) -> None:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertIsNone(export_spreadsheets(Drive(DRIVE_READONLY), self.sheets, "/Missing", self.tmp.name))
+        self.assertIn("no folder", out.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()
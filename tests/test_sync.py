@@ -0,0 +1,146 @@
+"""Tests that syncs in both directions only transfer what changed, against the emulator."""
+
+import os
+import io
+import unittest
+import contextlib
+from typing import Dict
+from gdrive_lib.drive.drive import Drive
+from gdrive_lib.drive.drive_api import DRIVE_FULL
+from gdrive_lib.drive.sync import DELETE, DOWNLOAD, MANIFEST_NAME, TRASH_DIR, UPDATE, UPLOAD, Manifest, Sync
+from emulated import EmulatorTestCase
+
+class SyncTestCase(EmulatorTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.local = os.path.join(self.tmp.name, "local")
+
+    def sync(self, remote_dir : str, upload : bool = False, delete : bool = False) -> Sync:
+        # A new client each time, like separate runs of the command
+        return Sync(Drive(DRIVE_FULL), remote_dir, self.local, upload=upload, delete=delete, workers=4)
+
+    def actions(self, sync : Sync) -> Dict[str, str]:
+        plan = sync.plan()
+        assert plan is not None
+        return {action.rel: action.kind for action in plan.actions}
+
+    def run_sync(self, sync : Sync) -> None:
+        plan = sync.plan()
+        assert plan is not None
+        stats = sync.run(plan)
+        self.assertEqual(stats.failed, 0)
+
+    def write(self, rel : str, content : str) -> None:
+        path = os.path.join(self.local, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(content)
+
+    def read(self, rel : str) -> str:
+        with open(os.path.join(self.local, rel), "r", encoding="utf-8") as fh:
+            return fh.read()
+
+class DownloadSyncTest(SyncTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        backend = self.emulator.drive
+        docs = backend.mkdir("docs")["id"]
+        self.a = backend.add("a.txt", docs, content=b"a")["id"]
+        sub = backend.mkdir("sub", docs)["id"]
+        self.c = backend.add("c.txt", sub, content=b"c")["id"]
+
+    def test_only_changes_are_downloaded(self) -> None:
+        sync = self.sync("docs/")
+        self.assertEqual(self.actions(sync), {"a.txt": DOWNLOAD, os.path.join("sub", "c.txt"): DOWNLOAD})
+        self.run_sync(sync)
+        self.assertEqual((self.read("a.txt"), self.read(os.path.join("sub", "c.txt"))), ("a", "c"))
+        self.assertEqual(sorted(Manifest(self.local).entries.keys()), ["a.txt", os.path.join("sub", "c.txt")])
+
+        self.assertEqual(self.actions(self.sync("/docs")), {})
+        self.emulator.drive.set_content(self.a, b"changed")
+        sync = self.sync("/docs")
+        self.assertEqual(self.actions(sync), {"a.txt": DOWNLOAD})
+        self.run_sync(sync)
+        self.assertEqual(self.read("a.txt"), "changed")
+
+    def test_deleted_files_go_to_the_local_trash(self) -> None:
+        self.run_sync(self.sync("/docs"))
+        self.emulator.drive.files[self.c]["trashed"] = True
+
+        self.assertEqual(self.actions(self.sync("/docs")), {})
+        sync = self.sync("/docs", delete=True)
+        self.assertEqual(self.actions(sync), {os.path.join("sub", "c.txt"): DELETE})
+        self.run_sync(sync)
+        self.assertFalse(os.path.exists(os.path.join(self.local, "sub", "c.txt")))
+        self.assertEqual(self.read(os.path.join(TRASH_DIR, "sub", "c.txt")), "c")
+        self.assertNotIn(os.path.join("sub", "c.txt"), Manifest(self.local).entries)
+
+    def test_identical_files_are_adopted(self) -> None:
+        self.write("a.txt", "a")
+        plan = self.sync("/docs").plan()
+        assert plan is not None
+        self.assertEqual([rel for rel, _f in plan.adopted], ["a.txt"])
+        self.assertEqual([action.rel for action in plan.actions], [os.path.join("sub", "c.txt")])
+
+    def test_failed_download_is_not_recorded(self) -> None:
+        sync = self.sync("/docs")
+        plan = sync.plan()
+        assert plan is not None
+        # Gone between planning and transferring
+        self.emulator.drive.delete_file(self.c)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = sync.run(plan)
+        self.assertEqual((stats.files, stats.failed), (1, 1))
+        self.assertEqual(list(Manifest(self.local).entries.keys()), ["a.txt"])
+
+    def test_missing_folder(self) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(self.sync("/missing").plan())
+
+class UploadSyncTest(SyncTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.write("a.txt", "a")
+        self.write(os.path.join("sub", "c.txt"), "c")
+
+    def content(self, path : str) -> bytes:
+        f = Drive(DRIVE_FULL).resolve(path)
+        assert f is not None
+        return self.emulator.drive.contents[f.id]
+
+    def test_only_changes_are_uploaded(self) -> None:
+        sync = self.sync("backup/up", upload=True)
+        self.assertEqual(self.actions(sync), {"a.txt": UPLOAD, os.path.join("sub", "c.txt"): UPLOAD})
+        self.run_sync(sync)
+        self.assertEqual(self.content("/backup/up/sub/c.txt"), b"c")
+        self.assertTrue(os.path.exists(os.path.join(self.local, MANIFEST_NAME)))
+
+        self.assertEqual(self.actions(self.sync("/backup/up/", upload=True)), {})
+        self.write("a.txt", "changed")
+        sync = self.sync("/backup/up", upload=True)
+        self.assertEqual(self.actions(sync), {"a.txt": UPDATE})
+        self.run_sync(sync)
+        self.assertEqual(self.content("/backup/up/a.txt"), b"changed")
+        self.assertEqual(len(Drive(DRIVE_FULL).ls("/backup/up")), 2)
+
+    def test_deleted_files_go_to_the_drive_trash(self) -> None:
+        self.run_sync(self.sync("/backup", upload=True))
+        os.remove(os.path.join(self.local, "a.txt"))
+
+        sync = self.sync("/backup", upload=True, delete=True)
+        self.assertEqual(self.actions(sync), {"a.txt": DELETE})
+        self.run_sync(sync)
+        self.assertEqual([f.path for f in Drive(DRIVE_FULL).ls("/backup")], ["/backup/sub"])
+        self.assertEqual(list(Manifest(self.local).entries.keys()), [os.path.join("sub", "c.txt")])
+
+    def test_refuses_to_delete_everything(self) -> None:
+        self.run_sync(self.sync("/backup", upload=True))
+        os.remove(os.path.join(self.local, "a.txt"))
+        os.remove(os.path.join(self.local, "sub", "c.txt"))
+
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertIsNone(self.sync("/backup", upload=True, delete=True).plan())
+        self.assertIn("Refusing", out.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()
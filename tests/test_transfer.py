@@ -0,0 +1,126 @@
+"""Tests ranged, resumable downloads and chunked, resumable uploads against the emulator."""
+
+import os
+import stat
+import unittest
+from typing import List
+from unittest import mock
+from gdrive_lib.drive.drive import Drive
+from gdrive_lib.drive.drive_api import DRIVE_FULL
+from gdrive_lib.drive.transfer import CHECKPOINT_SUFFIX, PARTIAL_SUFFIX, DownloadCheckpoint
+from emulated import EmulatorTestCase
+
+CHUNK = 256 * 1024
+SIZE = 4 * CHUNK
+
+class Interrupted(Exception):
+    pass
+
+class TransferTestCase(EmulatorTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        # Small enough that a file of a few chunks takes the ranged and resumable paths
+        for target, value in [("gdrive_lib.drive.drive.RANGE_CHUNK_SIZE", CHUNK // 4),
+                              ("gdrive_lib.drive.transfer.RANGE_CHUNK_SIZE", CHUNK // 4),
+                              ("gdrive_lib.drive.drive.RESUMABLE_THRESHOLD", CHUNK)]:
+            patch = mock.patch(target, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.content = os.urandom(SIZE)
+
+    def path(self, name : str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def read(self, name : str) -> bytes:
+        with open(self.path(name), "rb") as fh:
+            return fh.read()
+
+class DownloadTest(TransferTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.file = self.emulator.drive.add("big.bin", "root", content=self.content)
+
+    def test_download_in_parallel_ranges(self) -> None:
+        self.assertEqual(Drive(DRIVE_FULL).download("big.bin", self.path("big.bin"), workers=4, part_size=CHUNK), SIZE)
+        self.assertEqual(self.read("big.bin"), self.content)
+        self.assertEqual(self.emulator.requests["drive.files.get_media"], SIZE // (CHUNK // 4))
+        self.assertFalse(os.path.exists(self.path("big.bin") + PARTIAL_SUFFIX))
+        self.assertFalse(os.path.exists(self.path("big.bin") + CHECKPOINT_SUFFIX))
+
+    def test_download_continues_from_checkpoint(self) -> None:
+        local = self.path("big.bin")
+        checkpoint = DownloadCheckpoint.start(local, self.file["id"], self.file["md5Checksum"], SIZE, SIZE)
+        with open(local + PARTIAL_SUFFIX, "r+b") as fh:
+            fh.write(self.content[:CHUNK])
+        checkpoint.received(0, CHUNK)
+
+        self.assertEqual(Drive(DRIVE_FULL).download("/big.bin", local), SIZE - CHUNK)
+        self.assertEqual(self.read("big.bin"), self.content)
+        self.assertEqual(self.emulator.requests["drive.files.get_media"], (SIZE - CHUNK) // (CHUNK // 4))
+        self.assertFalse(os.path.exists(local + PARTIAL_SUFFIX))
+        self.assertFalse(os.path.exists(local + CHECKPOINT_SUFFIX))
+
+    def test_changed_file_starts_over(self) -> None:
+        local = self.path("big.bin")
+        checkpoint = DownloadCheckpoint.start(local, self.file["id"], "older version", SIZE, SIZE)
+        checkpoint.received(0, CHUNK)
+
+        self.assertEqual(Drive(DRIVE_FULL).download("/big.bin", local), SIZE)
+        self.assertEqual(self.read("big.bin"), self.content)
+
+class UploadTest(TransferTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        with open(self.path("big.bin"), "wb") as fh:
+            fh.write(self.content)
+
+    def uploaded(self, path : str) -> bytes:
+        f = Drive(DRIVE_FULL).resolve(path)
+        assert f is not None
+        return self.emulator.drive.contents[f.id]
+
+    def sessions(self) -> List[str]:
+        session_dir = os.path.join(self.tmp.name, "gdrive-lib", "uploads")
+        return [os.path.join(session_dir, name) for name in os.listdir(session_dir)] if os.path.isdir(session_dir) else []
+
+    def test_upload_in_chunks(self) -> None:
+        progress = []
+        f = Drive(DRIVE_FULL).upload(self.path("big.bin"), "/big.bin", chunk_size=CHUNK,
+                                     progress=lambda sent, total: progress.append((sent, total)))
+        assert f is not None
+        self.assertEqual(f.size, SIZE)
+        self.assertEqual(self.uploaded("/big.bin"), self.content)
+        self.assertEqual(self.emulator.requests["drive.upload.chunk"], SIZE // CHUNK)
+        self.assertEqual(progress[-1], (SIZE, SIZE))
+        self.assertEqual(self.sessions(), [])
+
+    def test_interrupted_upload_continues(self) -> None:
+        def interrupt(_sent : int, _total : int) -> None:
+            raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            Drive(DRIVE_FULL).upload(self.path("big.bin"), "/big.bin", chunk_size=CHUNK, progress=interrupt)
+        sessions = self.sessions()
+        self.assertEqual(len(sessions), 1)
+        # Anyone who knows the session URI could upload to it
+        self.assertEqual(stat.S_IMODE(os.stat(sessions[0]).st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(sessions[0])).st_mode), 0o700)
+
+        self.emulator.requests.clear()
+        f = Drive(DRIVE_FULL).upload(self.path("big.bin"), "/big.bin", chunk_size=CHUNK)
+        assert f is not None
+        self.assertEqual(self.uploaded("/big.bin"), self.content)
+        # One request asks for the offset, and only the remaining chunks are sent
+        self.assertEqual(self.emulator.requests["drive.upload.chunk"], 1 + SIZE // CHUNK - 1)
+        self.assertNotIn("drive.upload", self.emulator.requests)
+        self.assertEqual(self.sessions(), [])
+
+    def test_update_in_chunks(self) -> None:
+        self.emulator.drive.add("big.bin", "root", content=b"old")
+        f = Drive(DRIVE_FULL).update(self.path("big.bin"), "/big.bin", chunk_size=CHUNK)
+        assert f is not None
+        self.assertEqual(self.uploaded("/big.bin"), self.content)
+        self.assertEqual(self.emulator.requests["drive.upload.chunk"], SIZE // CHUNK)
+
+if __name__ == "__main__":
+    unittest.main()